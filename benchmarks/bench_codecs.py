@@ -0,0 +1,151 @@
+# Usage from the repository root:
+#   python benchmarks/bench_codecs.py --output baseline.json
+#   python benchmarks/bench_codecs.py --compare baseline.json --threshold 0.1
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+import PIL
+import bwtex
+from lib.texture_utils import (
+    generate_new_palettes_from_image,
+    PaletteFormat, IMAGE_FORMATS_THAT_USE_PALETTES, MAX_COLORS_FOR_IMAGE_FORMAT
+)
+from lib.codec_backends import BACKENDS, select_backend
+from benchmarks.synthetic import PATTERNS, make_image
+
+FORMATS = ("DXT1", "P8", "P4", "I4", "I8", "IA4", "IA8", "RGBA")
+SIZES = (64, 128, 256, 512, 1024)
+QUICK_SIZES = (64, 128)
+
+
+def best_time(func, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+
+def run_case(backend, fmt, pattern, size, repeat):
+    image_format = bwtex.FORMAT[fmt]
+    image = make_image(pattern, size)
+    pixels = size*size
+    results = {}
+
+    seconds, (image_data, palette_data, encoded_colors) = best_time(
+        lambda: backend.encode_image(image, image_format, PaletteFormat.RGB5A3), repeat)
+    results["encode/{0}/{1}/{2}".format(fmt, pattern, size)] = pixels/seconds/1000000
+
+    # Same padding as BW1Texture/BW2Texture.from_file
+    raw = image_data.getvalue()+b"\x00"*256*256
+    seconds, _ = best_time(
+        lambda: backend.decode_image(BytesIO(raw), palette_data, image_format, PaletteFormat.RGB5A3,
+                                     len(encoded_colors), size, size), repeat)
+    results["decode/{0}/{1}/{2}".format(fmt, pattern, size)] = pixels/seconds/1000000
+
+    if image_format in IMAGE_FORMATS_THAT_USE_PALETTES:
+        quantized = image.quantize(MAX_COLORS_FOR_IMAGE_FORMAT[image_format]).convert("RGBA")
+        seconds, _ = best_time(
+            lambda: generate_new_palettes_from_image(quantized, image_format, PaletteFormat.RGB5A3), repeat)
+        results["palette/{0}/{1}/{2}".format(fmt, pattern, size)] = pixels/seconds/1000000
+
+    return results
+
+
+def run(backend, formats, patterns, sizes, repeat):
+    results = {}
+    for size in sizes:
+        for fmt in formats:
+            for pattern in patterns:
+                case_results = run_case(backend, fmt, pattern, size, repeat)
+                for name, mpx in case_results.items():
+                    print("{0:<36} {1:>10.4f} MPixels/s".format(name, mpx))
+                results.update(case_results)
+    return results
+
+
+def compare(baseline, results, threshold):
+    regressions = []
+    print("{0:<36} {1:>10} {2:>10} {3:>8}".format("Case", "Baseline", "Current", "Change"))
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        change = (current - base)/base
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("{0:<36} {1:>10.4f} {2:>10.4f} {3:>+7.1%}{4}".format(name, base, current, change, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures encode, decode and palette generation throughput of the texture codecs.")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--patterns", nargs="+", default=PATTERNS, choices=PATTERNS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=None,
+                        help="Image sizes in pixels. Default: {0}".format(" ".join(str(x) for x in SIZES)))
+    parser.add_argument("--quick", action="store_true",
+                        help="Only run the small sizes ({0})".format(" ".join(str(x) for x in QUICK_SIZES)))
+    parser.add_argument("--backend", default=None, choices=list(BACKENDS),
+                        help="Codec backend to measure. Default: same as conv.py")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Run each case this many times and keep the best time. Default: 3")
+    parser.add_argument("--output", default=None,
+                        help="Write the results as a JSON baseline to this path.")
+    parser.add_argument("--compare", default=None,
+                        help="Compare against a JSON baseline written with --output.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown (as a fraction) above which a case counts as a regression. Default: 0.10")
+
+    args = parser.parse_args()
+
+    if args.sizes is not None:
+        sizes = args.sizes
+    elif args.quick:
+        sizes = QUICK_SIZES
+    else:
+        sizes = SIZES
+
+    backend = select_backend(args.backend)
+    print("Backend:", backend.name)
+    results = run(backend, args.formats, args.patterns, sizes, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "pillow": PIL.__version__,
+                    "numpy": numpy.__version__,
+                    "backend": backend.name,
+                    "repeat": args.repeat,
+                },
+                "results": results
+            }, f, indent=4, sort_keys=True)
+        print("Wrote baseline to", args.output)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print("{0} case(s) regressed by more than {1:.0%}".format(len(regressions), args.threshold))
+            sys.exit(1)
+        print("No regressions")
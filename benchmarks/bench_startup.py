@@ -0,0 +1,108 @@
+# Measures how long the command line tools take to start, in fresh processes.
+# Usage from the repository root:
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --repeat 20 --max-ms 100
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules that should only be imported when pixels are encoded or decoded
+HEAVY_MODULES = ("PIL", "numpy", "lib.texture_utils_numpy")
+
+HEADER_SCAN = """
+import sys
+import bwtex
+with open(sys.argv[1], "rb") as f:
+    header = f.read(bwtex.SNIFF_SIZE)
+print(bwtex.sniff_game(header), bwtex.get_texture_dimensions(header))
+"""
+
+REPORT_HEAVY_MODULES = """
+import sys
+import runpy
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+sys.stderr.write(",".join(m for m in {0!r} if m in sys.modules))
+""".format(HEAVY_MODULES)
+
+
+def make_texture(folder):
+    """Writes a small BW2 texture for the header scan."""
+    from PIL import Image
+    import bwtex
+    image_path = os.path.join(folder, "startup.png")
+    Image.new("RGBA", (64, 64), (255, 0, 0, 255)).save(image_path)
+    texture_path = os.path.join(folder, "startup.texture")
+    with contextlib.redirect_stdout(None):
+        tex = bwtex.BW2Texture.from_path(path=image_path, name="startup", fmt="DXT1")
+        with open(texture_path, "wb") as f:
+            tex.write(f)
+    return texture_path
+
+
+def get_cases(texture_path):
+    return [
+        ("python", ["-c", "pass"]),
+        ("import bwtex", ["-c", "import bwtex"]),
+        ("conv.py --help", [os.path.join(ROOT, "conv.py"), "--help"]),
+        ("massconvert.py --help", [os.path.join(ROOT, "massconvert.py"), "--help"]),
+        ("header scan", ["-c", HEADER_SCAN, texture_path]),
+    ]
+
+
+def time_command(args, repeat):
+    """Returns the fastest and the median wall time of running python with args, in milliseconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable]+args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start)*1000)
+    times.sort()
+    return times[0], times[len(times)//2]
+
+
+def get_heavy_modules(args):
+    if args[0] == "-c":
+        code = args[1]+"\nimport sys\nsys.stderr.write(','.join(m for m in {0!r} if m in sys.modules))".format(HEAVY_MODULES)
+        command = [sys.executable, "-c", code]+args[2:]
+    else:
+        command = [sys.executable, "-c", REPORT_HEAVY_MODULES]+args
+    result = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the start up time of conv.py, massconvert.py and reading a texture header.")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Start each command this many times. Default: 10")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Exit with an error if the median time of a command other than plain python is above this.")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        cases = get_cases(make_texture(folder))
+        print("{0:<24} {1:>9} {2:>9}  {3}".format("Command", "Best ms", "Median ms", "Heavy modules imported"))
+        too_slow = []
+        for name, command in cases:
+            best, median = time_command(command, args.repeat)
+            heavy = get_heavy_modules(command)
+            print("{0:<24} {1:>9.1f} {2:>9.1f}  {3}".format(name, best, median, heavy or "-"))
+            if args.max_ms is not None and name != "python" and median > args.max_ms:
+                too_slow.append(name)
+
+    if too_slow:
+        print("Slower than {0}ms: {1}".format(args.max_ms, ", ".join(too_slow)))
+        sys.exit(1)
@@ -0,0 +1,160 @@
+# Checks that every codec backend produces exactly the same bytes and pixels as the reference backend.
+# Usage from the repository root:
+#   python benchmarks/parity.py --iterations 2000
+#   python benchmarks/parity.py --backends reference numpy --seed 1234
+
+import os
+import sys
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+from PIL import Image
+from lib.texture_utils import ImageFormat, PaletteFormat
+from lib.codec_backends import BACKENDS, get_available_backends, select_backend
+
+IMAGE_KINDS = ("noise", "few_colors", "greyscale", "gradient", "flat")
+ALPHA_KINDS = ("opaque", "binary", "graded", "transparent")
+
+
+def random_image(rng, max_size):
+    width = rng.randint(1, max_size+1)
+    height = rng.randint(1, max_size+1)
+    kind = IMAGE_KINDS[rng.randint(len(IMAGE_KINDS))]
+    if kind == "noise":
+        pixels = rng.randint(0, 256, size=(height, width, 4))
+    elif kind == "few_colors":
+        colors = rng.randint(0, 256, size=(rng.randint(1, 20), 4))
+        pixels = colors[rng.randint(len(colors), size=(height, width))]
+    elif kind == "greyscale":
+        grey = rng.randint(0, 256, size=(height, width, 1))
+        pixels = numpy.concatenate([grey, grey, grey, rng.randint(0, 256, size=(height, width, 1))], axis=2)
+    elif kind == "gradient":
+        y, x = numpy.mgrid[0:height, 0:width]
+        pixels = numpy.stack([x*255//max(width-1, 1), y*255//max(height-1, 1), (x+y)*255//max(width+height-2, 1), x*0+255], axis=2)
+    else:
+        pixels = numpy.empty((height, width, 4), dtype=numpy.int64)
+        pixels[...] = rng.randint(0, 256, size=4)
+
+    alpha = ALPHA_KINDS[rng.randint(len(ALPHA_KINDS))]
+    if alpha == "opaque":
+        pixels[..., 3] = 255
+    elif alpha == "binary":
+        pixels[..., 3] = numpy.where(rng.randint(0, 2, size=(height, width)) == 1, 255, 0)
+    elif alpha == "transparent":
+        pixels[..., 3] = rng.randint(0, 20, size=(height, width))
+
+    image = Image.fromarray(pixels.astype(numpy.uint8), "RGBA")
+    if rng.randint(4) == 0:
+        # Images loaded from PNGs aren't always RGBA
+        image = image.convert("RGB")
+    return image, "{0}x{1} {2}/{3} {4}".format(width, height, kind, alpha, image.mode)
+
+
+def run_backend(name, func):
+    select_backend(name)
+    try:
+        return func()
+    except Exception as e:
+        return "raised " + type(e).__name__
+
+
+def check_case(backends, case, func_for_backend):
+    results = {}
+    for name in backends:
+        results[name] = run_backend(name, func_for_backend(name))
+    reference = results[backends[0]]
+    failures = []
+    for name in backends[1:]:
+        if results[name] != reference:
+            failures.append("{0}: {1} differs from {2}".format(case, name, backends[0]))
+    return failures, reference
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Encodes and decodes random images through every codec backend and compares the results byte for byte.")
+    parser.add_argument("--iterations", type=int, default=500,
+                        help="Number of random images. Every image is tested in every format. Default: 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-size", type=int, default=48,
+                        help="Maximum width and height of the random images. Default: 48")
+    parser.add_argument("--backends", nargs="+", default=None, choices=list(BACKENDS),
+                        help="Backends to compare. The first one is the reference. Default: all available, reference first.")
+    parser.add_argument("--formats", nargs="+", default=[fmt.name for fmt in ImageFormat],
+                        choices=[fmt.name for fmt in ImageFormat])
+    parser.add_argument("--max-failures", type=int, default=20,
+                        help="Stop after this many mismatches. Default: 20")
+
+    args = parser.parse_args()
+
+    backends = args.backends
+    if backends is None:
+        backends = ["reference"] + [name for name in get_available_backends() if name != "reference"]
+    if len(backends) < 2:
+        print("Need at least two available backends to compare, got:", ", ".join(backends))
+        sys.exit(1)
+    print("Comparing backends:", ", ".join(backends))
+
+    image_formats = [ImageFormat[name] for name in args.formats]
+    failures = []
+    cases = 0
+    for iteration in range(args.iterations):
+        seed = args.seed + iteration
+        rng = numpy.random.RandomState(seed)
+        image, description = random_image(rng, args.max_size)
+
+        for image_format in image_formats:
+            palette_format = PaletteFormat(rng.randint(3))
+            mipmap_count = 2 if image.width >= 2 and image.height >= 2 and rng.randint(4) == 0 else 1
+            case = "seed {0} {1} {2} {3} mips={4}".format(seed, description, image_format.name, palette_format.name, mipmap_count)
+
+            def encode_for(name):
+                def run():
+                    backend = BACKENDS[name]
+                    image_data, palette_data, encoded_colors = backend.encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
+                    return (bytes(image_data.getbuffer()), bytes(palette_data.getbuffer()), list(encoded_colors))
+                return run
+            case_failures, encoded = check_case(backends, "encode " + case, encode_for)
+            failures += case_failures
+            cases += 1
+
+            if isinstance(encoded, str):
+                # The reference couldn't encode it either, nothing to decode
+                continue
+
+            # Decode the reference's output, and random garbage of the same size
+            image_data, palette_data, encoded_colors = encoded
+            garbage = rng.randint(0, 256, size=len(image_data)).astype(numpy.uint8).tobytes()
+            for kind, data in (("encoded", image_data), ("random", garbage)):
+                def decode_for(name):
+                    def run():
+                        backend = BACKENDS[name]
+                        decoded = backend.decode_image(
+                            BytesIO(data+b"\x00"*256*256), BytesIO(palette_data), image_format, palette_format,
+                            len(encoded_colors), image.width, image.height)
+                        return decoded.tobytes()
+                    return run
+                case_failures, _ = check_case(backends, "decode {0} {1}".format(kind, case), decode_for)
+                failures += case_failures
+                cases += 1
+
+            if len(failures) >= args.max_failures:
+                break
+        if len(failures) >= args.max_failures:
+            break
+
+        if (iteration+1) % 50 == 0:
+            print("{0}/{1} images, {2} cases, {3} mismatches".format(iteration+1, args.iterations, cases, len(failures)))
+
+    for failure in failures:
+        print("MISMATCH", failure)
+    print("{0} cases, {1} mismatches".format(cases, len(failures)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Checks that the perceptual hash keeps texture-like images close to their copies in the lossy
+# texture formats and far from each other, at the distance texindex.py's similar command uses.
+# Usage from the repository root:
+#   python benchmarks/phash_check.py
+#   python benchmarks/phash_check.py --images 30 --formats P4 P8 --verbose
+
+import os
+import sys
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+from PIL import Image
+import bwtex
+from lib.perceptual_hash import perceptual_hash, hamming_distance
+from texindex import DEFAULT_SIMILAR_DISTANCE
+
+KINDS = ("terrain", "bricks", "shapes")
+FORMATS = ("DXT1", "P8", "P4")
+
+
+def value_noise(rng, size, scales):
+    """Smooth noise of 0-1 values, the sum of random grids of each scale x scale values scaled up."""
+    noise = numpy.zeros((size, size))
+    for scale in scales:
+        grid = Image.fromarray((rng.rand(scale, scale)*255).astype(numpy.uint8))
+        noise += numpy.asarray(grid.resize((size, size), Image.BICUBIC), dtype=numpy.float64)/scale
+    return noise/noise.max()
+
+
+def to_image(colors):
+    pixels = numpy.empty(colors.shape[:2] + (4,), dtype=numpy.uint8)
+    pixels[..., :3] = numpy.clip(colors, 0, 255)
+    pixels[..., 3] = 255
+    return Image.fromarray(pixels, "RGBA")
+
+
+def terrain(size, rng):
+    # Two colors blended by large scale noise and shaded by finer noise, like grass or rock
+    color_1, color_2 = rng.randint(0, 256, size=(2, 3))
+    mix = value_noise(rng, size, (4, 8, 16, 32))[..., numpy.newaxis]
+    light = 0.6 + 0.4*value_noise(rng, size, (16, 32, 64))[..., numpy.newaxis]
+    return to_image((color_1*mix + color_2*(1-mix))*light)
+
+
+def bricks(size, rng):
+    y, x = numpy.mgrid[0:size, 0:size]
+    brick_height, brick_width = size//8, size//4
+    row = y//brick_height
+    shifted_x = x + (row % 2)*brick_width//2
+    tints = 0.8 + 0.4*rng.rand(13)
+    colors = rng.randint(60, 200, size=3)*tints[(row*7 + shifted_x//brick_width) % 13][..., numpy.newaxis]
+    colors = colors*(0.85 + 0.3*value_noise(rng, size, (32, 64))[..., numpy.newaxis])
+    colors[((y % brick_height) < 2) | ((shifted_x % brick_width) < 2)] = 180
+    return to_image(colors)
+
+
+def shapes(size, rng):
+    # Flat colored circles on a flat background with a light gradient, like UI elements or decals
+    y, x = numpy.mgrid[0:size, 0:size]
+    colors = numpy.empty((size, size, 3))
+    colors[...] = rng.randint(0, 256, size=3)
+    for i in range(6):
+        center_x, center_y, diameter = rng.rand(3)*size
+        colors[(x-center_x)**2 + (y-center_y)**2 < (diameter/2)**2] = rng.randint(0, 256, size=3)
+    return to_image(colors*(0.6 + 0.4*x/size)[..., numpy.newaxis])
+
+
+GENERATORS = {
+    "terrain": terrain,
+    "bricks": bricks,
+    "shapes": shapes,
+}
+
+
+def round_trip(image, fmt):
+    return bwtex.decode_texture(bwtex.encode_texture(image, "bw2", fmt)).to_image(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=("Hashes texture-like images and their copies encoded in lossy formats and checks that every copy "
+                     "is within the distance of its image and every other image is not."))
+    parser.add_argument("--images", type=int, default=10,
+                        help="Number of images of each kind. Default: 10")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=128,
+                        help="Width and height of the images. Default: 128")
+    parser.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=sorted(bwtex.STRTOFORMAT))
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_SIMILAR_DISTANCE,
+                        help="Distance up to which images count as similar. Default: {0}".format(DEFAULT_SIMILAR_DISTANCE))
+    parser.add_argument("--verbose", action='store_true',
+                        help="Print the distance of every copy.")
+    args = parser.parse_args()
+
+    hashes = []
+    failures = []
+    distances = {}
+    for kind in args.kinds:
+        for i in range(args.images):
+            seed = args.seed + i
+            image = GENERATORS[kind](args.size, numpy.random.RandomState(seed))
+            value = perceptual_hash(image)
+            hashes.append(("{0} seed {1}".format(kind, seed), value))
+
+            for fmt in args.formats:
+                distance = hamming_distance(value, perceptual_hash(round_trip(image, fmt)))
+                distances.setdefault((kind, fmt), []).append(distance)
+                if args.verbose:
+                    print("{0} seed {1} {2}: {3}".format(kind, seed, fmt, distance))
+                if distance > args.max_distance:
+                    failures.append("{0} seed {1} in {2} is {3} bits from the image".format(kind, seed, fmt, distance))
+
+    for (kind, fmt), values in distances.items():
+        print("{0:<8} {1:<5} copies: max {2:2} mean {3:5.2f}".format(kind, fmt, max(values), numpy.mean(values)))
+
+    unrelated = []
+    for (case_1, hash_1), (case_2, hash_2) in itertools.combinations(hashes, 2):
+        distance = hamming_distance(hash_1, hash_2)
+        unrelated.append(distance)
+        if distance <= args.max_distance:
+            failures.append("{0} and {1} are only {2} bits apart".format(case_1, case_2, distance))
+    if unrelated:
+        print("Different images: min {0} mean {1:.2f}".format(min(unrelated), numpy.mean(unrelated)))
+
+    for failure in failures:
+        print("FAILED", failure)
+    print("{0} copies, {1} pairs of different images, {2} failures".format(
+        sum(len(values) for values in distances.values()), len(unrelated), len(failures)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
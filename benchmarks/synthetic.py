@@ -0,0 +1,62 @@
+# Deterministic test images for the benchmarks.
+# Every generator only depends on its size and seed so results are comparable across machines and runs.
+import numpy
+from PIL import Image
+
+PATTERNS = ("gradient", "noise", "flat", "alpha_edges")
+
+
+def gradient(width, height, seed=0):
+    x = numpy.linspace(0, 255, width, dtype=numpy.float64)[numpy.newaxis, :]
+    y = numpy.linspace(0, 255, height, dtype=numpy.float64)[:, numpy.newaxis]
+    pixels = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    pixels[..., 0] = numpy.broadcast_to(x, (height, width))
+    pixels[..., 1] = numpy.broadcast_to(y, (height, width))
+    pixels[..., 2] = (x + y) / 2
+    pixels[..., 3] = 255
+    return Image.fromarray(pixels, "RGBA")
+
+
+def noise(width, height, seed=0):
+    rng = numpy.random.RandomState(seed)
+    pixels = rng.randint(0, 256, size=(height, width, 4), dtype=numpy.uint8)
+    pixels[..., 3] = 255
+    return Image.fromarray(pixels, "RGBA")
+
+
+def flat(width, height, seed=0):
+    # A few large single-colored regions, like UI elements or masks
+    rng = numpy.random.RandomState(seed)
+    colors = rng.randint(0, 256, size=(4, 4), dtype=numpy.uint8)
+    colors[:, 3] = 255
+    pixels = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    pixels[:height//2, :width//2] = colors[0]
+    pixels[:height//2, width//2:] = colors[1]
+    pixels[height//2:, :width//2] = colors[2]
+    pixels[height//2:, width//2:] = colors[3]
+    return Image.fromarray(pixels, "RGBA")
+
+
+def alpha_edges(width, height, seed=0):
+    # Opaque noise with a circular cutout that has a soft edge on one side and a hard edge on the other
+    image = numpy.asarray(noise(width, height, seed)).copy()
+    y, x = numpy.mgrid[0:height, 0:width]
+    distance = numpy.hypot((x - width/2) / (width/2), (y - height/2) / (height/2))
+    alpha = numpy.clip((1.0 - distance) * 4 * 255, 0, 255)
+    alpha[:, :width//2] = numpy.where(distance[:, :width//2] < 1.0, 255, 0)
+    image[..., 3] = alpha.astype(numpy.uint8)
+    return Image.fromarray(image, "RGBA")
+
+
+GENERATORS = {
+    "gradient": gradient,
+    "noise": noise,
+    "flat": flat,
+    "alpha_edges": alpha_edges,
+}
+
+
+def make_image(pattern, width, height=None, seed=0):
+    if height is None:
+        height = width
+    return GENERATORS[pattern](width, height, seed)
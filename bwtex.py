@@ -1,11 +1,27 @@
+import contextlib
+import contextvars
+from collections import namedtuple
+from io import SEEK_END
 from math import log2
-from PIL import Image
+from struct import unpack, Struct
 from lib.read_binary import *
 from lib.texture_utils import * 
+from lib.profiling import stage, profiled
+from lib.codec_backends import get_backend
 
 PALLETE = b"PAL "
 MIP = b"MIP "
 
+# Everything in front of the PAL and MIP sections, read and written in one go:
+# name, width, height, unkint1, unkint2, format, color format, unkint3 to unkint7, padding, mipmap count.
+# BW2 follows this with the width, height and mipmap count a second time.
+BW1_HEADER = Struct("<16sIIII8s8sIIIII12sI")
+BW2_HEADER = Struct(">32sIIII8s8sIIIII12sIIII")
+assert BW1_HEADER.size == 0x54 and BW2_HEADER.size == 0x70
+
+# PAL and MIP sections start with the reversed section id and the size of the data that follows
+SECTION_HEADER = Struct("<4sI")
+
 DXT1 = b"\x00\x00\x00\x001TXD"
 IA8 = b"\x00\x00\x00\x00\x008AI"
 IA4 = b"\x00\x00\x00\x00\x004AI"
@@ -67,6 +83,240 @@ FORMATDEFAULTSBW1 = {
     "RGBA": (20, 0, 255, 17, 1024, 0xFFFFFFFF),
 }
 
+# Largest root mean square error (0-255 per channel) that --format auto accepts
+DEFAULT_MAX_ERROR = 4.0
+
+
+def get_payload_size(fmt, width, height):
+    """Number of bytes the PAL and MIP sections of the first mipmap take up in fmt."""
+    image_format = FORMAT[fmt]
+    size = 8 + get_num_blocks(image_format, width, height)*BLOCK_DATA_SIZES[image_format]
+    if fmt in ("P4", "P8"):
+        size += 8 + 512
+    return size
+
+
+def get_texture_memory(fmt, width, height, mipcount=1):
+    """Number of bytes of palette and pixel data of a texture in fmt with mipcount mipmaps: the
+    contents of its PAL and MIP sections without their section headers."""
+    image_format = FORMAT[fmt]
+    size = 512 if fmt in ("P4", "P8") else 0
+    for i in range(max(mipcount, 1)):
+        size += get_num_blocks(image_format, max(width >> i, 1), max(height >> i, 1))*BLOCK_DATA_SIZES[image_format]
+    return size
+
+
+def get_texture_file_size(game, fmt, width, height, mipmaps=1):
+    """Number of bytes of a texture file of game in fmt with mipmaps MIP sections: the header,
+    the section headers and get_texture_memory."""
+    header_size = BW1_HEADER.size if game == "bw1" else BW2_HEADER.size
+    sections = mipmaps + (1 if fmt in ("P4", "P8") else 0)
+    return header_size + 8*sections + get_texture_memory(fmt, width, height, mipmaps)
+
+
+def get_generated_mipmap_count(width, height):
+    """Number of mipmaps, the image included, that from_image makes with autogenmipmaps."""
+    if log2(width) % 1 != 0 or log2(height) % 1 != 0:
+        return 1
+    return max(int(log2(min(width, height))), 1)
+
+
+def choose_format(image, bw1=False, max_error=DEFAULT_MAX_ERROR):
+    """Picks the format with the smallest payload whose round trip error is at most max_error.
+    Of equally sized formats the one with the smallest error wins. Returns the format and the ImageAnalysis."""
+    if not NUMPY_INSTALLED:
+        raise RuntimeError("Choosing the format automatically requires numpy.")
+    from lib.texture_analysis import ImageAnalysis
+    
+    analysis = ImageAnalysis(image)
+    formats = FORMATDEFAULTSBW1 if bw1 else FORMATDEFAULTSBW2
+    by_size = {}
+    for fmt in formats:
+        by_size.setdefault(get_payload_size(fmt, analysis.width, analysis.height), []).append(fmt)
+    
+    for size in sorted(by_size):
+        passing = [fmt for fmt in by_size[size] if analysis.get_error(FORMAT[fmt]) <= max_error]
+        if passing:
+            return min(passing, key=lambda fmt: analysis.get_error(FORMAT[fmt])), analysis
+    
+    # Unreachable since RGBA is lossless
+    return "RGBA", analysis
+
+
+# True inside quiet(), which keeps the texture classes from printing
+_quiet = contextvars.ContextVar("bwtex_quiet", default=False)
+
+
+def log(*args):
+    """print for the progress and diagnostic messages of the texture classes."""
+    if not _quiet.get():
+        print(*args)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Keeps the texture classes from printing inside the with block."""
+    token = _quiet.set(True)
+    try:
+        yield
+    finally:
+        _quiet.reset(token)
+
+
+# Number of bytes sniff_game needs to see
+SNIFF_SIZE = 0x40
+
+
+def sniff_game(header):
+    """Guesses from the first SNIFF_SIZE bytes of a texture file which game it is from.
+    BW1 headers are little endian with a 0x10 byte name, a reversed format tag and A8R8G8B8,
+    BW2 headers are big endian with a 0x20 byte name, a forward format tag and 8B8G8R8A.
+    Returns "bw1", "bw2" or None if neither layout fits."""
+    bw1_score = 0
+    bw2_score = 0
+    
+    if len(header) >= 0x30:
+        unkint1, unkint2 = unpack("<II", header[0x18:0x20])
+        if unkint1 == 1: bw1_score += 1
+        if unkint2 in (4, 12, 20): bw1_score += 1
+        if bytes(reversed(header[0x20:0x28])) in FORMATTOSTR: bw1_score += 1
+        if header[0x28:0x30] == b"A8R8G8B8": bw1_score += 1
+    
+    if len(header) >= 0x40:
+        unkint1, unkint2 = unpack(">II", header[0x28:0x30])
+        if unkint1 == 1: bw2_score += 1
+        if unkint2 in (4100, 4108, 4116): bw2_score += 1
+        if header[0x30:0x38] in FORMATTOSTR: bw2_score += 1
+        if header[0x38:0x40] == b"8B8G8R8A": bw2_score += 1
+    
+    if bw1_score == bw2_score:
+        return None
+    elif bw1_score > bw2_score:
+        return "bw1"
+    else:
+        return "bw2"
+
+
+def get_texture_dimensions(header):
+    """Width and height of the first mipmap from the first SNIFF_SIZE bytes of a texture file, 
+    or None if the game can't be detected."""
+    game = sniff_game(header)
+    if game == "bw1":
+        return unpack("<II", header[0x10:0x18])
+    elif game == "bw2":
+        return unpack(">II", header[0x20:0x28])
+    return None
+
+
+def sniff_game_from_settings(string):
+    """Guesses the game from the header values in a PNG name as written by header_to_string, 
+    e.g. "MipMap.4100.255.255.1.1024.0". Returns "bw1", "bw2" or None."""
+    values = string.split(".")
+    if len(values) > 0 and values[0].lower() == "mipmap":
+        values.pop(0)
+    if len(values) < 6:
+        return None 
+    
+    if values[0] in ("4", "12", "20"):
+        return "bw1"
+    elif values[0] in ("4100", "4108", "4116"):
+        return "bw2"
+    return None
+
+
+def texture_class_for_game(game):
+    if game == "bw1":
+        return BW1Texture
+    elif game == "bw2":
+        return BW2Texture
+    raise RuntimeError("Unknown game: {0}".format(game))
+
+
+def detect_game(f):
+    """sniff_game for the texture at the current position of f, which is left where it was."""
+    start = f.tell()
+    game = sniff_game(f.read(SNIFF_SIZE))
+    f.seek(start)
+    if game is None:
+        raise RuntimeError("Not a BW1 or BW2 texture, cannot detect the game from the header.")
+    return game
+
+
+def read_texture(f, game=None, decode_mipmaps=True):
+    """Reads a BW1 or BW2 texture from f. If game is None it is detected from the header.
+    With decode_mipmaps=False only the raw data is read, see Texture.decode_mipmap."""
+    if game is None:
+        game = detect_game(f)
+    
+    return texture_class_for_game(game).from_file(f, decode_mipmaps)
+
+
+def read_texture_header(f, game=None):
+    """Reads only the header of a BW1 or BW2 texture from f and returns a TextureHeader.
+    If game is None it is detected from the header."""
+    if game is None:
+        game = detect_game(f)
+    
+    return texture_class_for_game(game).read_header(f)
+
+
+def rename_texture(data, name, game=None):
+    """Returns the texture file in data, a bytes-like object, with its name replaced by name.
+    If game is None it is detected from the header."""
+    if game is None:
+        game = sniff_game(data[:SNIFF_SIZE])
+        if game is None:
+            raise RuntimeError("Not a BW1 or BW2 texture, cannot detect the game from the header.")
+
+    # Same limits as in write
+    name_size, max_length = (0x10, 0x10) if game == "bw1" else (0x20, 0x20-1)
+    encoded_name = name.encode("ascii")
+    if len(encoded_name) > max_length:
+        raise ValueError("Texture name {0} is too long, {1} allows up to {2} characters".format(name, game.upper(), max_length))
+    return encoded_name.ljust(name_size, b"\x00") + bytes(data[name_size:])
+
+
+class TextureHeader(namedtuple("TextureHeader", "game name fmt width height mipcount unkint2 unkint3 unkint4 unkint5 unkint6 unkint7")):
+    """The values of a texture header without any pixel data, small enough to keep
+    for every texture of a game. width and height are those of the first mipmap."""
+    __slots__ = ()
+    
+    @property
+    def values(self):
+        """unkint2 to unkint7, as taken by from_path and encode_texture."""
+        return (self.unkint2, self.unkint3, self.unkint4, self.unkint5, self.unkint6, self.unkint7)
+
+
+def read_section_header(f):
+    """Returns the id and data size of the section at the current position of f."""
+    section, size = SECTION_HEADER.unpack(f.read(SECTION_HEADER.size))
+    return section[::-1], size
+
+
+def read_section_sizes(f):
+    """Number of MIP sections from the position of f to the end of the file and the bytes of data
+    in them and in the PAL section. Only the section headers are read, the data is skipped.
+    BW2 headers always say there is one mipmap, but write puts all of them in the file."""
+    position = f.tell()
+    end = f.seek(0, SEEK_END)
+    mipcount = 0
+    size = 0
+    while position + SECTION_HEADER.size <= end:
+        f.seek(position)
+        section, section_size = read_section_header(f)
+        if section == MIP:
+            mipcount += 1
+            size += section_size
+        elif section == PALLETE:
+            size += section_size
+        position += SECTION_HEADER.size + section_size
+    return mipcount, size
+
+
+def write_section_header(f, section, size):
+    f.write(SECTION_HEADER.pack(section[::-1], size))
+
+
 def valuerange_assertion(val, start, end):
     if not start <= val <= end:
         raise RuntimeError("Value needs to be in range of {0} to {1} but is {2}.")
@@ -76,6 +326,69 @@ class Texture(object):
     def __init__(self, name):
         self.name = name 
         
+        # Set to a texture read with from_file to reuse its encoded blocks where the image is unchanged
+        self.original = None
+    
+    def set_header(self, header):
+        """Takes over the format, size and header values of a TextureHeader."""
+        self.fmt = header.fmt
+        self.size_x = header.width
+        self.size_y = header.height
+        self.unkint2, self.unkint3, self.unkint4, self.unkint5, self.unkint6, self.unkint7 = header.values
+        
+    def encode_mipmap(self, i):
+        mipmap = self.mipmaps[i]
+        original = self.original
+        if original is not None and original.fmt == self.fmt and i < len(original.mipmap_data):
+            original_mip = original.mipmaps[i]
+            if original_mip.size == mipmap.size:
+                unchanged_blocks = get_unchanged_blocks(mipmap, original_mip, FORMAT[self.fmt])
+                if original.palette_data is not None:
+                    palette = BytesIO(original.palette_data)
+                    num_colors = len(original.palette_data)//2
+                else:
+                    palette = None
+                    num_colors = 0
+                result = encode_image_reusing_blocks(
+                            mipmap, FORMAT[self.fmt], PaletteFormat.RGB5A3, unchanged_blocks,
+                            BytesIO(original.mipmap_data[i]), palette, num_colors
+                            )
+                if result is not None:
+                    log("Reused {0} of {1} blocks from original".format(sum(unchanged_blocks), len(unchanged_blocks)))
+                    return result
+            log("Cannot reuse original for mipmap {0}, encoding all blocks".format(i))
+        
+        return get_backend().encode_image(mipmap, FORMAT[self.fmt], PaletteFormat.RGB5A3, mipmap_count=1)
+        
+    def decode_mipmap(self, i):
+        """Decodes mipmap i from the raw data read by from_file."""
+        if self.palette_data is not None:
+            palette = BytesIO(self.palette_data)
+            num_colors = len(self.palette_data)//2  # Max 16 for P4 and max 256 for P8
+        else:
+            palette = None
+            num_colors = 0
+        
+        imagedata = BytesIO(self.mipmap_data[i]+b"\x00"*256*256)
+        return get_backend().decode_image(
+                        imagedata, palette, FORMAT[self.fmt], PaletteFormat.RGB5A3, num_colors, 
+                        max(self.size_x//(2**i), 1), max(self.size_y//(2**i), 1)
+                        )
+    
+    def get_mipmap_index_for_size(self, max_width, max_height):
+        """Index of the smallest mipmap that is still at least as large as the first 
+        mipmap scaled down to fit into max_width x max_height."""
+        scale = min(max_width/self.size_x, max_height/self.size_y, 1.0)
+        width = int(self.size_x*scale)
+        height = int(self.size_y*scale)
+        
+        index = 0
+        for i in range(1, len(self.mipmap_data)):
+            if max(self.size_x//(2**i), 1) < width or max(self.size_y//(2**i), 1) < height:
+                break
+            index = i
+        return index
+        
     def dump_to_file(self, filepath):
         img = QImage(self.size_x, self.size_y, QImage.Format_ARGB32)
         rgbadata = self.rgba
@@ -110,6 +423,10 @@ class BW2Texture(Texture):
         
         self.mipmaps = []
         #self.mipmaps_decoded = []
+        
+        # Raw encoded data as read by from_file
+        self.mipmap_data = []
+        self.palette_data = None
     
     def header_to_string(self):
         unkint7 = self.unkint7 
@@ -140,7 +457,7 @@ class BW2Texture(Texture):
         if values[0] in (4, 12, 20):
             valmap = {4: 4100, 12: 4108, 20: 4116}
             new = valmap[values[0]]
-            print("BW1 values detected. Changing", values[0], "to", new)
+            log("BW1 values detected. Changing", values[0], "to", new)
             values[0] = new
             
         if values[0] not in (4100, 4108, 4116): raise RuntimeError("Unknown value for value 1: {0}. Needs to be 4, 12 or 20.".format(values[0]))
@@ -160,7 +477,17 @@ class BW2Texture(Texture):
             self.unkint7 = 0xFFFFFFFF
             
     @classmethod
+    @profiled("from_path")
     def from_path(cls, path, name, fmt, unkint2=None, unkint3=None, unkint4=None, unkint5=None, unkint6=None, unkint7=None, mipmaps=1, autogenmipmaps=False, mipmappaths = []):
+        from PIL import Image
+        with stage("load"):
+            img = Image.open(path)
+            img.load()
+        return cls.from_image(img, name, fmt, unkint2, unkint3, unkint4, unkint5, unkint6, unkint7, 
+                              autogenmipmaps=autogenmipmaps, mipmappaths=mipmappaths)
+    
+    @classmethod
+    def from_image(cls, img, name, fmt, unkint2=None, unkint3=None, unkint4=None, unkint5=None, unkint6=None, unkint7=None, autogenmipmaps=False, mipmappaths = []):
         if unkint2 is None: unkint2 = FORMATDEFAULTSBW2[fmt][0]
         if unkint3 is None: unkint3 = FORMATDEFAULTSBW2[fmt][1]
         if unkint4 is None: unkint4 = FORMATDEFAULTSBW2[fmt][2]
@@ -178,12 +505,12 @@ class BW2Texture(Texture):
         tex.unkint5 = unkint5
         tex.unkint6 = unkint6
         tex.unkint7 = unkint7
-        img = Image.open(path)
         tex.mipmaps.append(img)
         
         if autogenmipmaps:
+            from PIL import Image
             if log2(img.width) % 1 != 0 or log2(img.height) % 1 != 0:
-                print("Warning: Cannot generate mipmaps for non-power of 2 texture. Skipping mipmap generation.")
+                log("Warning: Cannot generate mipmaps for non-power of 2 texture. Skipping mipmap generation.")
             else:
                 mipmap_count = int(log2(min(img.width, img.height)))
                 mipmap_width = img.width 
@@ -193,155 +520,110 @@ class BW2Texture(Texture):
                     if i != 0:
                         mipmap_width //= 2
                         mipmap_height //= 2
-                        mipmap_image = img.resize((mipmap_width, mipmap_height), Image.NEAREST)
+                        with stage("resize", pixels=mipmap_width*mipmap_height):
+                            mipmap_image = img.resize((mipmap_width, mipmap_height), Image.NEAREST)
                         tex.mipmaps.append(mipmap_image)
         
         return tex
     
+    @profiled("write")
     def write(self, f):
-        start = f.tell()
-        print(self.name, len(self.name))
+        log(self.name, len(self.name))
         assert len(self.name) <= 0x20-1
-        f.write(self.name.encode("ascii"))
-        f.write(b"\x00"*(0x20 - f.tell()))
-        assert f.tell()-start == 0x20
         
         image = self.mipmaps[0]
-        write_uint32(f, image.width)
-        write_uint32(f, image.height)
-        write_uint32(f, self.unkint1)
-        write_uint32(f, self.unkint2)
-        f.write(STRTOFORMAT[self.fmt])
-        f.write(b"8B8G8R8A")
-        write_uint32(f, self.unkint3)
-        write_uint32(f, self.unkint4)
-        write_uint32(f, self.unkint5)
-        write_uint32(f, self.unkint6)
-        write_uint32(f, self.unkint7)
-        f.write(b"\x00"*12)
-        
         mipcount = 1 # len(self.mipmaps)
-        write_uint32(f, mipcount)
-        write_uint32(f, image.width)
-        write_uint32(f, image.height)
-        write_uint32(f, mipcount)
-        assert f.tell()-start == 0x70
-        
-        imgdata, palettedata, _ = encode_image(image, FORMAT[self.fmt], PaletteFormat.RGB5A3, mipmap_count=1)
+        f.write(BW2_HEADER.pack(
+            self.name.encode("ascii"), image.width, image.height, self.unkint1, self.unkint2,
+            STRTOFORMAT[self.fmt], b"8B8G8R8A",
+            self.unkint3, self.unkint4, self.unkint5, self.unkint6, self.unkint7, b"",
+            mipcount, image.width, image.height, mipcount
+        ))
+        
+        imgdata, palettedata, _ = self.encode_mipmap(0)
         if self.fmt in ("P4", "P8"):
-            write_id(f, PALLETE)
-            write_uint32_le(f, 512)
+            write_section_header(f, PALLETE, 512)
             f.write(palettedata.getbuffer())
             f.write(b"\x00"*(512-len(palettedata.getbuffer())))
         
-        write_id(f, MIP)
-        write_uint32_le(f, len(imgdata.getbuffer()))
-        f.write(imgdata.getbuffer())
+        with stage("file_write"):
+            write_section_header(f, MIP, len(imgdata.getbuffer()))
+            f.write(imgdata.getbuffer())
         
         if len(self.mipmaps) > 1:
-            for mipmap in self.mipmaps[1:]:
-                imgdata, palettedata, _ = encode_image(mipmap, FORMAT[self.fmt], PaletteFormat.RGB5A3, mipmap_count=1)
-                write_id(f, MIP)
-                write_uint32_le(f, len(imgdata.getbuffer()))
-                f.write(imgdata.getbuffer())
+            for i in range(1, len(self.mipmaps)):
+                imgdata, palettedata, _ = self.encode_mipmap(i)
+                with stage("file_write"):
+                    write_section_header(f, MIP, len(imgdata.getbuffer()))
+                    f.write(imgdata.getbuffer())
     
-    @classmethod 
-    def from_file(cls, f):
-        #f.seek(0)
-        start = f.tell()
-        name = f.read(0x20).rstrip(b"\x00").decode("ascii")
-        tex = cls(name)
-        
-        size_x2 = read_uint32(f)
-        size_y2 = read_uint32(f)
-        tex.unkint1 = read_uint32(f)
-        assert tex.unkint1 == 1
-        tex.unkint2 = read_uint32(f) 
-        assert tex.unkint2 in (4100, 4108, 4116)
-        
-        fmt = f.read(0x8)
+    @classmethod
+    def read_header(cls, f):
+        """Reads and checks the header at the current position of f and returns a TextureHeader.
+        f is left at the first section."""
+        (name, size_x2, size_y2, unkint1, unkint2, fmt, color_format,
+         unkint3, unkint4, unkint5, unkint6, unkint7, pad,
+         mipcount, size_x, size_y, mipcount2) = BW2_HEADER.unpack(f.read(BW2_HEADER.size))
+        
+        assert unkint1 == 1
+        assert unkint2 in (4100, 4108, 4116)
         assert fmt in (DXT1, IA8, IA4, I8, I4, P8, P4, RGBA)
-        tex.fmt = FORMATTOSTR[fmt]
-        color_format = f.read(0x8)
         assert color_format == b"8B8G8R8A"
-        
-        tex.unkint3 = read_uint32(f) 
-        assert tex.unkint3 <= 255
-        
-        tex.unkint4 = read_uint32(f)
-        assert tex.unkint4 <= 255
-        
-        
-        tex.unkint5 = read_uint32(f)
-        assert tex.unkint5 <= 255
-        
-        tex.unkint6 = read_uint32(f)
-        assert tex.unkint6 <= 1024
-        
-        tex.unkint7 = read_uint32(f)
-        assert 0 <= tex.unkint7 <= 25 or tex.unkint7 == 0xFFFFFFFF
-        pad = f.read(12) # between 0 and 25, or 0xFFFFFFFF
+        assert unkint3 <= 255
+        assert unkint4 <= 255
+        assert unkint5 <= 255
+        assert unkint6 <= 1024
+        assert 0 <= unkint7 <= 25 or unkint7 == 0xFFFFFFFF
         assert pad == b"\x00"*12
-        #tex.unkints = f.read(0x10)
-        
-        mipcount = read_uint32(f)
-        tex.size_x = read_uint32(f)
-        tex.size_y = read_uint32(f)
-        mipcount2 = read_uint32(f)
         
-        assert tex.size_x == size_x2
-        assert tex.size_y == size_y2
+        assert size_x == size_x2
+        assert size_y == size_y2
         assert mipcount == mipcount2
         assert mipcount >= 1
         
-        section = read_id(f)
-        #print(section)
-        size = read_uint32_le(f)
-        #print(name, tex.format)
+        return TextureHeader("bw2", name.rstrip(b"\x00").decode("ascii"), FORMATTOSTR[fmt], size_x, size_y, mipcount,
+                             unkint2, unkint3, unkint4, unkint5, unkint6, unkint7)
+    
+    @classmethod 
+    @profiled("from_file")
+    def from_file(cls, f, decode_mipmaps=True):
+        #f.seek(0)
+        header = cls.read_header(f)
+        tex = cls(header.name)
+        tex.set_header(header)
+        mipcount = header.mipcount
+        
+        section, size = read_section_header(f)
         if tex.fmt in ("P4", "P8"):
-            print(tex.fmt, section)
-            print(tex.name)
+            log(tex.fmt, section)
+            log(tex.name)
             assert section == PALLETE
-            palette = BytesIO(f.read(size))
-            num_colors = len(palette.getbuffer())//2  # Max 16 for P4 and max 256 for P8
-            section = read_id(f)
-            size = read_uint32_le(f)
+            tex.palette_data = f.read(size)
+            section, size = read_section_header(f)
             assert section == MIP
         else:
-            palette = None 
-            num_colors = 0
             assert section == MIP
         
         #tex.mipmaps.append(f.read(size))
-        print(section, hex(size))
-        print(hex(f.tell()))
-        imagedata = BytesIO(f.read(size)+b"\x00"*256*256)
+        log(section, hex(size))
+        log(hex(f.tell()))
+        with stage("read"):
+            tex.mipmap_data.append(f.read(size))
         
         #assert size == len(imagedata.getbuffer())
-        print(FORMAT[tex.fmt], hex(size), tex.size_x, tex.size_y)
-        mip = decode_image(
-                        imagedata, palette, FORMAT[tex.fmt], PaletteFormat.RGB5A3, num_colors, 
-                        tex.size_x, tex.size_y
-                        )
-        
-        tex.mipmaps.append(mip)
-        
+        log(FORMAT[tex.fmt], hex(size), tex.size_x, tex.size_y)
         if mipcount > 1:
             assert log2(tex.size_x) % 1 == 0 and log2(tex.size_y) % 1 == 0
         
         for i in range(mipcount-1):
-            section = read_id(f)
-            size = read_uint32_le(f)
+            section, size = read_section_header(f)
             assert section == MIP
-            imagedata = BytesIO(f.read(size)+b"\x00"*256*256)
-            mip_tex_x = max(tex.size_x//(2**(i+1)), 1)
-            mip_tex_y = max(tex.size_y//(2**(i+1)), 1)
-            #print(tex.size_x, mip_tex_x, tex.size_y, mip_tex_y)
-            mip = decode_image(
-                        imagedata, palette, FORMAT[tex.fmt], PaletteFormat.RGB5A3, num_colors, 
-                        mip_tex_x, mip_tex_y
-                        )
-            tex.mipmaps.append(mip)
+            with stage("read"):
+                tex.mipmap_data.append(f.read(size))
+        
+        if decode_mipmaps:
+            for i in range(len(tex.mipmap_data)):
+                tex.mipmaps.append(tex.decode_mipmap(i))
         return tex 
         
         
@@ -364,6 +646,10 @@ class BW1Texture(Texture):
         
         self.mipmaps = []
         #self.mipmaps_decoded = []
+        
+        # Raw encoded data as read by from_file
+        self.mipmap_data = []
+        self.palette_data = None
     
     def header_to_string(self):
         unkint7 = self.unkint7 
@@ -395,7 +681,7 @@ class BW1Texture(Texture):
         if values[0] in (4100, 4108, 4116):
             valmap = {4100: 4, 4108: 12, 4116: 20}
             new = valmap[values[0]]
-            print("BW2 values detected. Changing", values[0], "to", new)
+            log("BW2 values detected. Changing", values[0], "to", new)
             values[0] = new
             
         if values[0] not in (4, 12, 20): raise RuntimeError("Unknown value for value 1: {0}. Needs to be 4, 12 or 20.".format(values[0]))
@@ -416,7 +702,17 @@ class BW1Texture(Texture):
        
             
     @classmethod
+    @profiled("from_path")
     def from_path(cls, path, name, fmt, unkint2=None, unkint3=None, unkint4=None, unkint5=None, unkint6=None, unkint7=None, mipmaps=1, autogenmipmaps=False, mipmappaths = []):
+        from PIL import Image
+        with stage("load"):
+            img = Image.open(path)
+            img.load()
+        return cls.from_image(img, name, fmt, unkint2, unkint3, unkint4, unkint5, unkint6, unkint7, 
+                              autogenmipmaps=autogenmipmaps, mipmappaths=mipmappaths)
+    
+    @classmethod
+    def from_image(cls, img, name, fmt, unkint2=None, unkint3=None, unkint4=None, unkint5=None, unkint6=None, unkint7=None, autogenmipmaps=False, mipmappaths = []):
         if unkint2 is None: unkint2 = FORMATDEFAULTSBW1[fmt][0]
         if unkint3 is None: unkint3 = FORMATDEFAULTSBW1[fmt][1]
         if unkint4 is None: unkint4 = FORMATDEFAULTSBW1[fmt][2]
@@ -434,12 +730,12 @@ class BW1Texture(Texture):
         tex.unkint5 = unkint5
         tex.unkint6 = unkint6
         tex.unkint7 = unkint7
-        img = Image.open(path)
         tex.mipmaps.append(img)
         
         if autogenmipmaps:
+            from PIL import Image
             if log2(img.width) % 1 != 0 or log2(img.height) % 1 != 0:
-                print("Warning: Cannot generate mipmaps for non-power of 2 texture. Skipping mipmap generation.")
+                log("Warning: Cannot generate mipmaps for non-power of 2 texture. Skipping mipmap generation.")
             else:
                 mipmap_count = int(log2(min(img.width, img.height)))
                 mipmap_width = img.width 
@@ -449,136 +745,193 @@ class BW1Texture(Texture):
                     if i != 0:
                         mipmap_width //= 2
                         mipmap_height //= 2
-                        mipmap_image = img.resize((mipmap_width, mipmap_height), Image.NEAREST)
+                        with stage("resize", pixels=mipmap_width*mipmap_height):
+                            mipmap_image = img.resize((mipmap_width, mipmap_height), Image.NEAREST)
                         tex.mipmaps.append(mipmap_image)
         return tex
     
+    @profiled("write")
     def write(self, f):
-        start = f.tell()
-        print(self.name, len(self.name))
+        log(self.name, len(self.name))
         assert len(self.name) <= 0x10
-        f.write(self.name.encode("ascii"))
-        f.write(b"\x00"*(0x10 - len(self.name)))
-        assert f.tell()-start == 0x10
         
         image = self.mipmaps[0]
-        write_uint32_le(f, image.width)
-        write_uint32_le(f, image.height)
-        write_uint32_le(f, 1)
-        write_uint32_le(f, self.unkint2)
-        f.write(bytes(reversed(STRTOFORMAT[self.fmt])))
-        f.write(b"A8R8G8B8")
-        
-        write_uint32_le(f, self.unkint3)
-        write_uint32_le(f, self.unkint4)
-        write_uint32_le(f, self.unkint5)
-        write_uint32_le(f, self.unkint6)
-        write_uint32_le(f, self.unkint7)
-        f.write(b"\x00"*12)
-        
         mipcount = len(self.mipmaps)
-        write_uint32_le(f, mipcount)
-        assert f.tell()-start == 0x54
-        
-        imgdata, palettedata, _ = encode_image(image, FORMAT[self.fmt], PaletteFormat.RGB5A3, mipmap_count=1)
+        f.write(BW1_HEADER.pack(
+            self.name.encode("ascii"), image.width, image.height, 1, self.unkint2,
+            bytes(reversed(STRTOFORMAT[self.fmt])), b"A8R8G8B8",
+            self.unkint3, self.unkint4, self.unkint5, self.unkint6, self.unkint7, b"",
+            mipcount
+        ))
+        
+        imgdata, palettedata, _ = self.encode_mipmap(0)
         if self.fmt in ("P4", "P8"):
-            write_id(f, PALLETE)
-            write_uint32_le(f, 512)
+            write_section_header(f, PALLETE, 512)
             f.write(palettedata.getbuffer())
             f.write(b"\x00"*(512-len(palettedata.getbuffer())))
         
-        write_id(f, MIP)
-        write_uint32_le(f, len(imgdata.getbuffer()))
-        f.write(imgdata.getbuffer())
+        with stage("file_write"):
+            write_section_header(f, MIP, len(imgdata.getbuffer()))
+            f.write(imgdata.getbuffer())
         
         if len(self.mipmaps) > 1:
-            for mipmap in self.mipmaps[1:]:
-                imgdata, palettedata, _ = encode_image(mipmap, FORMAT[self.fmt], PaletteFormat.RGB5A3, mipmap_count=1)
-                write_id(f, MIP)
-                write_uint32_le(f, len(imgdata.getbuffer()))
-                f.write(imgdata.getbuffer())
+            for i in range(1, len(self.mipmaps)):
+                imgdata, palettedata, _ = self.encode_mipmap(i)
+                with stage("file_write"):
+                    write_section_header(f, MIP, len(imgdata.getbuffer()))
+                    f.write(imgdata.getbuffer())
                 
-    @classmethod 
-    def from_file(cls, f):
-        name = f.read(0x10).rstrip(b"\x00").decode("ascii")
-        tex = cls(name)
+    @classmethod
+    def read_header(cls, f):
+        """Reads and checks the header at the current position of f and returns a TextureHeader.
+        f is left at the first section."""
+        (name, size_x, size_y, unkint1, unkint2, fmt, outputformat,
+         unkint3, unkint4, unkint5, unkint6, unkint7, pad,
+         mipcount) = BW1_HEADER.unpack(f.read(BW1_HEADER.size))
+        
+        name = name.rstrip(b"\x00").decode("ascii")
         assert len(name) <= 0x10
-        tex.size_x = read_uint32_le(f)
-        tex.size_y = read_uint32_le(f)
-
-        tex.unkint1 = read_uint32_le(f)
-        assert tex.unkint1 == 1
-        tex.unkint2 = read_uint32_le(f)
-        assert tex.unkint2 in (4, 12, 20)
+        assert unkint1 == 1
+        assert unkint2 in (4, 12, 20)
         
-        fmt = bytes(reversed(f.read(0x8)))
+        fmt = bytes(reversed(fmt))
         assert fmt in FORMATTOSTR
-        tex.fmt = FORMATTOSTR[fmt]
-        
-        outputformat = f.read(0x8)
         assert outputformat == b"A8R8G8B8"
-        tex.unkint3 = read_uint32_le(f)
-        tex.unkint4 = read_uint32_le(f)
-        tex.unkint5 = read_uint32_le(f)
-        tex.unkint6 = read_uint32_le(f)
-        tex.unkint7 = read_uint32_le(f)
-        
-        assert tex.unkint3 <= 255 
-        assert tex.unkint4 <= 255
-        assert tex.unkint5 <= 255
-        assert tex.unkint6 <= 1024 
-        assert tex.unkint7 == 0xFFFFFFFF or 0 <= tex.unkint7 <= 25  # Only values up to 11 have been seen, using BW2 as limit
-        
-        pad = f.read(0xC)
+        
+        assert unkint3 <= 255 
+        assert unkint4 <= 255
+        assert unkint5 <= 255
+        assert unkint6 <= 1024 
+        assert unkint7 == 0xFFFFFFFF or 0 <= unkint7 <= 25  # Only values up to 11 have been seen, using BW2 as limit
         assert pad == b"\x00"*0xC
-        mipcount = read_uint32_le(f)
-        print(mipcount,"mips")
-        section = read_id(f)
+        
+        return TextureHeader("bw1", name, FORMATTOSTR[fmt], size_x, size_y, mipcount,
+                             unkint2, unkint3, unkint4, unkint5, unkint6, unkint7)
+    
+    @classmethod 
+    @profiled("from_file")
+    def from_file(cls, f, decode_mipmaps=True):
+        header = cls.read_header(f)
+        tex = cls(header.name)
+        tex.set_header(header)
+        mipcount = header.mipcount
+        log(mipcount,"mips")
+        section, size = read_section_header(f)
         assert section in (MIP, PALLETE)
-        #print(section)
-        size = read_uint32_le(f)
-        #print(name, tex.format)
         
         if tex.fmt in ("P4", "P8"):
             assert section == PALLETE
-            palette = BytesIO(f.read(size))
-            num_colors = len(palette.getbuffer())//2  # Max 16 for P4 and max 256 for P8
-            section = read_id(f)
-            size = read_uint32_le(f)
+            tex.palette_data = f.read(size)
+            section, size = read_section_header(f)
             assert section == MIP
         else:
-            palette = None 
-            num_colors = 0
             assert section == MIP
  
         #tex.mipmaps.append(f.read(size))
-        print(section, hex(size))
-        print(hex(f.tell()))
-        imagedata = BytesIO(f.read(size)+b"\x00"*256*256)
+        log(section, hex(size))
+        log(hex(f.tell()))
+        with stage("read"):
+            tex.mipmap_data.append(f.read(size))
         
         #assert size == len(imagedata.getbuffer())
         #print(FORMAT[tex.fmt], hex(size), tex.size_x, tex.size_y)
-        mip = decode_image(
-                        imagedata, palette, FORMAT[tex.fmt], PaletteFormat.RGB5A3, num_colors, 
-                        tex.size_x, tex.size_y
-                        )
-        
-        tex.mipmaps.append(mip)
-        
         if mipcount > 1:
             assert log2(tex.size_x) % 1 == 0 and log2(tex.size_y) % 1 == 0
         
         for i in range(mipcount-1):
-            section = read_id(f)
-            size = read_uint32_le(f)
+            section, size = read_section_header(f)
             assert section == MIP
-            imagedata = BytesIO(f.read(size)+b"\x00"*256*256)
-            mip_tex_x = max(tex.size_x//(2**(i+1)), 1)
-            mip_tex_y = max(tex.size_y//(2**(i+1)), 1)
-            #print(tex.size_x, mip_tex_x, tex.size_y, mip_tex_y)
-            mip = decode_image(
-                        imagedata, palette, FORMAT[tex.fmt], PaletteFormat.RGB5A3, num_colors, 
-                        mip_tex_x, mip_tex_y
-                        )
-            tex.mipmaps.append(mip)
-        return tex
\ No newline at end of file
+            with stage("read"):
+                tex.mipmap_data.append(f.read(size))
+        
+        if decode_mipmaps:
+            for i in range(len(tex.mipmap_data)):
+                tex.mipmaps.append(tex.decode_mipmap(i))
+        return tex
+
+# In memory API for using the converter as a library. Unlike the texture classes these never print.
+
+class TextureResult(object):
+    """A decoded texture. mipmaps holds the pixels of each mipmap as RGBA bytes, row by row,
+    in memoryviews; mipmap_sizes holds their widths and heights. header holds the values
+    unkint2 to unkint7 that encode_texture takes, header_string the same as header_to_string."""
+    def __init__(self, game, name, fmt, header, header_string, mipmaps, mipmap_sizes):
+        self.game = game
+        self.name = name
+        self.fmt = fmt
+        self.header = header
+        self.header_string = header_string
+        self.mipmaps = mipmaps
+        self.mipmap_sizes = mipmap_sizes
+
+    @property
+    def width(self):
+        return self.mipmap_sizes[0][0]
+
+    @property
+    def height(self):
+        return self.mipmap_sizes[0][1]
+
+    def to_image(self, i=0):
+        """Mipmap i as a PIL image sharing the pixel buffer."""
+        from PIL import Image
+        return Image.frombuffer("RGBA", self.mipmap_sizes[i], self.mipmaps[i], "raw", "RGBA", 0, 1)
+
+
+def decode_texture(buf, game=None, mipmaps=None):
+    """Decodes the texture file in buf, any bytes-like object, and returns a TextureResult.
+    If game is None it is detected from the header. If mipmaps is given, only that many
+    mipmaps are decoded, starting with the largest."""
+    with quiet():
+        tex = read_texture(BytesIO(buf), game, decode_mipmaps=mipmaps is None)
+        if mipmaps is not None:
+            tex.mipmaps = [tex.decode_mipmap(i) for i in range(min(mipmaps, len(tex.mipmap_data)))]
+    
+    if game is None:
+        game = "bw1" if isinstance(tex, BW1Texture) else "bw2"
+    mipmaps = []
+    mipmap_sizes = []
+    for mipmap in tex.mipmaps:
+        mipmaps.append(memoryview(mipmap.convert("RGBA").tobytes()))
+        mipmap_sizes.append(mipmap.size)
+    header = (tex.unkint2, tex.unkint3, tex.unkint4, tex.unkint5, tex.unkint6, tex.unkint7)
+    return TextureResult(game, tex.name, tex.fmt, header, tex.header_to_string(), mipmaps, mipmap_sizes)
+
+
+def encode_texture(pixels, game, fmt, header=None, mips=1, size=None, name="texture"):
+    """Encodes an image into a texture file and returns its bytes.
+    
+    pixels is a PIL image or a bytes-like object with RGBA pixels row by row, in which case size
+    is its (width, height). header holds the values unkint2 to unkint7, a header string as 
+    written by header_to_string works too; None uses the usual values for fmt. mips is the 
+    number of mipmaps, more than one needs power of two sizes. Like BW2Texture.write, BW2 
+    headers always say there is one mipmap."""
+    if fmt not in STRTOFORMAT:
+        raise ValueError("Unknown format: {0}".format(fmt))
+    
+    from PIL import Image
+    if isinstance(pixels, Image.Image):
+        image = pixels
+    else:
+        if size is None:
+            raise ValueError("size is needed when pixels aren't a PIL image")
+        width, height = size
+        view = memoryview(pixels).cast("B")
+        if len(view) != width*height*4:
+            raise ValueError("Expected {0} bytes of RGBA pixels for {1}x{2}, got {3}".format(width*height*4, width, height, len(view)))
+        image = Image.frombuffer("RGBA", (width, height), view, "raw", "RGBA", 0, 1)
+    
+    if mips > 1 and (log2(image.width) % 1 != 0 or log2(image.height) % 1 != 0):
+        raise ValueError("Mipmaps need power of two sizes, not {0}x{1}".format(image.width, image.height))
+    
+    with quiet():
+        tex = texture_class_for_game(game).from_image(image, name, fmt, autogenmipmaps=mips > 1)
+        del tex.mipmaps[max(mips, 1):]
+        if isinstance(header, str):
+            tex.header_from_string(header)
+        elif header is not None:
+            tex.header_from_string(".".join(str(x) for x in header))
+        
+        out = BytesIO()
+        tex.write(out)
+    return out.getvalue()
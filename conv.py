@@ -1,79 +1,514 @@
-import argparse
 import sys 
 import os 
+import convserver
+
+if __name__ == "__main__":
+    # Let a running conv.py --serve do the conversion if BWTEX_SERVER is set, before
+    # spending time on the imports below. Exits if the server did it.
+    convserver.forward_to_server(sys.argv[1:])
+
+import io
+import argparse
+import contextlib
+import glob
+import traceback
 import bwtex 
+from lib.profiling import PROFILER
+from lib.texture_utils import NUMPY_INSTALLED
+from lib.codec_backends import BACKENDS, BACKEND_ENV_VAR, select_backend, get_backend
 
 
-if __name__ == "__main__":
+def game_from_flags(bw1=None):
+    """bw1 is True for BW1, False for BW2 and None to detect the game from the input."""
+    if bw1 is None:
+        return None
+    return "bw1" if bw1 else "bw2"
+
+
+def texture_to_image(in_path, outpath=None, bw1=None):
+    with open(in_path, "rb") as f:
+        tex = bwtex.read_texture(f, game_from_flags(bw1))
+    print("Texture format:", tex.fmt)
+    if outpath is None:
+        settings = tex.header_to_string()
+        outpath = in_path.replace(".texture", "")+"."+tex.fmt+"."+settings+".png"
+    with PROFILER.stage("save_png", pixels=tex.mipmaps[0].width*tex.mipmaps[0].height):
+        tex.mipmaps[0].save(outpath)
+    """if len(tex.mipmaps) > 1:
+        print("saved mipmap")
+        for i, mip in enumerate(tex.mipmaps[1:]):
+            mip.save(in_path+".mip{0}".format(i)+".png")"""
+    return outpath
+
+
+def get_image_game(filename, bw1=None, original=None):
+    """The game the texture made of the image named filename is for: from the flags, the original
+    texture or the header values in the name, in that order."""
+    game = game_from_flags(bw1)
+    if game is None and original is not None:
+        with open(original, "rb") as f:
+            game = bwtex.sniff_game(f.read(bwtex.SNIFF_SIZE))
+    if game is None:
+        # The header values in the name are only there if there's also a format
+        settings = os.path.basename(filename).split(".")
+        game = bwtex.sniff_game_from_settings(".".join(settings[2:]))
+    if game is None:
+        raise RuntimeError("Cannot detect whether {0} is for BW1 or BW2, use --bw1 or --bw2.".format(filename))
+    return game
+
+
+def build_texture(image_file, filename, bw1=None, fmt=None, original=None, max_error=bwtex.DEFAULT_MAX_ERROR):
+    """Makes a texture of the image in image_file, a path or a file object. The texture name, 
+    format and header values come from filename, see image_to_texture."""
+    settings = os.path.basename(filename).split(".")
+    name = settings.pop(0)
+    game = get_image_game(filename, bw1, original)
+
+    if fmt is None:
+        if len(settings) > 2:
+            fmt = settings.pop(0)
+            if fmt not in bwtex.STRTOFORMAT and fmt != "auto":
+                fmt = "DXT1"
+        else:
+            fmt = "DXT1"
+
+    if len(settings) > 1:
+        gen_mipmap = settings[0].lower() == "mipmap"
+    else:
+        gen_mipmap = False
+
+    if fmt == "auto":
+        from PIL import Image
+        with PROFILER.stage("load"):
+            image = Image.open(image_file)
+            image.load()
+        if hasattr(image_file, "seek"):
+            image_file.seek(0)
+        fmt, analysis = bwtex.choose_format(image, bw1=(game == "bw1"), max_error=max_error)
+        print("Image:", analysis.summary())
+        print("Chose format {0} (error {1:.2f}, limit {2})".format(fmt, analysis.get_error(bwtex.FORMAT[fmt]), max_error))
     
+    print("Converting to format", fmt)
+    tex = bwtex.texture_class_for_game(game).from_path(path=image_file, name=name, fmt=fmt, autogenmipmaps=gen_mipmap)
+
+    tex.header_from_string(".".join(settings))
+
+    if original is not None:
+        with open(original, "rb") as f:
+            tex.original = bwtex.read_texture(f, game)
+    return tex
+
+
+def parse_image_name(filename):
+    """The texture name, the format (None if there is none), whether to generate mipmaps and the
+    remaining settings in the name of an image, read the way build_texture reads them."""
+    settings = os.path.basename(filename).split(".")
+    name = settings.pop(0)
+    name_fmt = settings.pop(0) if len(settings) > 2 else None
+    gen_mipmap = len(settings) > 1 and settings[0].lower() == "mipmap"
+    return name, name_fmt, gen_mipmap, settings
+
+
+def build_texture_in_format(data, filename, game, fmt, original=None):
+    """Makes a texture in fmt of the image file in data, like build_texture does for an image named
+    filename. The header values in the name are only used if they are for fmt, the header values 
+    of other formats are often wrong for it, so those textures get the defaults of fmt."""
+    name, name_fmt, gen_mipmap, settings = parse_image_name(filename)
+    
+    tex = bwtex.texture_class_for_game(game).from_path(path=io.BytesIO(data), name=name, fmt=fmt, autogenmipmaps=gen_mipmap)
+    if name_fmt == fmt:
+        tex.header_from_string(".".join(settings))
+    if original is not None:
+        with open(original, "rb") as f:
+            tex.original = bwtex.read_texture(f, game)
+    return tex
+
+
+def encode_candidate(data, filename, game, fmt, original=None):
+    """Runs in the worker processes of choose_format_by_encoding too. Returns fmt, the texture
+    file made of the image file in data and the PSNR of its channel with the largest error."""
+    import texmetrics
+    from PIL import Image
+    # The texture classes print while encoding, which would be noise for every format tried
+    with bwtex.quiet():
+        tex = build_texture_in_format(data, filename, game, fmt, original)
+        out = io.BytesIO()
+        tex.write(out)
+    texture_data = out.getvalue()
+    with Image.open(io.BytesIO(data)) as source:
+        metrics = texmetrics.compare_texture(texture_data, source, worst=0)
+    return fmt, texture_data, metrics.min_psnr
+
+
+def get_candidate_formats(game, width, height, mipmaps=1, max_bytes=None):
+    """The formats of game grouped by the file size of a width x height texture with mipmaps
+    mipmaps, smallest first, as [(size, formats)]. Formats with files larger than max_bytes are left out."""
+    formats = bwtex.FORMATDEFAULTSBW1 if game == "bw1" else bwtex.FORMATDEFAULTSBW2
+    by_size = {}
+    for fmt in formats:
+        size = bwtex.get_texture_file_size(game, fmt, width, height, mipmaps)
+        if max_bytes is None or size <= max_bytes:
+            by_size.setdefault(size, []).append(fmt)
+    return sorted(by_size.items())
+
+
+def choose_format_by_encoding(data, filename, bw1=None, target_psnr=None, max_bytes=None, original=None, workers=None):
+    """Encodes the image file in data in the formats of its game, smallest file first, and returns
+    the format, texture file and PSNR of the smallest texture file of at most max_bytes whose channels all
+    have a PSNR of at least target_psnr. The PSNR decides between formats of the same size. No larger
+    formats are encoded once one qualifies. Without target_psnr the texture with the highest PSNR 
+    within max_bytes wins. filename gives the texture name and header values like for build_texture.
+    
+    With workers the formats are encoded in that many processes at once, smallest first, and the 
+    larger ones still being encoded are stopped once a format is chosen."""
+    if not NUMPY_INSTALLED:
+        raise RuntimeError("Choosing the format by PSNR requires numpy.")
+    from PIL import Image
+    from lib.texture_metrics import format_psnr
+    
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+    game = get_image_game(filename, bw1, original)
+    name, name_fmt, gen_mipmap, settings = parse_image_name(filename)
+    mipmaps = bwtex.get_generated_mipmap_count(width, height) if gen_mipmap else 1
+    groups = [formats for size, formats in get_candidate_formats(game, width, height, mipmaps, max_bytes)]
+    if not groups:
+        raise RuntimeError("Every format takes more than {0} bytes for a {1}x{2} texture.".format(max_bytes, width, height))
+    
+    import multiprocessing
+    pool = None
+    # Pool workers are daemon processes, which can't have a pool of their own
+    if workers is not None and workers > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(workers, initializer=select_backend, initargs=(get_backend().name,))
+    try:
+        if pool is not None:
+            # The pool takes tasks in the order they are queued, so the small formats are done first
+            queued = [[pool.apply_async(encode_candidate, (data, filename, game, fmt, original)) for fmt in group]
+                      for group in groups]
+            results = ([result.get() for result in group] for group in queued)
+        else:
+            results = ([encode_candidate(data, filename, game, fmt, original) for fmt in group] for group in groups)
+        
+        best = None
+        for group_results in results:
+            for fmt, texture_data, psnr in group_results:
+                fits = max_bytes is None or len(texture_data) <= max_bytes
+                print("{0}: {1} bytes, PSNR {2} dB{3}".format(fmt, len(texture_data), format_psnr(psnr), "" if fits else ", too large"))
+                if fits and (target_psnr is None or psnr >= target_psnr) and (best is None or psnr > best[2]):
+                    best = (fmt, texture_data, psnr)
+            # Nothing is better than lossless
+            if best is not None and (target_psnr is not None or best[2] == float("inf")):
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    
+    if best is None:
+        if max_bytes is None:
+            raise RuntimeError("No format reaches a PSNR of {0} dB.".format(target_psnr))
+        if target_psnr is None:
+            raise RuntimeError("No format fits in {0} bytes.".format(max_bytes))
+        raise RuntimeError("No format reaches a PSNR of {0} dB in at most {1} bytes.".format(target_psnr, max_bytes))
+    print("Chose format {0} ({1} bytes, PSNR {2} dB)".format(best[0], len(best[1]), format_psnr(best[2])))
+    return best
+
+
+def image_to_texture(in_path, outpath=None, bw1=None, fmt=None, original=None, max_error=bwtex.DEFAULT_MAX_ERROR,
+                     target_psnr=None, max_bytes=None, workers=None):
+    """Converts an image to a texture. The image name is the texture name, optionally followed by
+    the format and the header values like texture_to_image writes them: name.DXT1.MipMap.4.255.255.1.1024.0.png
+    With target_psnr or max_bytes the format is chosen by choose_format_by_encoding instead."""
+    if outpath is None:
+        outpath = in_path+".texture"
+
+    if target_psnr is not None or max_bytes is not None:
+        with open(in_path, "rb") as f:
+            data = f.read()
+        fmt, texture_data, psnr = choose_format_by_encoding(data, in_path, bw1=bw1, target_psnr=target_psnr,
+                                                            max_bytes=max_bytes, original=original, workers=workers)
+        with open(outpath, "wb") as f:
+            f.write(texture_data)
+        return outpath
+
+    tex = build_texture(in_path, in_path, bw1=bw1, fmt=fmt, original=original, max_error=max_error)
+
+    with open(outpath, "wb") as f:
+        tex.write(f)
+    return outpath
+
+
+def convert(in_path, outpath=None, bw1=None, fmt=None, original=None, max_error=bwtex.DEFAULT_MAX_ERROR,
+            target_psnr=None, max_bytes=None, workers=None):
+    """Converts a texture to PNG or anything else to a texture and returns the output path."""
+    if in_path.endswith(".texture"):
+        return texture_to_image(in_path, outpath, bw1=bw1)
+    else:
+        return image_to_texture(in_path, outpath, bw1=bw1, fmt=fmt, original=original, max_error=max_error,
+                                target_psnr=target_psnr, max_bytes=max_bytes, workers=workers)
+
+
+def is_texture_data(data):
+    """Guesses from the first bytes whether data is a texture rather than an image."""
+    if data.startswith(b"\x89PNG"):
+        return False
+    return bwtex.sniff_game(data[:bwtex.SNIFF_SIZE]) is not None
+
 
+def convert_stream(in_file, out_file, name=None, to_png=None, bw1=None, fmt=None, max_error=bwtex.DEFAULT_MAX_ERROR,
+                   target_psnr=None, max_bytes=None):
+    """Converts the texture or image read from in_file and writes the result to out_file, which is 
+    only written to once the conversion succeeded. to_png=None guesses the direction from the data. 
+    For images, name is used like the image file name to get the texture name, format and header values."""
+    with PROFILER.stage("read"):
+        data = in_file.read()
+    if to_png is None:
+        to_png = is_texture_data(data)
+    
+    out = io.BytesIO()
+    if to_png:
+        tex = bwtex.read_texture(io.BytesIO(data), game_from_flags(bw1))
+        print("Texture format:", tex.fmt)
+        # The header values would be in the file name, which a stream doesn't have
+        print("Name for converting back:", (name or tex.name)+"."+tex.fmt+"."+tex.header_to_string()+".png")
+        with PROFILER.stage("save_png", pixels=tex.mipmaps[0].width*tex.mipmaps[0].height):
+            tex.mipmaps[0].save(out, "PNG")
+    elif target_psnr is not None or max_bytes is not None:
+        fmt, texture_data, psnr = choose_format_by_encoding(data, name or "texture", bw1=bw1, target_psnr=target_psnr,
+                                                            max_bytes=max_bytes)
+        out.write(texture_data)
+    else:
+        tex = build_texture(io.BytesIO(data), name or "texture", bw1=bw1, fmt=fmt, max_error=max_error)
+        tex.write(out)
+    
+    with PROFILER.stage("write_output"):
+        out_file.write(out.getbuffer())
+        out_file.flush()
+
+
+def convert_in_worker(in_path, bw1, fmt, max_error, target_psnr=None, max_bytes=None):
+    """Runs in the worker processes of convert_many. Returns the output path, or None and the error."""
+    try:
+        return convert(in_path, bw1=bw1, fmt=fmt, max_error=max_error, target_psnr=target_psnr, max_bytes=max_bytes), None, None
+    except Exception as e:
+        return None, "{0}: {1}".format(type(e).__name__, e), traceback.format_exc()
+
+
+def is_glob_pattern(path):
+    return any(c in path for c in "*?[")
+
+
+def get_file_kind(path):
+    """"texture" for textures, "image" for files whose extension PIL knows, otherwise None."""
+    if path.endswith(".texture"):
+        return "texture"
+    from PIL import Image
+    if os.path.splitext(path)[1].lower() in Image.registered_extensions():
+        return "image"
+    return None
+
+
+def is_output_path(in_path, path):
+    """Whether path, the second of two paths, is where in_path should be converted to (conv.py in.png out.texture).
+    It's another input if it exists and is the same kind of file as in_path, like the two PNGs *.png expands
+    to in a folder with two PNGs, which would be overwritten otherwise."""
+    if not os.path.exists(path):
+        return True
+    kind = get_file_kind(path)
+    return kind is None or kind != get_file_kind(in_path)
+
+
+def read_path_list(f):
+    return [line.strip() for line in f if line.strip()]
+
+
+def expand_inputs(paths, from_file=None):
+    """Returns the files to convert: paths with glob patterns expanded and - replaced by the paths 
+    on stdin, followed by the paths listed in from_file (- for stdin). Lists have one path per line.
+    Patterns that don't match anything are returned as they are so that they fail to convert."""
+    in_paths = []
+    for path in paths:
+        if path == "-":
+            in_paths.extend(read_path_list(sys.stdin))
+        elif is_glob_pattern(path):
+            matches = sorted(glob.glob(path, recursive=True))
+            if not matches:
+                print("No files match", path)
+                in_paths.append(path)
+            in_paths.extend(matches)
+        else:
+            in_paths.append(path)
+    
+    if from_file == "-":
+        in_paths.extend(read_path_list(sys.stdin))
+    elif from_file is not None:
+        with open(from_file, "r") as f:
+            in_paths.extend(read_path_list(f))
+    return in_paths
+
+
+def convert_many(in_paths, bw1=None, fmt=None, max_error=bwtex.DEFAULT_MAX_ERROR, workers=None,
+                 target_psnr=None, max_bytes=None):
+    """Converts every file in in_paths to where conv.py would put it on its own. With workers=None the 
+    files are converted one after another in this process, otherwise in a pool of that many worker 
+    processes. A failed file doesn't stop the others. Returns the output paths, None for failed files."""
+    outpaths = []
+    if workers is None:
+        for in_path in in_paths:
+            print("Converting", in_path)
+            try:
+                outpath = convert(in_path, bw1=bw1, fmt=fmt, max_error=max_error, target_psnr=target_psnr, max_bytes=max_bytes)
+                print("Saved to", outpath)
+            except Exception as e:
+                traceback.print_exc()
+                print("Failed to convert {0}: {1}: {2}".format(in_path, type(e).__name__, e))
+                outpath = None
+            outpaths.append(outpath)
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(workers, initializer=select_backend, initargs=(get_backend().name,)) as pool:
+            results = [pool.apply_async(convert_in_worker, (in_path, bw1, fmt, max_error, target_psnr, max_bytes))
+                       for in_path in in_paths]
+            for in_path, result in zip(in_paths, results):
+                outpath, error, error_traceback = result.get()
+                if error is None:
+                    print("Saved {0} to {1}".format(in_path, outpath))
+                else:
+                    print(error_traceback, end="")
+                    print("Failed to convert {0}: {1}".format(in_path, error))
+                outpaths.append(outpath)
+    return outpaths
+
+
+def print_profile(trace_path=None):
+    print(PROFILER.report())
+    if trace_path is not None:
+        PROFILER.write_chrome_trace(trace_path)
+        print("Wrote trace to", trace_path)
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument("input",
-                        help="Path to texture")
+    parser.add_argument("inputs", nargs='*', metavar="input",
+                        help=("Textures to convert to PNG and images to convert to textures. Glob patterns like "
+                                "*.png are expanded, - reads paths from stdin, one per line. Of exactly two paths "
+                                "without patterns, the second is the output path of the first (conv.py in.png out.texture), "
+                                "unless it exists and is the same kind of file as the first. "
+                                "Default output: next to the input, named after the texture header or with .texture added."))
     parser.add_argument('--bw1',
-                        action='store_true')
+                        action='store_true',
+                        help="Input/output is a BW1 texture. Default: detected from the texture header or the PNG name.")
     parser.add_argument('--bw2',
-                        action='store_true')
+                        action='store_true',
+                        help="Input/output is a BW2 texture. Default: detected from the texture header or the PNG name.")
     parser.add_argument("-f", "--format", default=None, 
                         help=("Format of new BW1/BW2 texture. Default: DXT1 \n"
                                 "For BW1: One of DXT1, P8, RGBA.\n" 
-                                "For BW2: One of DXT1, P4, P8, I4, I8, IA4, IA8, RGBA"))
-    parser.add_argument("output", default=None, nargs = '?',
-                        help=("Path to output") )
-
-    args = parser.parse_args()
-    assert (args.bw1 or args.bw2) and not (args.bw1 and args.bw2)
-    #in_path = sys.argv[1]
-    in_path = args.input 
+                                "For BW2: One of DXT1, P4, P8, I4, I8, IA4, IA8, RGBA\n"
+                                "auto: The smallest format that keeps the error below --max-error"))
+    parser.add_argument("--max-error", type=float, default=bwtex.DEFAULT_MAX_ERROR,
+                        help=("Largest root mean square error per channel (0-255) that --format auto accepts. "
+                                "Default: {0}".format(bwtex.DEFAULT_MAX_ERROR)))
+    parser.add_argument("--target-psnr", type=float, default=None, metavar="DB",
+                        help=("Encode the image in every format of its game, smallest first, and keep the smallest "
+                                "texture whose channels all have at least this PSNR. Stops at the first format that "
+                                "qualifies. Requires numpy."))
+    parser.add_argument("--max-bytes", type=int, default=None, metavar="N",
+                        help=("Like --target-psnr, only texture files of at most N bytes qualify. On its own, the texture "
+                                "with the highest PSNR within N bytes is kept."))
+    parser.add_argument("--original", default=None,
+                        help=("Path to the .texture the input image was extracted from. "
+                                "Blocks that weren't edited are copied from it instead of being re-encoded."))
+    parser.add_argument("--backend", default=None, choices=list(BACKENDS),
+                        help=("Codec implementation to use. Default: the {0} environment variable, "
+                                "otherwise native if installed, otherwise reference.".format(BACKEND_ENV_VAR)))
+    parser.add_argument('--profile', action='store_true',
+                        help="Print the time spent in each stage of the conversion.")
+    parser.add_argument("--trace", default=None,
+                        help="Write a Chrome trace JSON of the conversion stages to this path. Implies --profile.")
+    parser.add_argument("--serve", nargs='?', const=convserver.DEFAULT_ADDRESS, default=None, metavar="ADDRESS",
+                        help=("Keep running and convert files sent by other conv.py calls, which do that when the {0} "
+                                "environment variable is set to ADDRESS. ADDRESS is the path of a Unix socket or a loopback host:port, "
+                                "which only accepts requests with the token the server writes next to its default socket. "
+                                "Default: {1}".format(convserver.SERVER_ENV_VAR, convserver.DEFAULT_ADDRESS)))
+    parser.add_argument("--stream", action='store_true',
+                        help=("Read one texture or image from stdin and write the converted file to stdout. "
+                                "Everything else that would be printed goes to stderr."))
+    parser.add_argument("--to", choices=("png", "texture"), default=None,
+                        help="With --stream, what to convert to. Default: texture if stdin isn't a texture, otherwise png.")
+    parser.add_argument("--name", default=None,
+                        help=("With --stream, the file name the image would have, which holds the texture name, "
+                                "format and header values. Default: texture"))
+    parser.add_argument("--from-file", default=None, metavar="PATH",
+                        help="Also convert the files listed in this file, one per line. - reads the list from stdin.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=("Number of worker processes that convert several inputs at once, or that --serve uses. "
+                                "With a single input and --target-psnr or --max-bytes, the number of formats "
+                                "encoded at once. Default: one input at a time in this process, one worker per CPU for --serve."))
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.inputs and args.from_file is None and args.serve is None and not args.stream:
+        parser.error("the following arguments are required: input")
+    assert not (args.bw1 and args.bw2)
+    bw1 = True if args.bw1 else (False if args.bw2 else None)
     
-    if in_path.endswith(".texture"):
-        with open(in_path, "rb") as f:
-            if args.bw1:
-                tex = bwtex.BW1Texture.from_file(f)  
-            else:
-                tex = bwtex.BW2Texture.from_file(f)  
-        print("Texture format:", tex.fmt)
-        if args.output is not None:
-            outpath = args.output 
-        else:
-            settings = tex.header_to_string()
-            outpath = in_path.replace(".texture", "")+"."+tex.fmt+"."+settings+".png"
-        tex.mipmaps[0].save(outpath)
-        """if len(tex.mipmaps) > 1:
-            print("saved mipmap")
-            for i, mip in enumerate(tex.mipmaps[1:]):
-                mip.save(in_path+".mip{0}".format(i)+".png")"""
+    by_encoding = args.target_psnr is not None or args.max_bytes is not None
+    if by_encoding and args.format is not None:
+        parser.error("--target-psnr and --max-bytes choose the format, they can't be used with --format")
+
+    select_backend(args.backend)
+
+    if args.serve is not None:
+        server = convserver.ConversionServer(args.serve, workers=args.workers)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except (ValueError, RuntimeError) as e:
+            parser.error(str(e))
+        return []
+
+    if args.profile or args.trace is not None:
+        PROFILER.enable()
+
+    if args.stream:
+        if args.inputs or args.from_file is not None:
+            parser.error("--stream reads from stdin and doesn't take input paths")
+        stdout = sys.stdout.buffer
+        # Keep the converted file the only thing on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            to_png = None if args.to is None else args.to == "png"
+            convert_stream(sys.stdin.buffer, stdout, name=args.name, to_png=to_png, bw1=bw1, fmt=args.format, max_error=args.max_error,
+                           target_psnr=args.target_psnr, max_bytes=args.max_bytes)
+            if PROFILER.enabled:
+                print_profile(args.trace)
+        return ["-"]
+
+    single_input = (args.from_file is None and len(args.inputs) in (1, 2)
+                    and not any(is_glob_pattern(path) or path == "-" for path in args.inputs))
+    if single_input and (len(args.inputs) == 1 or is_output_path(*args.inputs)):
+        # A single file, converted as before: errors end the program with a traceback
+        outpath = args.inputs[1] if len(args.inputs) == 2 else None
+        outpaths = [convert(args.inputs[0], outpath, bw1=bw1, fmt=args.format, original=args.original, max_error=args.max_error,
+                            target_psnr=args.target_psnr, max_bytes=args.max_bytes, workers=args.workers)]
     else:
-        settings = os.path.basename(in_path).split(".")
-        name = settings.pop(0)
-        
-        if args.format is None:
-            if len(settings) > 2:
-                fmt = settings.pop(0)
-                if fmt not in bwtex.STRTOFORMAT:
-                    fmt = "DXT1"
-            else:
-                fmt = "DXT1"
-        else:
-            fmt = args.format
-        
-        if len(settings) > 1:
-            gen_mipmap = settings[0].lower() == "mipmap"
-        else:
-            gen_mipmap = False
-        
-        print("Converting to format", fmt)
-        if args.bw1:
-            tex = bwtex.BW1Texture.from_path(path=in_path, name=name, fmt=fmt, autogenmipmaps=gen_mipmap)
-        else:
-            tex = bwtex.BW2Texture.from_path(path=in_path, name=name, fmt=fmt, autogenmipmaps=gen_mipmap)
-        
-        tex.header_from_string(".".join(settings))
+        if args.original is not None:
+            parser.error("--original only works with a single input")
+        in_paths = expand_inputs(args.inputs, args.from_file)
+        outpaths = convert_many(in_paths, bw1=bw1, fmt=args.format, max_error=args.max_error, workers=args.workers,
+                                target_psnr=args.target_psnr, max_bytes=args.max_bytes)
+        failed = outpaths.count(None)
+        print("Converted {0} of {1} files".format(len(outpaths) - failed, len(outpaths)))
         
-        if args.output is None:
-            outpath = in_path+".texture"
-        else:
-            outpath = args.output
-        
-        with open(outpath, "wb") as f:
-            tex.write(f)
\ No newline at end of file
+    if PROFILER.enabled:
+        print_profile(args.trace)
+    return outpaths
+
+
+if __name__ == "__main__":
+    if None in main():
+        sys.exit(1)
@@ -0,0 +1,337 @@
+# Keeps conv.py loaded between conversions. "conv.py --serve" starts a daemon with a pool of
+# worker processes that have already imported the codecs, and conv.py hands its command line
+# to that daemon when the BWTEX_SERVER environment variable is set. Build scripts that call
+# conv.py once per file then only pay for starting Python, not for the imports.
+#
+# Requests and replies are JSON objects, one per line. A connection can send any number of
+# requests, each one is answered before the next is read.
+#
+# Whoever can send requests can make the server read and write any file its user can, so it
+# only listens where its own user can reach it: by default on a Unix socket in a directory only
+# that user can open. TCP is limited to loopback addresses and every request has to carry the
+# token the server writes to a file in that directory.
+#
+# This module is imported by conv.py before anything else so it must stay cheap to import:
+# even json and socket are only imported once a server is actually used.
+
+import os
+import sys
+import time
+
+SERVER_ENV_VAR = "BWTEX_SERVER"
+TCP_PORT = 47831
+
+
+def get_user_directory():
+    """Directory for the socket and the token of the server of the current user, see ensure_user_directory."""
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or os.environ.get("TEMP")
+    if not base:
+        base = "/tmp" if os.name != "nt" else os.path.expanduser("~")
+    if hasattr(os, "getuid"):
+        user = str(os.getuid())
+    else:
+        user = os.environ.get("USERNAME", "user")
+    return os.path.join(base, "bwtex-"+user)
+
+
+def ensure_user_directory():
+    """Creates the user directory if needed and makes sure no other user can get into it."""
+    directory = get_user_directory()
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if hasattr(os, "getuid"):
+        status = os.stat(directory)
+        if status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise RuntimeError("{0} has to belong to this user and be closed to everyone else.".format(directory))
+    return directory
+
+
+def get_default_address():
+    # Windows has no Unix sockets
+    if os.name == "nt":
+        return "127.0.0.1:{0}".format(TCP_PORT)
+    return os.path.join(get_user_directory(), "conv.sock")
+
+
+DEFAULT_ADDRESS = get_default_address()
+
+# How long the client waits for the server to accept the connection before converting locally
+CONNECT_TIMEOUT = 1.0
+
+
+def parse_address(address):
+    """host:port is a TCP address, anything else is the path of a Unix socket. Only loopback
+    hosts are accepted, the server must not be reachable from other machines."""
+    import socket
+    import ipaddress
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        host = host.strip("[]") or "127.0.0.1"
+        if host == "localhost":
+            host = "127.0.0.1"
+        try:
+            loopback = ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            loopback = False
+        if not loopback:
+            raise ValueError("The server only listens on loopback addresses like 127.0.0.1, not {0}".format(host))
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        return family, (host, int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("Unix sockets aren't supported on this system, use host:port instead of {0}".format(address))
+    return socket.AF_UNIX, address
+
+
+def request_to_argv(request):
+    """Turns a request with separate fields into a conv.py command line."""
+    argv = [request["input"]]
+    if request.get("output") is not None:
+        argv.append(request["output"])
+    if request.get("game") is not None:
+        if request["game"] not in ("bw1", "bw2"):
+            raise ValueError("Unknown game: {0}".format(request["game"]))
+        argv.append("--"+request["game"])
+    if request.get("format") is not None:
+        argv.extend(("--format", request["format"]))
+    if request.get("max_error") is not None:
+        argv.extend(("--max-error", str(request["max_error"])))
+    if request.get("target_psnr") is not None:
+        argv.extend(("--target-psnr", str(request["target_psnr"])))
+    if request.get("max_bytes") is not None:
+        argv.extend(("--max-bytes", str(request["max_bytes"])))
+    if request.get("original") is not None:
+        argv.extend(("--original", request["original"]))
+    if request.get("profile"):
+        argv.append("--profile")
+    return argv
+
+
+def without_workers(argv):
+    """argv without --workers. The server's workers are daemon processes, which can't start a
+    pool of their own, so the requests of one conv.py run are converted by one worker."""
+    result = []
+    skip_value = False
+    for arg in argv:
+        option, equals, value = arg.partition("=")
+        # argparse also takes abbreviations like --work
+        is_workers = len(option) > 2 and "--workers".startswith(option)
+        if skip_value:
+            skip_value = False
+        elif is_workers and not equals:
+            skip_value = True
+        elif not is_workers:
+            result.append(arg)
+    return result
+
+
+def get_token_path(port):
+    return os.path.join(get_user_directory(), "server-{0}.token".format(port))
+
+
+def write_token(port):
+    """Makes up the token for the TCP server on port and writes it to a file only this user can read."""
+    import secrets
+    token = secrets.token_hex(32)
+    path = get_token_path(port)
+    ensure_user_directory()
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def read_token(port):
+    with open(get_token_path(port), "r") as f:
+        return f.read().strip()
+
+
+# Client side
+
+def send_request(address, request):
+    import json
+    import socket
+    family, sock_address = parse_address(address)
+    if family != getattr(socket, "AF_UNIX", None):
+        request = dict(request, token=read_token(sock_address[1]))
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(sock_address)
+        sock.settimeout(None)
+        sock.sendall(json.dumps(request).encode("utf-8")+b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The server closed the connection without replying")
+    return json.loads(line)
+
+
+def forward_to_server(argv):
+    """Sends a conv.py command line to the server in BWTEX_SERVER, prints what the conversion
+    printed and exits with its exit code. Returns without doing anything if no server is set,
+    and after a warning if it can't be reached, so that conv.py can do the conversion itself."""
+    address = os.environ.get(SERVER_ENV_VAR)
+    # The server can't read this process's stdin, so path lists on stdin are read here
+    if not address or "--serve" in argv or "--stream" in argv or "-h" in argv or "--help" in argv or "-" in argv:
+        return
+
+    try:
+        reply = send_request(address, {"argv": argv, "cwd": os.getcwd()})
+    except (OSError, ValueError) as e:
+        print("Couldn't use the conversion server at {0} ({1}), converting without it".format(address, e), file=sys.stderr)
+        return
+
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stderr.write(reply.get("stderr", ""))
+    if reply["status"] == "error" and not reply.get("stderr"):
+        sys.stderr.write(reply.get("traceback") or reply["error"]+"\n")
+    sys.stdout.flush()
+    sys.exit(reply["returncode"])
+
+
+# Server side
+
+def init_worker(backend_name):
+    # Importing conv here does the expensive setup once per worker instead of once per file
+    import conv
+    from lib.codec_backends import BACKEND_ENV_VAR, select_backend
+    # Requests without --backend use the backend of the server
+    os.environ[BACKEND_ENV_VAR] = backend_name
+    select_backend(backend_name)
+
+
+def handle_request(request):
+    """Runs in the worker processes. Converts like conv.py with the request's command line
+    and returns the reply without the timings measured by the server."""
+    import io
+    import contextlib
+    import traceback
+    import conv
+    from lib.profiling import PROFILER
+
+    started = time.time()
+    stdout, stderr = io.StringIO(), io.StringIO()
+    reply = {"status": "ok", "returncode": 0}
+    previous_cwd = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            argv = without_workers(request["argv"] if "argv" in request else request_to_argv(request))
+            os.chdir(request.get("cwd", previous_cwd))
+            reply["outpaths"] = conv.main(argv)
+            if None in reply["outpaths"]:
+                reply.update(status="error", returncode=1, error="Some files failed to convert")
+    except SystemExit as e:
+        # argparse exits on bad command lines
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        reply.update(status="ok" if code == 0 else "error", returncode=code, error="conv.py exited with {0}".format(code))
+    except Exception as e:
+        reply.update(status="error", returncode=1, error="{0}: {1}".format(type(e).__name__, e),
+                     traceback=traceback.format_exc())
+    finally:
+        os.chdir(previous_cwd)
+        PROFILER.enabled = False
+        PROFILER.reset()
+
+    reply["stdout"] = stdout.getvalue()
+    reply["stderr"] = stderr.getvalue()
+    reply["started"] = started
+    reply["finished"] = time.time()
+    return reply
+
+
+class ConversionServer(object):
+    """Accepts conversion requests on address and converts them in a pool of worker processes."""
+    def __init__(self, address=DEFAULT_ADDRESS, workers=None):
+        self.address = address
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.server = None
+        # Requests over TCP need this, None for Unix sockets
+        self.token = None
+
+    def handle(self, request):
+        import hmac
+        received = time.time()
+        try:
+            if not isinstance(request, dict) or ("argv" not in request and "input" not in request):
+                raise ValueError("A request needs either argv or input")
+            if self.token is not None and not hmac.compare_digest(str(request.pop("token", "")), self.token):
+                raise PermissionError("The request doesn't have the token of this server")
+            reply = self.pool.apply(handle_request, (request,))
+        except Exception as e:
+            return {"status": "error", "returncode": 1, "error": "{0}: {1}".format(type(e).__name__, e)}
+
+        started, finished = reply.pop("started"), reply.pop("finished")
+        reply["timings"] = {
+            "queued": max(started - received, 0.0),
+            "convert": finished - started,
+            "total": time.time() - received
+        }
+        return reply
+
+    def serve_forever(self):
+        import json
+        import socket
+        import socketserver
+        import multiprocessing
+        from lib.codec_backends import get_backend
+
+        family, sock_address = parse_address(self.address)
+        conversion_server = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        reply = {"status": "error", "returncode": 1, "error": "Invalid request: {0}".format(e)}
+                    else:
+                        reply = conversion_server.handle(request)
+                    self.wfile.write(json.dumps(reply).encode("utf-8")+b"\n")
+                    self.wfile.flush()
+
+        tcp = family != getattr(socket, "AF_UNIX", None)
+        if tcp:
+            base_class = socketserver.ThreadingTCPServer
+            self.token = write_token(sock_address[1])
+        else:
+            base_class = socketserver.ThreadingUnixStreamServer
+            if os.path.dirname(os.path.abspath(sock_address)) == get_user_directory():
+                ensure_user_directory()
+            if os.path.exists(sock_address):
+                os.remove(sock_address)
+
+        class server_class(base_class):
+            daemon_threads = True
+            allow_reuse_address = True
+            address_family = family
+
+        self.pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(get_backend().name,))
+        try:
+            # Only the user running the server may send it files to convert, the socket is never open to others
+            previous_umask = os.umask(0o177)
+            try:
+                self.server = server_class(sock_address, RequestHandler)
+            finally:
+                os.umask(previous_umask)
+            with self.server:
+                if not tcp:
+                    os.chmod(sock_address, 0o600)
+                print("Serving conversions on {0} with {1} workers. Set {2}={0} to have conv.py use it.".format(
+                    self.address, self.workers, SERVER_ENV_VAR))
+                sys.stdout.flush()
+                self.server.serve_forever()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            if not tcp and os.path.exists(sock_address):
+                os.remove(sock_address)
+            if tcp and os.path.exists(get_token_path(sock_address[1])):
+                os.remove(get_token_path(sock_address[1]))
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
@@ -0,0 +1,117 @@
+import os
+
+from . import texture_utils
+
+# Environment variable that selects the backend when none is given on the command line
+BACKEND_ENV_VAR = "BWTEX_BACKEND"
+
+
+class CodecBackend(object):
+    """Image encoder/decoder implementation.
+
+    All backends must produce byte-identical output, see benchmarks/parity.py."""
+
+    name = None
+    description = ""
+
+    def is_available(self):
+        return True
+
+    def activate(self):
+        pass
+
+    def decode_image(self, image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+        raise NotImplementedError()
+
+    def encode_image(self, image, image_format, palette_format, mipmap_count=1):
+        raise NotImplementedError()
+
+
+class ReferenceBackend(CodecBackend):
+    name = "reference"
+    description = "Pure Python codecs in lib/texture_utils.py"
+
+    def activate(self):
+        texture_utils.USE_NATIVE_MODULES = False
+
+    def decode_image(self, image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+        return texture_utils.decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height)
+
+    def encode_image(self, image, image_format, palette_format, mipmap_count=1):
+        return texture_utils.encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
+
+
+class NativeBackend(ReferenceBackend):
+    name = "native"
+    description = "lib/texture_utils.py using pyfastbti/pyfasttextureutils where they apply"
+
+    def is_available(self):
+        return texture_utils.PY_FAST_BTI_INSTALLED or texture_utils.PY_FAST_TEXTURE_UTILS_INSTALLED
+
+    def activate(self):
+        texture_utils.USE_NATIVE_MODULES = True
+
+
+class NumpyBackend(CodecBackend):
+    name = "numpy"
+    description = "Vectorized codecs in lib/texture_utils_numpy.py"
+
+    def is_available(self):
+        return texture_utils.NUMPY_INSTALLED
+
+    def decode_image(self, image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+        from . import texture_utils_numpy
+        return texture_utils_numpy.decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height)
+
+    def encode_image(self, image, image_format, palette_format, mipmap_count=1):
+        from . import texture_utils_numpy
+        return texture_utils_numpy.encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
+
+
+BACKENDS = {}
+
+
+def register_backend(backend):
+    BACKENDS[backend.name] = backend
+
+
+register_backend(ReferenceBackend())
+register_backend(NativeBackend())
+register_backend(NumpyBackend())
+
+
+def get_available_backends():
+    return [name for name, backend in BACKENDS.items() if backend.is_available()]
+
+
+def get_default_backend_name():
+    name = os.environ.get(BACKEND_ENV_VAR)
+    if name:
+        return name
+    if BACKENDS["native"].is_available():
+        return "native"
+    return "reference"
+
+
+_current_backend = None
+
+
+def select_backend(name=None):
+    global _current_backend
+    if name is None:
+        name = get_default_backend_name()
+    if name not in BACKENDS:
+        raise RuntimeError("Unknown codec backend: {0}. Known backends: {1}".format(name, ", ".join(BACKENDS)))
+    backend = BACKENDS[name]
+    if not backend.is_available():
+        raise RuntimeError("Codec backend {0} is not available. Available backends: {1}".format(
+            name, ", ".join(get_available_backends())))
+    backend.activate()
+    _current_backend = backend
+    return backend
+
+
+def get_backend():
+    if _current_backend is None:
+        return select_backend()
+    return _current_backend
@@ -21,10 +21,15 @@ def read_all_bytes(data):
   return data.read()
 
 def read_bytes(data, offset, length):
+  if isinstance(data, BinaryView):
+    return data.read_bytes(offset, length)
   data.seek(offset)
   return data.read(length)
 
 def write_bytes(data, offset, raw_bytes):
+  if isinstance(data, BinaryView):
+    data.write_bytes(offset, raw_bytes)
+    return
   data.seek(offset)
   data.write(raw_bytes)
 
@@ -115,69 +120,218 @@ def write_str_with_null_byte(data, offset, new_string):
   write_str(data, offset, new_string, str_len+1)
 
 
+# Precompiled big endian structs, so the format strings aren't looked up again for every value
+U8 = struct.Struct(">B")
+U16 = struct.Struct(">H")
+U32 = struct.Struct(">I")
+FLOAT = struct.Struct(">f")
+S8 = struct.Struct(">b")
+S16 = struct.Struct(">h")
+S32 = struct.Struct(">i")
+
+_U16_ARRAY_STRUCTS = {}
+
+def _get_u16_array_struct(count):
+  array_struct = _U16_ARRAY_STRUCTS.get(count)
+  if array_struct is None:
+    array_struct = struct.Struct(">%dH" % count)
+    _U16_ARRAY_STRUCTS[count] = array_struct
+  return array_struct
+
+class BinaryView:
+  # Reads and writes big endian values at absolute offsets of a bytes-like buffer, without the
+  # seek and read of a file object for every value.
+  # Wrap a bytearray or a writable memoryview to write. A BytesIO is read from a copy of its
+  # current contents, so writes to the view don't reach the BytesIO.
+  # Unlike writing to a BytesIO, writes can't go past the end of the buffer.
+  
+  __slots__ = ("buffer",)
+  
+  def __init__(self, buffer):
+    if isinstance(buffer, BinaryView):
+      buffer = buffer.buffer
+    elif isinstance(buffer, BytesIO):
+      buffer = buffer.getvalue()
+    self.buffer = buffer
+  
+  def __len__(self):
+    return len(self.buffer)
+  
+  def read_bytes(self, offset, length):
+    return bytes(self.buffer[offset:offset+length])
+  
+  def u8(self, offset):
+    return U8.unpack_from(self.buffer, offset)[0]
+  
+  def u16(self, offset):
+    return U16.unpack_from(self.buffer, offset)[0]
+  
+  def u32(self, offset):
+    return U32.unpack_from(self.buffer, offset)[0]
+  
+  def float(self, offset):
+    return FLOAT.unpack_from(self.buffer, offset)[0]
+  
+  def s8(self, offset):
+    return S8.unpack_from(self.buffer, offset)[0]
+  
+  def s16(self, offset):
+    return S16.unpack_from(self.buffer, offset)[0]
+  
+  def s32(self, offset):
+    return S32.unpack_from(self.buffer, offset)[0]
+  
+  def u8_array(self, offset, count):
+    # Indexing or iterating over bytes already gives ints
+    if offset+count > len(self.buffer):
+      raise InvalidOffsetError("Offset 0x%X, length 0x%X is past the end of the data (length 0x%X)." % (offset, count, len(self.buffer)))
+    return bytes(self.buffer[offset:offset+count])
+  
+  def u16_array(self, offset, count):
+    return _get_u16_array_struct(count).unpack_from(self.buffer, offset)
+  
+  def write_bytes(self, offset, raw_bytes):
+    if offset+len(raw_bytes) > len(self.buffer):
+      raise InvalidOffsetError("Offset 0x%X, length 0x%X is past the end of the data (length 0x%X)." % (offset, len(raw_bytes), len(self.buffer)))
+    self.buffer[offset:offset+len(raw_bytes)] = raw_bytes
+  
+  def write_u8(self, offset, new_value):
+    U8.pack_into(self.buffer, offset, new_value)
+  
+  def write_u16(self, offset, new_value):
+    U16.pack_into(self.buffer, offset, new_value)
+  
+  def write_u32(self, offset, new_value):
+    U32.pack_into(self.buffer, offset, new_value)
+  
+  def write_float(self, offset, new_value):
+    FLOAT.pack_into(self.buffer, offset, new_value)
+  
+  def write_s8(self, offset, new_value):
+    S8.pack_into(self.buffer, offset, new_value)
+  
+  def write_s16(self, offset, new_value):
+    S16.pack_into(self.buffer, offset, new_value)
+  
+  def write_s32(self, offset, new_value):
+    S32.pack_into(self.buffer, offset, new_value)
+
+
+# The functions below take either a file object such as a BytesIO or a BinaryView.
+
 def read_u8(data, offset):
+  if isinstance(data, BinaryView):
+    return data.u8(offset)
   data.seek(offset)
-  return struct.unpack(">B", data.read(1))[0]
+  return U8.unpack(data.read(1))[0]
 
 def read_u16(data, offset):
+  if isinstance(data, BinaryView):
+    return data.u16(offset)
   data.seek(offset)
-  return struct.unpack(">H", data.read(2))[0]
+  return U16.unpack(data.read(2))[0]
 
 def read_u32(data, offset):
+  if isinstance(data, BinaryView):
+    return data.u32(offset)
   data.seek(offset)
-  return struct.unpack(">I", data.read(4))[0]
+  return U32.unpack(data.read(4))[0]
 
 def read_float(data, offset):
+  if isinstance(data, BinaryView):
+    return data.float(offset)
   data.seek(offset)
-  return struct.unpack(">f", data.read(4))[0]
+  return FLOAT.unpack(data.read(4))[0]
 
 
 def read_s8(data, offset):
+  if isinstance(data, BinaryView):
+    return data.s8(offset)
   data.seek(offset)
-  return struct.unpack(">b", data.read(1))[0]
+  return S8.unpack(data.read(1))[0]
 
 def read_s16(data, offset):
+  if isinstance(data, BinaryView):
+    return data.s16(offset)
   data.seek(offset)
-  return struct.unpack(">h", data.read(2))[0]
+  return S16.unpack(data.read(2))[0]
 
 def read_s32(data, offset):
+  if isinstance(data, BinaryView):
+    return data.s32(offset)
+  data.seek(offset)
+  return S32.unpack(data.read(4))[0]
+
+def read_u8_array(data, offset, count):
+  if isinstance(data, BinaryView):
+    return data.u8_array(offset, count)
+  data.seek(offset)
+  values = data.read(count)
+  if len(values) < count:
+    raise InvalidOffsetError("Offset 0x%X, length 0x%X is past the end of the data." % (offset, count))
+  return values
+
+def read_u16_array(data, offset, count):
+  if isinstance(data, BinaryView):
+    return data.u16_array(offset, count)
   data.seek(offset)
-  return struct.unpack(">i", data.read(4))[0]
+  return _get_u16_array_struct(count).unpack(data.read(count*2))
 
 
 def write_u8(data, offset, new_value):
-  new_value = struct.pack(">B", new_value)
+  if isinstance(data, BinaryView):
+    data.write_u8(offset, new_value)
+    return
+  new_value = U8.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
 def write_u16(data, offset, new_value):
-  new_value = struct.pack(">H", new_value)
+  if isinstance(data, BinaryView):
+    data.write_u16(offset, new_value)
+    return
+  new_value = U16.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
 def write_u32(data, offset, new_value):
-  new_value = struct.pack(">I", new_value)
+  if isinstance(data, BinaryView):
+    data.write_u32(offset, new_value)
+    return
+  new_value = U32.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
 def write_float(data, offset, new_value):
-  new_value = struct.pack(">f", new_value)
+  if isinstance(data, BinaryView):
+    data.write_float(offset, new_value)
+    return
+  new_value = FLOAT.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
 
 def write_s8(data, offset, new_value):
-  new_value = struct.pack(">b", new_value)
+  if isinstance(data, BinaryView):
+    data.write_s8(offset, new_value)
+    return
+  new_value = S8.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
 def write_s16(data, offset, new_value):
-  new_value = struct.pack(">h", new_value)
+  if isinstance(data, BinaryView):
+    data.write_s16(offset, new_value)
+    return
+  new_value = S16.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
 def write_s32(data, offset, new_value):
-  new_value = struct.pack(">i", new_value)
+  if isinstance(data, BinaryView):
+    data.write_s32(offset, new_value)
+    return
+  new_value = S32.pack(new_value)
   data.seek(offset)
   data.write(new_value)
 
@@ -0,0 +1,123 @@
+# Perceptual hashes for finding textures that look alike, e.g. recolors and slightly edited
+# copies. The hash is the sign pattern of the lowest frequencies of a map of how far each color
+# of the blurred image is from its average color, so small edits, compression and recolors only
+# flip a few of its 64 bits, and the number of differing bits (the Hamming distance) tells how
+# similar two images are.
+# Hashing the distance to the average color instead of the brightness is what keeps recolors
+# close: swapping red and blue changes the brightness of whole areas, but not the distances.
+# The blur is what keeps palette formats close: P4 and P8 turn smooth gradients into bands, and
+# without it the borders of the bands move the hash as much as a different image would.
+
+import numpy
+
+# The image is scaled to SAMPLE_SIZE x SAMPLE_SIZE and the lowest HASH_SIZE x HASH_SIZE frequencies are kept
+SAMPLE_SIZE = 32
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE*HASH_SIZE
+# Standard deviation of the gaussian blur of the sample, in sample pixels
+BLUR_SIGMA = 2.0
+
+
+def get_dct_matrix(size):
+    """Matrix of the orthonormal DCT-II, dct(x) = matrix @ x."""
+    k = numpy.arange(size)[:, numpy.newaxis]
+    n = numpy.arange(size)[numpy.newaxis, :]
+    matrix = numpy.cos(numpy.pi*(2*n + 1)*k/(2*size))*numpy.sqrt(2/size)
+    matrix[0] /= numpy.sqrt(2)
+    return matrix
+
+
+def get_blur_matrix(size, sigma):
+    """Matrix of a gaussian blur that repeats the values at the edges, blur(x) = matrix @ x."""
+    radius = int(3*sigma)
+    offsets = numpy.arange(-radius, radius+1)
+    weights = numpy.exp(-offsets*offsets/(2*sigma*sigma))
+    weights /= weights.sum()
+    matrix = numpy.zeros((size, size))
+    for offset, weight in zip(offsets, weights):
+        matrix[numpy.arange(size), numpy.clip(numpy.arange(size) + offset, 0, size-1)] += weight
+    return matrix
+
+DCT_MATRIX = get_dct_matrix(SAMPLE_SIZE)[:HASH_SIZE]
+BLUR_MATRIX = get_blur_matrix(SAMPLE_SIZE, BLUR_SIGMA)
+
+
+def get_color_distances(pixels):
+    """How far the color of each pixel is from the average color of all of them."""
+    return numpy.sqrt(((pixels - pixels.mean(axis=(0, 1)))**2).sum(axis=-1))
+
+
+def perceptual_hash(image):
+    """64 bit perceptual hash of a PIL image as an int. Transparent pixels count as black."""
+    from PIL import Image
+    sample = image.convert("RGBA").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BOX)
+    pixels = numpy.asarray(sample, dtype=numpy.float64)
+    colors = pixels[..., :3]*(pixels[..., 3:]/255)
+    # Blurs the rows and columns of each channel
+    colors = numpy.einsum("ij,jkc,lk->ilc", BLUR_MATRIX, colors, BLUR_MATRIX)
+
+    frequencies = (DCT_MATRIX @ get_color_distances(colors) @ DCT_MATRIX.T).ravel()
+    # The first one is the average, which says nothing about where the image differs
+    median = numpy.median(frequencies[1:])
+    bits = frequencies > median + 1e-6
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(hash_1, hash_2):
+    return bin(hash_1 ^ hash_2).count("1")
+
+
+class BKTree(object):
+    """Finds all hashes within a Hamming distance of a hash without comparing against every one.
+    Each node's children are keyed by their distance to it, and the triangle inequality rules
+    out every child whose distance is too far from the node's distance to the searched hash."""
+    def __init__(self, entries=()):
+        # A node is [hash, items with that hash, {distance: child node}]
+        self.root = None
+        self.size = 0
+        for value, item in entries:
+            self.add(value, item)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Returns (distance, item) for every item within max_distance of value, closest first."""
+        found = []
+        if self.root is None:
+            return found
+
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+
+        found.sort(key=lambda result: result[0])
+        return found
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+import functools
+
+
+class _Stage(object):
+    def __init__(self, profiler, name, pixels, blocks):
+        self.profiler = profiler
+        self.name = name
+        self.pixels = pixels
+        self.blocks = blocks
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        self.profiler.record(self.name, self.start, end, self.pixels, self.blocks)
+        return False
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.pixels = 0
+        self.blocks = 0
+
+
+class Profiler(object):
+    """Collects timings and pixel/block counters for the stages of a conversion.
+
+    Disabled by default, in which case stage() costs next to nothing."""
+
+    def __init__(self):
+        self.enabled = False
+        self.start = time.perf_counter()
+        self.stats = {}
+        self.events = []
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start = time.perf_counter()
+            self.stats = {}
+            self.events = []
+
+    def stage(self, name, pixels=0, blocks=0):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, pixels, blocks)
+
+    def record(self, name, start, end, pixels=0, blocks=0):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = StageStats(name)
+            stats.calls += 1
+            stats.seconds += end - start
+            stats.pixels += pixels
+            stats.blocks += blocks
+            self.events.append((name, start, end, threading.get_ident(), pixels, blocks))
+
+    def report(self):
+        wall = time.perf_counter() - self.start
+        lines = ["{0:<22} {1:>7} {2:>10} {3:>7} {4:>10} {5:>12}".format(
+                    "Stage", "Calls", "Total (s)", "% wall", "MPixels/s", "Blocks/s")]
+        for stats in self.stats.values():
+            if stats.pixels and stats.seconds > 0:
+                pixel_rate = "{0:.3f}".format(stats.pixels/stats.seconds/1000000)
+            else:
+                pixel_rate = "-"
+            if stats.blocks and stats.seconds > 0:
+                block_rate = "{0:.0f}".format(stats.blocks/stats.seconds)
+            else:
+                block_rate = "-"
+            lines.append("{0:<22} {1:>7} {2:>10.4f} {3:>7.1f} {4:>10} {5:>12}".format(
+                stats.name, stats.calls, stats.seconds, 100*stats.seconds/wall if wall > 0 else 0.0,
+                pixel_rate, block_rate))
+        lines.append("Wall time: {0:.4f}s".format(wall))
+        return "\n".join(lines)
+
+    def write_chrome_trace(self, path):
+        # Trace Event Format, can be opened in chrome://tracing or Perfetto
+        pid = os.getpid()
+        events = []
+        for name, start, end, tid, pixels, blocks in self.events:
+            events.append({
+                "name": name, "ph": "X", "pid": pid, "tid": tid,
+                "ts": (start - self.start)*1000000, "dur": (end - start)*1000000,
+                "args": {"pixels": pixels, "blocks": blocks}
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+PROFILER = Profiler()
+stage = PROFILER.stage
+
+
+def profiled(name):
+    # Decorator that times every call of a function as a stage
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -19,11 +19,7 @@ float_tripple_unpack = float_tripple.unpack
 
 
 def read_id(f):
-    c1 = f.read(1)
-    c2 = f.read(1)
-    c3 = f.read(1)
-    c4 = f.read(1)
-    return c4+c3+c2+c1
+    return f.read(4)[::-1]
 
 
 def write_id(f, val):
@@ -0,0 +1,91 @@
+# Measures how much of an image survives each texture format, used by conv.py --format auto.
+# The decoded pixels are reproduced with the same math as the codecs in texture_utils_numpy,
+# so the errors are what you would get from an actual encode and decode.
+
+import numpy
+
+from .texture_utils import ImageFormat, IMAGE_FORMATS_THAT_USE_PALETTES, MAX_COLORS_FOR_IMAGE_FORMAT
+from .texture_utils_numpy import (
+    image_to_array, image_to_blocks, blocks_to_image, swizzle_4_bit_to_8_bit,
+    convert_rgb_to_greyscale, convert_colors_to_rgb5a3, convert_rgb5a3_to_colors,
+    encode_cmpr_blocks, decode_cmpr_blocks
+)
+from .profiling import stage
+
+ALPHA_NONE = "none"
+ALPHA_BINARY = "binary"
+ALPHA_GRADED = "graded"
+
+
+class ImageAnalysis(object):
+    def __init__(self, image):
+        self.image = image.convert("RGBA")
+        self.width, self.height = self.image.size
+
+        with stage("analyze", pixels=self.width*self.height):
+            self.pixels = image_to_array(self.image)
+            r, g, b, a = self.pixels[..., 0], self.pixels[..., 1], self.pixels[..., 2], self.pixels[..., 3]
+
+            self.grey = convert_rgb_to_greyscale(r, g, b)
+            # Largest difference between a color channel and the intensity that greyscale formats would store
+            self.max_grey_deviation = int(numpy.abs(self.pixels[..., :3] - self.grey[..., numpy.newaxis]).max(initial=0))
+            self.greyscale = self.max_grey_deviation == 0
+
+            if numpy.all(a == 255):
+                self.alpha = ALPHA_NONE
+            elif numpy.all((a == 0) | (a == 255)):
+                self.alpha = ALPHA_BINARY
+            else:
+                self.alpha = ALPHA_GRADED
+
+            packed = (r.astype(numpy.uint32) << 24) | (g.astype(numpy.uint32) << 16) | (b.astype(numpy.uint32) << 8) | a.astype(numpy.uint32)
+            self.unique_colors = len(numpy.unique(packed))
+
+        self._errors = {}
+
+    def get_decoded_pixels(self, image_format):
+        """Returns the pixels the image would have after being encoded in image_format and decoded again."""
+        pixels = self.pixels
+        a = pixels[..., 3]
+        decoded = numpy.empty(pixels.shape, dtype=numpy.int32)
+
+        if image_format == ImageFormat.I4:
+            decoded[...] = swizzle_4_bit_to_8_bit(self.grey >> 4)[..., numpy.newaxis]
+        elif image_format == ImageFormat.I8:
+            decoded[...] = self.grey[..., numpy.newaxis]
+        elif image_format == ImageFormat.IA4:
+            decoded[..., :3] = swizzle_4_bit_to_8_bit(self.grey >> 4)[..., numpy.newaxis]
+            decoded[..., 3] = swizzle_4_bit_to_8_bit(a >> 4)
+        elif image_format == ImageFormat.IA8:
+            decoded[..., :3] = self.grey[..., numpy.newaxis]
+            decoded[..., 3] = a
+        elif image_format == ImageFormat.RGBA32:
+            decoded[...] = pixels
+        elif image_format in IMAGE_FORMATS_THAT_USE_PALETTES:
+            # Same quantization as texture_utils.encode_image, then the RGB5A3 palette
+            quantized = self.image.quantize(MAX_COLORS_FOR_IMAGE_FORMAT[image_format]).convert("RGBA")
+            decoded = convert_rgb5a3_to_colors(convert_colors_to_rgb5a3(image_to_array(quantized)))
+        elif image_format == ImageFormat.CMPR:
+            blocks, valid = image_to_blocks(pixels, image_format, self.width, self.height)
+            data = numpy.frombuffer(encode_cmpr_blocks(blocks, valid).tobytes(), dtype=numpy.uint8)
+            decoded = blocks_to_image(decode_cmpr_blocks(data.reshape(-1, 32).astype(numpy.int32)), image_format, self.width, self.height)
+        else:
+            raise Exception("Unsupported image format: %s" % ImageFormat(image_format).name)
+
+        return decoded
+
+    def get_error(self, image_format):
+        """Root mean square error over all four channels (0-255) after a round trip through image_format."""
+        if image_format not in self._errors:
+            with stage("analyze_" + image_format.name, pixels=self.width*self.height):
+                difference = self.get_decoded_pixels(image_format) - self.pixels
+                if difference.size == 0:
+                    self._errors[image_format] = 0.0
+                else:
+                    self._errors[image_format] = float(numpy.sqrt(numpy.mean(difference*difference)))
+        return self._errors[image_format]
+
+    def summary(self):
+        return "{0}x{1}, greyscale: {2}, alpha: {3}, unique colors: {4}".format(
+            self.width, self.height, "yes" if self.greyscale else "no (off by up to {0})".format(self.max_grey_deviation),
+            self.alpha, self.unique_colors)
@@ -0,0 +1,169 @@
+# Measures how close the decoded pixels of a texture are to the image it was encoded from, so that
+# changes to the encoders can be judged by numbers instead of by eye. Everything is computed on
+# whole arrays at once, which keeps the cost small next to the encode itself.
+
+import math
+
+import numpy
+
+from .texture_utils import BLOCK_WIDTHS, BLOCK_HEIGHTS
+from .texture_utils_numpy import image_to_array
+
+CHANNELS = ("r", "g", "b", "a")
+# Number of blocks with the largest error that are reported by default
+DEFAULT_WORST_BLOCKS = 10
+# Width and height of the windows SSIM compares. A box window instead of the usual gaussian one,
+# so the window sums come from cumulative sums in a few array operations.
+SSIM_WINDOW = 8
+SSIM_C1 = (0.01*255)**2
+SSIM_C2 = (0.03*255)**2
+
+
+def get_psnr(mse):
+    """Peak signal to noise ratio in dB for a mean squared error of 0-255 values, inf if there is no error."""
+    if mse == 0:
+        return math.inf
+    return 10*math.log10(255*255/mse)
+
+
+def get_window_sums(values, size):
+    """Sum of every size x size window of values, an integer array of (..., height, width, channels)."""
+    sums = numpy.zeros(values.shape[:-3] + (values.shape[-3]+1, values.shape[-2]+1, values.shape[-1]), dtype=numpy.int64)
+    inner = sums[..., 1:, 1:, :]
+    inner[...] = values
+    # The sums of integers are exact, unlike those of floats
+    numpy.cumsum(inner, axis=-3, out=inner)
+    numpy.cumsum(inner, axis=-2, out=inner)
+    return (sums[..., size:, size:, :] - sums[..., :-size, size:, :]
+            - sums[..., size:, :-size, :] + sums[..., :-size, :-size, :])
+
+
+def get_ssim(reference, decoded, window=SSIM_WINDOW):
+    """Mean structural similarity of each channel, 1.0 for identical images."""
+    # Images smaller than a window are compared as a whole
+    window = max(min(window, reference.shape[0], reference.shape[1]), 1)
+    x = reference.astype(numpy.int64)
+    y = decoded.astype(numpy.int64)
+
+    # All five window sums at once
+    sums = get_window_sums(numpy.stack((x, y, x*x, y*y, x*y)), window)
+    mean_x, mean_y, mean_xx, mean_yy, mean_xy = sums/(window*window)
+    mean_x_y = mean_x*mean_y
+    mean_x_2 = mean_x*mean_x
+    mean_y_2 = mean_y*mean_y
+
+    ssim = (((2*mean_x_y + SSIM_C1)*(2*(mean_xy - mean_x_y) + SSIM_C2))
+            / ((mean_x_2 + mean_y_2 + SSIM_C1)*((mean_xx - mean_x_2) + (mean_yy - mean_y_2) + SSIM_C2)))
+    return ssim.mean(axis=(0, 1))
+
+
+def get_block_errors(squared_errors, absolute_errors, block_width, block_height):
+    """Mean squared error over all channels and the largest error of every block of the image.
+    Both are arrays of (blocks tall, blocks wide). Blocks at the right and bottom edge only count
+    the pixels inside the image."""
+    height, width = squared_errors.shape[:2]
+    blocks_wide = (width + block_width-1)//block_width
+    blocks_tall = (height + block_height-1)//block_height
+    padding = ((0, blocks_tall*block_height-height), (0, blocks_wide*block_width-width), (0, 0))
+
+    shape = (blocks_tall, block_height, blocks_wide, block_width, squared_errors.shape[2])
+    block_sums = numpy.pad(squared_errors, padding).reshape(shape).sum(axis=(1, 3, 4))
+    block_max = numpy.pad(absolute_errors, padding).reshape(shape).max(axis=(1, 3, 4))
+
+    # Pixels inside the image per block row and column
+    rows = numpy.minimum(height - numpy.arange(blocks_tall)*block_height, block_height)
+    columns = numpy.minimum(width - numpy.arange(blocks_wide)*block_width, block_width)
+    counts = rows[:, numpy.newaxis]*columns[numpy.newaxis, :]*squared_errors.shape[2]
+    return block_sums/counts, block_max
+
+
+class TextureMetrics(object):
+    """Errors of decoded compared to reference, both arrays of RGBA values of (height, width, 4).
+    The worst blocks are those of image_format, an ImageFormat, or 4x4 pixels without one.
+
+    mse, psnr and ssim hold one value per channel in the order of CHANNELS, rgb_psnr is the PSNR
+    of the color channels together. worst_blocks holds dicts with the x, y, width and height of
+    the blocks with the largest mean squared error and that error, largest first."""
+    def __init__(self, reference, decoded, image_format=None, worst=DEFAULT_WORST_BLOCKS):
+        if reference.shape != decoded.shape:
+            raise ValueError("Cannot compare images of different sizes: {0}x{1} and {2}x{3}".format(
+                reference.shape[1], reference.shape[0], decoded.shape[1], decoded.shape[0]))
+        self.height, self.width = reference.shape[:2]
+
+        difference = decoded.astype(numpy.int32) - reference.astype(numpy.int32)
+        absolute_errors = numpy.abs(difference)
+        squared_errors = (difference*difference).astype(numpy.float64)
+
+        self.mse = squared_errors.mean(axis=(0, 1)).tolist()
+        self.psnr = [get_psnr(mse) for mse in self.mse]
+        self.rgb_psnr = get_psnr(sum(self.mse[:3])/3)
+        self.ssim = get_ssim(reference, decoded).tolist()
+        self.max_error = int(absolute_errors.max(initial=0))
+        self.alpha_max_error = int(absolute_errors[..., 3].max(initial=0))
+        self.alpha_mean_error = float(absolute_errors[..., 3].mean()) if absolute_errors.size else 0.0
+
+        if image_format is not None:
+            block_width, block_height = BLOCK_WIDTHS[image_format], BLOCK_HEIGHTS[image_format]
+        else:
+            block_width, block_height = 4, 4
+        self.worst_blocks = self.find_worst_blocks(squared_errors, absolute_errors, block_width, block_height, worst)
+
+    @staticmethod
+    def find_worst_blocks(squared_errors, absolute_errors, block_width, block_height, count):
+        if count <= 0 or squared_errors.size == 0:
+            return []
+        block_mse, block_max = get_block_errors(squared_errors, absolute_errors, block_width, block_height)
+        flat_mse = block_mse.ravel()
+        count = min(count, flat_mse.size)
+        # Only sort the blocks that can be among the worst
+        candidates = numpy.argpartition(flat_mse, flat_mse.size-count)[flat_mse.size-count:]
+        candidates = candidates[numpy.argsort(-flat_mse[candidates], kind="stable")]
+
+        blocks_wide = block_mse.shape[1]
+        height, width = squared_errors.shape[:2]
+        worst = []
+        for i in candidates:
+            if flat_mse[i] == 0:
+                break
+            x = int(i % blocks_wide)*block_width
+            y = int(i // blocks_wide)*block_height
+            worst.append({"x": x, "y": y, "width": min(block_width, width-x), "height": min(block_height, height-y),
+                          "mse": float(flat_mse[i]), "max_error": int(block_max.flat[i])})
+        return worst
+
+    @property
+    def min_psnr(self):
+        """PSNR of the channel with the largest error."""
+        return min(self.psnr)
+
+    @classmethod
+    def from_images(cls, reference, decoded, image_format=None, worst=DEFAULT_WORST_BLOCKS):
+        """Compares two PIL images."""
+        return cls(image_to_array(reference), image_to_array(decoded), image_format, worst)
+
+    def to_dict(self):
+        """The metrics as a dict that can be written as JSON. PSNR is None where there is no error."""
+        def psnr_value(psnr):
+            return None if math.isinf(psnr) else round(psnr, 3)
+
+        return {
+            "width": self.width,
+            "height": self.height,
+            "psnr": {channel: psnr_value(psnr) for channel, psnr in zip(CHANNELS, self.psnr)},
+            "rgb_psnr": psnr_value(self.rgb_psnr),
+            "ssim": {channel: round(ssim, 5) for channel, ssim in zip(CHANNELS, self.ssim)},
+            "mse": {channel: round(mse, 4) for channel, mse in zip(CHANNELS, self.mse)},
+            "max_error": self.max_error,
+            "alpha_max_error": self.alpha_max_error,
+            "alpha_mean_error": round(self.alpha_mean_error, 4),
+            "worst_blocks": [dict(block, mse=round(block["mse"], 4)) for block in self.worst_blocks],
+        }
+
+    def summary(self):
+        """The main numbers on one line."""
+        return "PSNR {0} dB, SSIM {1:.4f}, alpha error max {2} mean {3:.2f}".format(
+            format_psnr(self.rgb_psnr), sum(self.ssim[:3])/3, self.alpha_max_error, self.alpha_mean_error)
+
+
+def format_psnr(psnr):
+    return "inf" if math.isinf(psnr) else "{0:.2f}".format(psnr)
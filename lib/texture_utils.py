@@ -1,11 +1,12 @@
 
-from PIL import Image
 from io import BytesIO
 import colorsys
+import importlib.util
 from enum import Enum
 import operator
 
 from .fs_helpers import *
+from .profiling import stage
 
 try:
   import pyfastbti
@@ -19,6 +20,13 @@ try:
 except ImportError:
   PY_FAST_TEXTURE_UTILS_INSTALLED = False
 
+# Lets the pure Python reference codec be selected even when the native modules are installed. See codec_backends.
+USE_NATIVE_MODULES = True
+
+# PIL and numpy are only imported by the functions that use them, which keeps reading
+# texture headers fast.
+NUMPY_INSTALLED = importlib.util.find_spec("numpy") is not None
+
 class TooManyColorsError(Exception):
   pass
 
@@ -110,6 +118,11 @@ MAX_COLORS_FOR_IMAGE_FORMAT = {
 
 
 
+def get_num_blocks(image_format, image_width, image_height):
+  blocks_wide = (image_width + (BLOCK_WIDTHS[image_format]-1)) // BLOCK_WIDTHS[image_format]
+  blocks_tall = (image_height + (BLOCK_HEIGHTS[image_format]-1)) // BLOCK_HEIGHTS[image_format]
+  return blocks_wide*blocks_tall
+
 def get_rgba(color):
   if len(color) == 4:
     r, g, b, a = color
@@ -285,7 +298,7 @@ def get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565):
   return colors
 
 def get_best_cmpr_key_colors(all_colors):
-  if PY_FAST_BTI_INSTALLED:
+  if PY_FAST_BTI_INSTALLED and USE_NATIVE_MODULES:
     return pyfastbti.get_best_cmpr_key_colors(all_colors)
   
   max_dist = -1
@@ -504,12 +517,9 @@ def decode_palettes(palette_data, palette_format, num_colors, image_format):
     return []
   
   colors = []
-  offset = 0
-  for i in range(num_colors):
-    raw_color = read_u16(palette_data, offset)
+  for raw_color in read_u16_array(palette_data, 0, num_colors):
     color = decode_color(raw_color, palette_format)
     colors.append(color)
-    offset += 2
   
   return colors
 
@@ -604,12 +614,19 @@ def encode_palette(encoded_colors, palette_format, image_format):
 
 
 def decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+  num_blocks = get_num_blocks(image_format, image_width, image_height)
+  with stage("decode_image", pixels=image_width*image_height, blocks=num_blocks):
+    return _decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height)
+
+def _decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
   colors = decode_palettes(palette_data, palette_format, num_colors, image_format)
+  image_data = BinaryView(image_data)
   
   block_width = BLOCK_WIDTHS[image_format]
   block_height = BLOCK_HEIGHTS[image_format]
   block_data_size = BLOCK_DATA_SIZES[image_format]
   
+  from PIL import Image
   image = Image.new("RGBA", (image_width, image_height), (0, 0, 0, 0))
   pixels = image.load()
   offset = 0
@@ -665,8 +682,7 @@ def decode_block(image_format, image_data, offset, block_data_size, colors):
 def decode_i4_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for byte_index in range(block_data_size):
-    byte = read_u8(image_data, offset+byte_index)
+  for byte in read_u8_array(image_data, offset, block_data_size):
     for nibble_index in range(2):
       i4 = (byte >> (1-nibble_index)*4) & 0xF
       color = convert_i4_to_color(i4)
@@ -678,8 +694,7 @@ def decode_i4_block(image_format, image_data, offset, block_data_size, colors):
 def decode_i8_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size):
-    i8 = read_u8(image_data, offset+i)
+  for i8 in read_u8_array(image_data, offset, block_data_size):
     color = convert_i8_to_color(i8)
     
     pixel_color_data.append(color)
@@ -689,8 +704,7 @@ def decode_i8_block(image_format, image_data, offset, block_data_size, colors):
 def decode_ia4_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size):
-    ia4 = read_u8(image_data, offset+i)
+  for ia4 in read_u8_array(image_data, offset, block_data_size):
     color = convert_ia4_to_color(ia4)
     
     pixel_color_data.append(color)
@@ -700,8 +714,7 @@ def decode_ia4_block(image_format, image_data, offset, block_data_size, colors):
 def decode_ia8_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size//2):
-    ia8 = read_u16(image_data, offset+i*2)
+  for ia8 in read_u16_array(image_data, offset, block_data_size//2):
     color = convert_ia8_to_color(ia8)
     
     pixel_color_data.append(color)
@@ -711,8 +724,7 @@ def decode_ia8_block(image_format, image_data, offset, block_data_size, colors):
 def decode_rgb565_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size//2):
-    rgb565 = read_u16(image_data, offset+i*2)
+  for rgb565 in read_u16_array(image_data, offset, block_data_size//2):
     color = convert_rgb565_to_color(rgb565)
     
     pixel_color_data.append(color)
@@ -722,8 +734,7 @@ def decode_rgb565_block(image_format, image_data, offset, block_data_size, color
 def decode_rgb5a3_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size//2):
-    rgb5a3 = read_u16(image_data, offset+i*2)
+  for rgb5a3 in read_u16_array(image_data, offset, block_data_size//2):
     color = convert_rgb5a3_to_color(rgb5a3)
     
     pixel_color_data.append(color)
@@ -733,11 +744,13 @@ def decode_rgb5a3_block(image_format, image_data, offset, block_data_size, color
 def decode_rgba32_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
+  # The alpha and red values of all 16 pixels come first, then the green and blue ones
+  block = read_u8_array(image_data, offset, 64)
   for i in range(16):
-    a = read_u8(image_data, offset+(i*2))
-    r = read_u8(image_data, offset+(i*2)+1)
-    g = read_u8(image_data, offset+(i*2)+32)
-    b = read_u8(image_data, offset+(i*2)+33)
+    a = block[(i*2)]
+    r = block[(i*2)+1]
+    g = block[(i*2)+32]
+    b = block[(i*2)+33]
     color = (r, g, b, a)
     
     pixel_color_data.append(color)
@@ -747,8 +760,7 @@ def decode_rgba32_block(image_format, image_data, offset, block_data_size, color
 def decode_c4_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for byte_index in range(block_data_size):
-    byte = read_u8(image_data, offset+byte_index)
+  for byte in read_u8_array(image_data, offset, block_data_size):
     for nibble_index in range(2):
       color_index = (byte >> (1-nibble_index)*4) & 0xF
       if color_index >= len(colors):
@@ -764,8 +776,7 @@ def decode_c4_block(image_format, image_data, offset, block_data_size, colors):
 def decode_c8_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size):
-    color_index = read_u8(image_data, offset+i)
+  for color_index in read_u8_array(image_data, offset, block_data_size):
     if color_index >= len(colors):
       # This block bleeds past the edge of the image
       color = None
@@ -779,8 +790,8 @@ def decode_c8_block(image_format, image_data, offset, block_data_size, colors):
 def decode_c14x2_block(image_format, image_data, offset, block_data_size, colors):
   pixel_color_data = []
   
-  for i in range(block_data_size//2):
-    color_index = read_u16(image_data, offset+i*2) & 0x3FFF
+  for color_index in read_u16_array(image_data, offset, block_data_size//2):
+    color_index &= 0x3FFF
     if color_index >= len(colors):
       # This block bleeds past the edge of the image
       color = None
@@ -821,13 +832,20 @@ def decode_cmpr_block(image_format, image_data, offset, block_data_size, colors)
 
 
 def encode_image_from_path(new_image_file_path, image_format, palette_format, mipmap_count=1):
+  from PIL import Image
   image = Image.open(new_image_file_path)
   image_width, image_height = image.size
   new_image_data, new_palette_data, encoded_colors = encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
   return (new_image_data, new_palette_data, encoded_colors, image_width, image_height)
 
 def encode_image(image, image_format, palette_format, mipmap_count=1):
-  image = image.convert("RGBA")
+  with stage("encode_image", pixels=image.width*image.height):
+    return _encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
+
+def _encode_image(image, image_format, palette_format, mipmap_count=1):
+  from PIL import Image
+  with stage("convert"):
+    image = image.convert("RGBA")
   image_width, image_height = image.size
   
   if mipmap_count < 1:
@@ -838,10 +856,12 @@ def encode_image(image, image_format, palette_format, mipmap_count=1):
     if max_colors <= 256:
       # Pillow's quantize method only supports up to 256 max colors.
       # So for C14X2 the image must be quantized by custom Python code instead (slower).
-      image = image.quantize(max_colors)
-      image = image.convert("RGBA")
+      with stage("quantize", pixels=image_width*image_height):
+        image = image.quantize(max_colors)
+        image = image.convert("RGBA")
   
-  encoded_colors, colors_to_color_indexes = generate_new_palettes_from_image(image, image_format, palette_format)
+  with stage("generate_palette", pixels=image_width*image_height):
+    encoded_colors, colors_to_color_indexes = generate_new_palettes_from_image(image, image_format, palette_format)
   
   new_image_data = BytesIO()
   mipmap_image = image
@@ -867,6 +887,11 @@ def encode_image(image, image_format, palette_format, mipmap_count=1):
   return (new_image_data, new_palette_data, encoded_colors)
 
 def encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height):
+  num_blocks = get_num_blocks(image_format, image_width, image_height)
+  with stage("encode_mipmap_image", pixels=image_width*image_height, blocks=num_blocks):
+    return _encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height)
+
+def _encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height):
   pixels = image.load()
   offset_in_image_data = 0
   block_x = 0
@@ -921,7 +946,7 @@ def encode_image_to_block(image_format, pixels, colors_to_color_indexes, block_x
     raise Exception("Unknown image format: %s" % ImageFormat(image_format).name)
 
 def encode_image_to_i4_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.I4]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -947,11 +972,10 @@ def encode_image_to_i4_block(pixels, colors_to_color_indexes, block_x, block_y,
       write_u8(new_data, offset, byte)
       offset += 1
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_i8_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.I8]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -967,11 +991,10 @@ def encode_image_to_i8_block(pixels, colors_to_color_indexes, block_x, block_y,
       write_u8(new_data, offset, i8)
       offset += 1
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_ia4_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.IA4]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -987,11 +1010,10 @@ def encode_image_to_ia4_block(pixels, colors_to_color_indexes, block_x, block_y,
       write_u8(new_data, offset, ia4)
       offset += 1
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_ia8_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.IA8]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -1007,11 +1029,10 @@ def encode_image_to_ia8_block(pixels, colors_to_color_indexes, block_x, block_y,
       write_u16(new_data, offset, ia8)
       offset += 2
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_rgb563_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.RGB565]))
   offset = 0
   for y in range(block_y, block_y+block_height):
     for x in range(block_x, block_x+block_width):
@@ -1025,11 +1046,10 @@ def encode_image_to_rgb563_block(pixels, colors_to_color_indexes, block_x, block
       write_u16(new_data, offset, rgb565)
       offset += 2
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_rgb5a3_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.RGB5A3]))
   offset = 0
   for y in range(block_y, block_y+block_height):
     for x in range(block_x, block_x+block_width):
@@ -1043,11 +1063,10 @@ def encode_image_to_rgb5a3_block(pixels, colors_to_color_indexes, block_x, block
       write_u16(new_data, offset, rgb5a3)
       offset += 2
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_rgba32_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.RGBA32]))
   for i in range(16):
     x = block_x + (i % block_width)
     y = block_y + (i // block_width)
@@ -1063,11 +1082,10 @@ def encode_image_to_rgba32_block(pixels, colors_to_color_indexes, block_x, block
     write_u8(new_data, (i*2)+32, g)
     write_u8(new_data, (i*2)+33, b)
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_c4_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.C4]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -1093,11 +1111,10 @@ def encode_image_to_c4_block(pixels, colors_to_color_indexes, block_x, block_y,
       write_u8(new_data, offset, byte)
       offset += 1
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_c8_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.C8]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -1112,11 +1129,10 @@ def encode_image_to_c8_block(pixels, colors_to_color_indexes, block_x, block_y,
       write_u8(new_data, offset, color_index)
       offset += 1
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_c14x2_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.C14X2]))
   offset = 0
   
   for y in range(block_y, block_y+block_height):
@@ -1131,11 +1147,10 @@ def encode_image_to_c14x2_block(pixels, colors_to_color_indexes, block_x, block_
       write_u16(new_data, offset, color_index)
       offset += 2
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
 
 def encode_image_to_cmpr_block(pixels, colors_to_color_indexes, block_x, block_y, block_width, block_height, image_width, image_height):
-  new_data = BytesIO()
+  new_data = BinaryView(bytearray(BLOCK_DATA_SIZES[ImageFormat.CMPR]))
   subblock_offset = 0
   for subblock_index in range(4):
     subblock_x = block_x + (subblock_index%2)*4
@@ -1199,16 +1214,112 @@ def encode_image_to_cmpr_block(pixels, colors_to_color_indexes, block_x, block_y
     
     subblock_offset += 8
   
-  new_data.seek(0)
-  return new_data.read()
+  return bytes(new_data.buffer)
+
+def get_unchanged_blocks(image, original_image, image_format):
+  # Compares an edited image against the decoded original one block at a time.
+  # Returns a list of booleans in block order (the order blocks are stored in the image data), True for blocks whose pixels are identical.
+  image = image.convert("RGBA")
+  original_image = original_image.convert("RGBA")
+  if image.size != original_image.size:
+    raise Exception("Image size %dx%d does not match the original size %dx%d" % (image.width, image.height, original_image.width, original_image.height))
+  
+  block_width = BLOCK_WIDTHS[image_format]
+  block_height = BLOCK_HEIGHTS[image_format]
+  blocks_wide = (image.width + (block_width-1)) // block_width
+  blocks_tall = (image.height + (block_height-1)) // block_height
+  
+  if not NUMPY_INSTALLED:
+    unchanged_blocks = []
+    for block_y in range(0, blocks_tall*block_height, block_height):
+      for block_x in range(0, blocks_wide*block_width, block_width):
+        box = (block_x, block_y, block_x+block_width, block_y+block_height)
+        unchanged_blocks.append(image.crop(box).tobytes() == original_image.crop(box).tobytes())
+    return unchanged_blocks
+  
+  import numpy
+  padded_shape = (blocks_tall*block_height, blocks_wide*block_width, 4)
+  different = numpy.zeros(padded_shape, dtype=bool)
+  different[:image.height, :image.width] = (
+    numpy.asarray(image, dtype=numpy.uint8) != numpy.asarray(original_image, dtype=numpy.uint8)
+  )
+  different = different.reshape(blocks_tall, block_height, blocks_wide, block_width, 4)
+  changed_blocks = different.any(axis=(1, 3, 4))
+  return (~changed_blocks).ravel().tolist()
+
+def encode_image_reusing_blocks(image, image_format, palette_format, unchanged_blocks, original_image_data, original_palette_data=None, original_num_colors=0):
+  # Encodes a single mipmap, copying the encoded data of unchanged blocks verbatim from the original image data and only encoding the blocks that changed.
+  # Paletted formats keep the original palette, so this only works if every color in the new image is already in it.
+  # Returns None when the original data can't be reused, in which case the caller should encode the whole image normally.
+  image = image.convert("RGBA")
+  image_width, image_height = image.size
+  
+  block_width = BLOCK_WIDTHS[image_format]
+  block_height = BLOCK_HEIGHTS[image_format]
+  block_data_size = BLOCK_DATA_SIZES[image_format]
+  blocks_wide = (image_width + (block_width-1)) // block_width
+  blocks_tall = (image_height + (block_height-1)) // block_height
+  if len(unchanged_blocks) != blocks_wide*blocks_tall:
+    return None
+  if data_len(original_image_data) < blocks_wide*blocks_tall*block_data_size:
+    return None
+  
+  if image_format in IMAGE_FORMATS_THAT_USE_PALETTES:
+    # Palette sections may be padded past the number of colors the format can index.
+    original_num_colors = min(original_num_colors, MAX_COLORS_FOR_IMAGE_FORMAT[image_format])
+    colors = decode_palettes(original_palette_data, palette_format, original_num_colors, image_format)
+    colors_to_color_indexes = {}
+    for color_index, color in enumerate(colors):
+      if color not in colors_to_color_indexes:
+        colors_to_color_indexes[color] = color_index
+    
+    image_colors = image.getcolors(max(len(colors_to_color_indexes), 1))
+    if image_colors is None:
+      # More distinct colors than the original palette has.
+      return None
+    for count, color in image_colors:
+      if color not in colors_to_color_indexes:
+        return None
+    
+    encoded_colors = list(read_u16_array(original_palette_data, 0, original_num_colors))
+    new_palette_data = make_copy_data(original_palette_data)
+  else:
+    colors_to_color_indexes = {}
+    encoded_colors = []
+    new_palette_data = BytesIO()
+  
+  pixels = image.load()
+  new_image_data = BytesIO()
+  offset = 0
+  num_changed_blocks = len(unchanged_blocks) - sum(unchanged_blocks)
+  with stage("encode_changed_blocks", pixels=image_width*image_height, blocks=num_changed_blocks):
+    for block_index, unchanged in enumerate(unchanged_blocks):
+      if unchanged:
+        block_data = read_bytes(original_image_data, offset, block_data_size)
+      else:
+        block_x = (block_index % blocks_wide)*block_width
+        block_y = (block_index // blocks_wide)*block_height
+        block_data = encode_image_to_block(
+          image_format,
+          pixels, colors_to_color_indexes,
+          block_x, block_y, block_width, block_height, image_width, image_height
+        )
+      
+      assert len(block_data) == block_data_size
+      
+      write_bytes(new_image_data, offset, block_data)
+      offset += block_data_size
+  
+  return (new_image_data, new_palette_data, encoded_colors)
 
 def color_exchange(image, base_color, replacement_color, mask_path=None, validate_mask_colors=True, ignore_bright=False):
+  from PIL import Image
   if mask_path:
     mask_image = Image.open(mask_path).convert("RGBA")
     if image.size != mask_image.size:
       raise Exception("Mask image is not the same size as the texture.")
   
-  if PY_FAST_TEXTURE_UTILS_INSTALLED:
+  if PY_FAST_TEXTURE_UTILS_INSTALLED and USE_NATIVE_MODULES:
     image_bytes = image.tobytes()
     
     if mask_path:
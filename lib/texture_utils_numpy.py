@@ -0,0 +1,465 @@
+# Vectorized versions of the image codecs in texture_utils.
+# Every function here has to produce exactly the same bytes and pixels as its counterpart in texture_utils,
+# benchmarks/parity.py checks that.
+
+import numpy
+from PIL import Image
+from io import BytesIO
+
+from . import texture_utils
+from .texture_utils import (
+    ImageFormat, PaletteFormat, BLOCK_WIDTHS, BLOCK_HEIGHTS, BLOCK_DATA_SIZES,
+    IMAGE_FORMATS_THAT_USE_PALETTES, MAX_COLORS_FOR_IMAGE_FORMAT,
+    decode_palettes, encode_palette, get_num_blocks
+)
+from .profiling import stage
+
+
+def swizzle_3_bit_to_8_bit(v):
+    return (v << 5) | (v << 2) | (v >> 1)
+
+
+def swizzle_4_bit_to_8_bit(v):
+    return (v << 4) | v
+
+
+def swizzle_5_bit_to_8_bit(v):
+    return (v << 3) | (v >> 2)
+
+
+def swizzle_6_bit_to_8_bit(v):
+    return (v << 2) | (v >> 4)
+
+
+def convert_rgb_to_greyscale(r, g, b):
+    # Same as round(((r * 30) + (g * 59) + (b * 11)) / 100) including Python's round-half-to-even
+    total = r*30 + g*59 + b*11
+    quotient, remainder = numpy.divmod(total, 100)
+    return quotient + (remainder > 50) + ((remainder == 50) & (quotient % 2 == 1))
+
+
+def convert_rgb565_to_colors(rgb565):
+    colors = numpy.empty(rgb565.shape + (4,), dtype=numpy.int32)
+    colors[..., 0] = swizzle_5_bit_to_8_bit((rgb565 >> 11) & 0x1F)
+    colors[..., 1] = swizzle_6_bit_to_8_bit((rgb565 >> 5) & 0x3F)
+    colors[..., 2] = swizzle_5_bit_to_8_bit(rgb565 & 0x1F)
+    colors[..., 3] = 255
+    return colors
+
+
+def convert_rgb5a3_to_colors(rgb5a3):
+    colors = numpy.empty(rgb5a3.shape + (4,), dtype=numpy.int32)
+    opaque = (rgb5a3 & 0x8000) != 0
+    colors[..., 0] = numpy.where(opaque, swizzle_5_bit_to_8_bit((rgb5a3 >> 10) & 0x1F), swizzle_4_bit_to_8_bit((rgb5a3 >> 8) & 0xF))
+    colors[..., 1] = numpy.where(opaque, swizzle_5_bit_to_8_bit((rgb5a3 >> 5) & 0x1F), swizzle_4_bit_to_8_bit((rgb5a3 >> 4) & 0xF))
+    colors[..., 2] = numpy.where(opaque, swizzle_5_bit_to_8_bit(rgb5a3 & 0x1F), swizzle_4_bit_to_8_bit(rgb5a3 & 0xF))
+    colors[..., 3] = numpy.where(opaque, 255, swizzle_3_bit_to_8_bit((rgb5a3 >> 12) & 0x7))
+    return colors
+
+
+def convert_colors_to_rgb565(colors):
+    r, g, b = colors[..., 0], colors[..., 1], colors[..., 2]
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+
+def convert_colors_to_rgb5a3(colors):
+    r, g, b, a = colors[..., 0], colors[..., 1], colors[..., 2], colors[..., 3]
+    with_alpha = ((a >> 5) << 12) | ((r >> 4) << 8) | ((g >> 4) << 4) | (b >> 4)
+    opaque = 0x8000 | ((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3)
+    return numpy.where(a != 255, with_alpha, opaque)
+
+
+def convert_colors_to_ia8(colors):
+    l = convert_rgb_to_greyscale(colors[..., 0], colors[..., 1], colors[..., 2])
+    return (l & 0xFF) | ((colors[..., 3] << 8) & 0xFF00)
+
+
+def encode_colors(colors, palette_format):
+    if palette_format == PaletteFormat.IA8:
+        return convert_colors_to_ia8(colors)
+    elif palette_format == PaletteFormat.RGB565:
+        return convert_colors_to_rgb565(colors)
+    elif palette_format == PaletteFormat.RGB5A3:
+        return convert_colors_to_rgb5a3(colors)
+
+
+def pack_colors(colors):
+    colors = colors.astype(numpy.uint32)
+    return (colors[..., 0] << 24) | (colors[..., 1] << 16) | (colors[..., 2] << 8) | colors[..., 3]
+
+
+def unpack_color(key):
+    key = int(key)
+    return ((key >> 24) & 0xFF, (key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF)
+
+
+def image_to_array(image):
+    return numpy.asarray(image.convert("RGBA"), dtype=numpy.uint8).astype(numpy.int32)
+
+
+def blocks_to_image(blocks, image_format, image_width, image_height):
+    # blocks: (num_blocks, block_height, block_width, 4) in the order they are stored in
+    block_width = BLOCK_WIDTHS[image_format]
+    block_height = BLOCK_HEIGHTS[image_format]
+    blocks_wide = (image_width + (block_width-1)) // block_width
+    blocks_tall = (image_height + (block_height-1)) // block_height
+    pixels = blocks.reshape(blocks_tall, blocks_wide, block_height, block_width, 4)
+    pixels = pixels.transpose(0, 2, 1, 3, 4).reshape(blocks_tall*block_height, blocks_wide*block_width, 4)
+    return pixels[:image_height, :image_width]
+
+
+def get_valid_mask(image_format, image_width, image_height):
+    # Which pixels of each block are inside the image, shaped (num_blocks, block_height, block_width)
+    block_width = BLOCK_WIDTHS[image_format]
+    block_height = BLOCK_HEIGHTS[image_format]
+    blocks_wide = (image_width + (block_width-1)) // block_width
+    blocks_tall = (image_height + (block_height-1)) // block_height
+    valid = numpy.zeros((blocks_tall*block_height, blocks_wide*block_width), dtype=bool)
+    valid[:image_height, :image_width] = True
+    valid = valid.reshape(blocks_tall, block_height, blocks_wide, block_width).transpose(0, 2, 1, 3)
+    return valid.reshape(-1, block_height, block_width)
+
+
+def image_to_blocks(pixels, image_format, image_width, image_height):
+    # Returns the pixels as (num_blocks, block_height, block_width, 4) plus a mask of which of them are inside the image
+    block_width = BLOCK_WIDTHS[image_format]
+    block_height = BLOCK_HEIGHTS[image_format]
+    blocks_wide = (image_width + (block_width-1)) // block_width
+    blocks_tall = (image_height + (block_height-1)) // block_height
+    padded = numpy.zeros((blocks_tall*block_height, blocks_wide*block_width, 4), dtype=numpy.int32)
+    padded[:image_height, :image_width] = pixels[:image_height, :image_width]
+    padded = padded.reshape(blocks_tall, block_height, blocks_wide, block_width, 4).transpose(0, 2, 1, 3, 4)
+    return (padded.reshape(-1, block_height, block_width, 4), get_valid_mask(image_format, image_width, image_height))
+
+
+def read_block_data(image_data, image_format, image_width, image_height):
+    num_blocks = get_num_blocks(image_format, image_width, image_height)
+    size = num_blocks*BLOCK_DATA_SIZES[image_format]
+    image_data.seek(0)
+    data = image_data.read(size)
+    if len(data) < size:
+        data += b"\x00"*(size-len(data))
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(num_blocks, BLOCK_DATA_SIZES[image_format])
+
+
+def lookup_palette(indexes, colors, valid):
+    # Out of range indexes are only allowed for pixels outside of the image, like in texture_utils
+    palette = numpy.zeros((max(len(colors), 1), 4), dtype=numpy.int32)
+    if colors:
+        palette[:len(colors)] = numpy.array(colors, dtype=numpy.int32)
+    out_of_range = indexes >= len(colors)
+    if numpy.any(out_of_range & valid):
+        raise TypeError("Color index out of range of the palette")
+    return palette[numpy.where(out_of_range, 0, indexes)]
+
+
+def decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+    num_blocks = get_num_blocks(image_format, image_width, image_height)
+    with stage("decode_image", pixels=image_width*image_height, blocks=num_blocks):
+        return _decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height)
+
+
+def _decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+    colors = decode_palettes(palette_data, palette_format, num_colors, image_format)
+    data = read_block_data(image_data, image_format, image_width, image_height).astype(numpy.int32)
+    num_blocks = data.shape[0]
+    block_width = BLOCK_WIDTHS[image_format]
+    block_height = BLOCK_HEIGHTS[image_format]
+    pixel_shape = (num_blocks, block_height, block_width)
+
+    if image_format in (ImageFormat.I4, ImageFormat.C4):
+        values = numpy.empty((num_blocks, 64), dtype=numpy.int32)
+        values[:, 0::2] = data >> 4
+        values[:, 1::2] = data & 0xF
+    elif image_format in (ImageFormat.IA8, ImageFormat.RGB565, ImageFormat.RGB5A3, ImageFormat.C14X2):
+        values = (data[:, 0::2] << 8) | data[:, 1::2]
+    else:
+        values = data
+    if image_format != ImageFormat.RGBA32 and image_format != ImageFormat.CMPR:
+        values = values.reshape(pixel_shape)
+
+    blocks = numpy.empty(pixel_shape + (4,), dtype=numpy.int32)
+    if image_format == ImageFormat.I4:
+        blocks[...] = swizzle_4_bit_to_8_bit(values)[..., numpy.newaxis]
+    elif image_format == ImageFormat.I8:
+        blocks[...] = values[..., numpy.newaxis]
+    elif image_format == ImageFormat.IA4:
+        blocks[..., :3] = swizzle_4_bit_to_8_bit(values & 0xF)[..., numpy.newaxis]
+        blocks[..., 3] = swizzle_4_bit_to_8_bit(values >> 4)
+    elif image_format == ImageFormat.IA8:
+        blocks[..., :3] = (values & 0xFF)[..., numpy.newaxis]
+        blocks[..., 3] = values >> 8
+    elif image_format == ImageFormat.RGB565:
+        blocks[...] = convert_rgb565_to_colors(values)
+    elif image_format == ImageFormat.RGB5A3:
+        blocks[...] = convert_rgb5a3_to_colors(values)
+    elif image_format == ImageFormat.RGBA32:
+        blocks[..., 3] = data[:, 0:32:2].reshape(pixel_shape)
+        blocks[..., 0] = data[:, 1:32:2].reshape(pixel_shape)
+        blocks[..., 1] = data[:, 32:64:2].reshape(pixel_shape)
+        blocks[..., 2] = data[:, 33:64:2].reshape(pixel_shape)
+    elif image_format in (ImageFormat.C4, ImageFormat.C8, ImageFormat.C14X2):
+        if image_format == ImageFormat.C14X2:
+            values = values & 0x3FFF
+        valid = get_valid_mask(image_format, image_width, image_height)
+        blocks[...] = lookup_palette(values, colors, valid)
+    elif image_format == ImageFormat.CMPR:
+        blocks[...] = decode_cmpr_blocks(data)
+    else:
+        raise Exception("Unknown image format: %s" % image_format.name)
+
+    pixels = blocks_to_image(blocks, image_format, image_width, image_height)
+    return Image.fromarray(numpy.ascontiguousarray(pixels, dtype=numpy.uint8), "RGBA")
+
+
+def get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565):
+    # Returns (..., 4, 4): the four colors of every subblock
+    color_0 = convert_rgb565_to_colors(color_0_rgb565)
+    color_1 = convert_rgb565_to_colors(color_1_rgb565)
+    four_colors = (color_0_rgb565 > color_1_rgb565)[..., numpy.newaxis]
+
+    colors = numpy.empty(color_0.shape[:-1] + (4, 4), dtype=numpy.int32)
+    colors[..., 0, :] = color_0
+    colors[..., 1, :] = color_1
+    colors[..., 2, :] = numpy.where(four_colors, (2*color_0 + color_1)//3, color_0//2 + color_1//2)
+    colors[..., 3, :] = numpy.where(four_colors, (color_0 + 2*color_1)//3, 0)
+    colors[..., 2, 3] = 255
+    colors[..., 3, 3] = numpy.where(four_colors[..., 0], 255, 0)
+    return colors
+
+
+def decode_cmpr_blocks(data):
+    num_blocks = data.shape[0]
+    subblocks = data.reshape(num_blocks, 4, 8)
+    color_0_rgb565 = (subblocks[..., 0] << 8) | subblocks[..., 1]
+    color_1_rgb565 = (subblocks[..., 2] << 8) | subblocks[..., 3]
+    colors = get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565)
+
+    # Four bytes of 2 bit indexes, most significant bits first
+    index_bytes = subblocks[..., 4:8]
+    shifts = numpy.array([6, 4, 2, 0], dtype=numpy.int32)
+    color_indexes = ((index_bytes[..., numpy.newaxis] >> shifts) & 3).reshape(num_blocks, 4, 16)
+
+    pixels = numpy.take_along_axis(colors, color_indexes[..., numpy.newaxis], axis=2)  # (num_blocks, 4, 16, 4)
+    pixels = pixels.reshape(num_blocks, 2, 2, 4, 4, 4)  # (block, subblock y, subblock x, y, x, channel)
+    return pixels.transpose(0, 1, 3, 2, 4, 5).reshape(num_blocks, 8, 8, 4)
+
+
+def generate_new_palettes_from_image(image, image_format, palette_format):
+    if image_format not in IMAGE_FORMATS_THAT_USE_PALETTES:
+        return ([], {})
+
+    pixels = image_to_array(image).reshape(-1, 4)
+    keys = pack_colors(pixels)
+    unique_keys, first_index = numpy.unique(keys, return_index=True)
+    unique_colors = pixels[first_index]
+    unique_encoded = encode_colors(unique_colors, palette_format)
+
+    # Encoded colors are numbered in the order they first appear in the image
+    order = numpy.argsort(first_index, kind="stable")
+    encoded_colors = []
+    encoded_color_indexes = {}
+    for i in order:
+        encoded_color = int(unique_encoded[i])
+        if encoded_color not in encoded_color_indexes:
+            encoded_color_indexes[encoded_color] = len(encoded_colors)
+            encoded_colors.append(encoded_color)
+
+    if len(encoded_colors) > MAX_COLORS_FOR_IMAGE_FORMAT[image_format]:
+        # Color reduction for C14X2 isn't vectorized
+        return texture_utils.generate_new_palettes_from_image(image, image_format, palette_format)
+
+    colors_to_color_indexes = {}
+    for i in order:
+        colors_to_color_indexes[unpack_color(unique_keys[i])] = encoded_color_indexes[int(unique_encoded[i])]
+
+    return (encoded_colors, colors_to_color_indexes)
+
+
+def encode_image(image, image_format, palette_format, mipmap_count=1):
+    with stage("encode_image", pixels=image.width*image.height):
+        return _encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
+
+
+def _encode_image(image, image_format, palette_format, mipmap_count=1):
+    with stage("convert"):
+        image = image.convert("RGBA")
+    image_width, image_height = image.size
+
+    if mipmap_count < 1:
+        mipmap_count = 1
+
+    if image_format in IMAGE_FORMATS_THAT_USE_PALETTES:
+        max_colors = MAX_COLORS_FOR_IMAGE_FORMAT[image_format]
+        if max_colors <= 256:
+            with stage("quantize", pixels=image_width*image_height):
+                image = image.quantize(max_colors)
+                image = image.convert("RGBA")
+
+    with stage("generate_palette", pixels=image_width*image_height):
+        encoded_colors, colors_to_color_indexes = generate_new_palettes_from_image(image, image_format, palette_format)
+
+    new_image_data = BytesIO()
+    mipmap_image = image
+    mipmap_width = image_width
+    mipmap_height = image_height
+    for i in range(mipmap_count):
+        if i != 0:
+            mipmap_width //= 2
+            mipmap_height //= 2
+            mipmap_image = image.resize((mipmap_width, mipmap_height), Image.NEAREST)
+
+        mipmap_image_data = encode_mipmap_image(
+            mipmap_image, image_format,
+            colors_to_color_indexes,
+            mipmap_width, mipmap_height
+        )
+        new_image_data.write(mipmap_image_data.getbuffer())
+
+    new_palette_data = encode_palette(encoded_colors, palette_format, image_format)
+
+    return (new_image_data, new_palette_data, encoded_colors)
+
+
+def encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height):
+    num_blocks = get_num_blocks(image_format, image_width, image_height)
+    with stage("encode_mipmap_image", pixels=image_width*image_height, blocks=num_blocks):
+        return _encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height)
+
+
+def _encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height):
+    pixels = image_to_array(image)
+    blocks, valid = image_to_blocks(pixels, image_format, image_width, image_height)
+    num_blocks = blocks.shape[0]
+    r, g, b, a = blocks[..., 0], blocks[..., 1], blocks[..., 2], blocks[..., 3]
+
+    if image_format == ImageFormat.I4:
+        values = numpy.where(valid, (convert_rgb_to_greyscale(r, g, b) >> 4) & 0xF, 0xF).reshape(num_blocks, 64)
+        data = ((values[:, 0::2] << 4) | values[:, 1::2]).astype(numpy.uint8)
+    elif image_format == ImageFormat.I8:
+        data = numpy.where(valid, convert_rgb_to_greyscale(r, g, b) & 0xFF, 0xFF).astype(numpy.uint8)
+    elif image_format == ImageFormat.IA4:
+        ia4 = ((convert_rgb_to_greyscale(r, g, b) >> 4) & 0xF) | (a & 0xF0)
+        data = numpy.where(valid, ia4, 0xFF).astype(numpy.uint8)
+    elif image_format == ImageFormat.IA8:
+        data = numpy.where(valid, convert_colors_to_ia8(blocks), 0xFF).astype(">u2")
+    elif image_format == ImageFormat.RGB565:
+        data = numpy.where(valid, convert_colors_to_rgb565(blocks), 0xFFFF).astype(">u2")
+    elif image_format == ImageFormat.RGB5A3:
+        data = numpy.where(valid, convert_colors_to_rgb5a3(blocks), 0xFFFF).astype(">u2")
+    elif image_format == ImageFormat.RGBA32:
+        channels = numpy.where(valid[..., numpy.newaxis], blocks, 0xFF).reshape(num_blocks, 16, 4)
+        data = numpy.empty((num_blocks, 64), dtype=numpy.uint8)
+        data[:, 0:32:2] = channels[..., 3]
+        data[:, 1:32:2] = channels[..., 0]
+        data[:, 32:64:2] = channels[..., 1]
+        data[:, 33:64:2] = channels[..., 2]
+    elif image_format in (ImageFormat.C4, ImageFormat.C8, ImageFormat.C14X2):
+        indexes = lookup_color_indexes(blocks, valid, colors_to_color_indexes)
+        if image_format == ImageFormat.C4:
+            if numpy.any(indexes[valid] > 0xF):
+                raise AssertionError("Color index does not fit into 4 bits")
+            values = numpy.where(valid, indexes, 0xF).reshape(num_blocks, 64)
+            data = ((values[:, 0::2] << 4) | values[:, 1::2]).astype(numpy.uint8)
+        elif image_format == ImageFormat.C8:
+            data = numpy.where(valid, indexes, 0xFF).astype(numpy.uint8)
+        else:
+            data = numpy.where(valid, indexes, 0x3FFF).astype(">u2")
+    elif image_format == ImageFormat.CMPR:
+        data = encode_cmpr_blocks(blocks, valid)
+    else:
+        raise Exception("Unknown image format: %s" % ImageFormat(image_format).name)
+
+    return BytesIO(numpy.ascontiguousarray(data).tobytes())
+
+
+def lookup_color_indexes(blocks, valid, colors_to_color_indexes):
+    keys = pack_colors(blocks)
+    if not colors_to_color_indexes:
+        if numpy.any(valid):
+            raise KeyError(unpack_color(keys[valid][0]))
+        return numpy.zeros(keys.shape, dtype=numpy.int32)
+
+    known_keys = pack_colors(numpy.array(list(colors_to_color_indexes.keys()), dtype=numpy.int32))
+    known_indexes = numpy.array(list(colors_to_color_indexes.values()), dtype=numpy.int32)
+    order = numpy.argsort(known_keys)
+    known_keys = known_keys[order]
+    known_indexes = known_indexes[order]
+
+    positions = numpy.minimum(numpy.searchsorted(known_keys, keys), len(known_keys)-1)
+    missing = valid & (known_keys[positions] != keys)
+    if numpy.any(missing):
+        raise KeyError(unpack_color(keys[missing][0]))
+    return known_indexes[positions]
+
+
+def get_best_cmpr_key_colors(colors, opaque):
+    # colors: (num_subblocks, 16, 4), opaque: (num_subblocks, 16)
+    # Picks the pair of opaque colors furthest apart, the first such pair in pixel order like texture_utils does.
+    distances = numpy.abs(colors[:, :, numpy.newaxis, :] - colors[:, numpy.newaxis, :, :]).sum(axis=3)
+    pair_valid = opaque[:, :, numpy.newaxis] & opaque[:, numpy.newaxis, :] & numpy.triu(numpy.ones((16, 16), dtype=bool), 1)
+    distances = numpy.where(pair_valid, distances, -1).reshape(-1, 256)
+    best_pair = distances.argmax(axis=1)
+    has_pair = distances[numpy.arange(distances.shape[0]), best_pair] != -1
+
+    subblock_indexes = numpy.arange(colors.shape[0])
+    color_1 = colors[subblock_indexes, best_pair // 16].copy()
+    color_2 = colors[subblock_indexes, best_pair % 16].copy()
+    color_1[:, 3] = 0xFF
+    color_2[:, 3] = 0xFF
+
+    same_rgb565 = (
+        ((color_1[:, 0] >> 3) == (color_2[:, 0] >> 3)) &
+        ((color_1[:, 1] >> 2) == (color_2[:, 1] >> 2)) &
+        ((color_1[:, 2] >> 3) == (color_2[:, 2] >> 3))
+    )
+    black_rgb565 = ((color_1[:, 0] >> 3) == 0) & ((color_1[:, 1] >> 2) == 0) & ((color_1[:, 2] >> 3) == 0)
+    color_2[same_rgb565 & black_rgb565] = (0xFF, 0xFF, 0xFF, 0xFF)
+    color_2[same_rgb565 & ~black_rgb565] = (0, 0, 0, 0xFF)
+
+    color_1[~has_pair] = (0, 0, 0, 0xFF)
+    color_2[~has_pair] = (0xFF, 0xFF, 0xFF, 0xFF)
+    return (color_1, color_2)
+
+
+def encode_cmpr_blocks(blocks, valid):
+    num_blocks = blocks.shape[0]
+    # (block, subblock y, y, subblock x, x) -> (block, subblock y, subblock x, y, x)
+    colors = blocks.reshape(num_blocks, 2, 4, 2, 4, 4).transpose(0, 1, 3, 2, 4, 5).reshape(-1, 16, 4)
+    valid = valid.reshape(num_blocks, 2, 4, 2, 4).transpose(0, 1, 3, 2, 4).reshape(-1, 16)
+
+    transparent = valid & (colors[..., 3] < 16)
+    opaque = valid & ~transparent
+    needs_transparent_color = transparent.any(axis=1)
+
+    color_0, color_1 = get_best_cmpr_key_colors(colors, opaque)
+    color_0_rgb565 = convert_colors_to_rgb565(color_0)
+    color_1_rgb565 = convert_colors_to_rgb565(color_1)
+
+    swap = (
+        (needs_transparent_color & (color_0_rgb565 > color_1_rgb565)) |
+        (~needs_transparent_color & (color_0_rgb565 < color_1_rgb565))
+    )
+    color_0_rgb565, color_1_rgb565 = numpy.where(swap, color_1_rgb565, color_0_rgb565), numpy.where(swap, color_0_rgb565, color_1_rgb565)
+    color_0, color_1 = numpy.where(swap[:, numpy.newaxis], color_1, color_0), numpy.where(swap[:, numpy.newaxis], color_0, color_1)
+
+    palette = get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565)
+    palette[:, 0] = color_0
+    palette[:, 1] = color_1
+
+    # Exact matches first, then the transparent color for nearly transparent pixels, then the nearest color
+    distances = numpy.abs(colors[:, :, numpy.newaxis, :] - palette[:, numpy.newaxis, :, :]).sum(axis=3)
+    nearest = distances.argmin(axis=2)
+    exact = distances.min(axis=2) == 0
+    has_transparent_color = (palette[:, 3, 3] == 0)[:, numpy.newaxis]
+    color_indexes = numpy.where(~exact & (colors[..., 3] < 16) & has_transparent_color, 3, nearest)
+    color_indexes = numpy.where(valid, color_indexes, 0).astype(numpy.uint32)
+
+    shifts = numpy.arange(15, -1, -1, dtype=numpy.uint32)*2
+    packed_indexes = (color_indexes << shifts).sum(axis=1, dtype=numpy.uint32)
+
+    subblocks = numpy.empty(colors.shape[0], dtype=[("color_0", ">u2"), ("color_1", ">u2"), ("indexes", ">u4")])
+    subblocks["color_0"] = color_0_rgb565
+    subblocks["color_1"] = color_1_rgb565
+    subblocks["indexes"] = packed_indexes
+    return subblocks
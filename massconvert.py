@@ -1,7 +1,667 @@
-import subprocess
 import os
+import sys
+import json
+import time
+import hashlib
 import argparse
+import functools
+import traceback
+import threading
+import contextlib
+import multiprocessing
+import queue
+import collections
 import bwtex
+import conv
+from lib.profiling import PROFILER
+from lib.texture_utils import NUMPY_INSTALLED
+from lib.codec_backends import BACKENDS, BACKEND_ENV_VAR, select_backend, get_backend
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_INSTALLED = True
+except ImportError:
+    WATCHDOG_INSTALLED = False
+
+# Seconds between scans of a watched folder when watchdog isn't installed
+WATCH_POLL_INTERVAL = 0.25
+# Seconds a watched file has to stay unchanged before it's converted
+WATCH_DEBOUNCE = 0.3
+
+
+def get_pixel_count(path):
+    """Pixels in the first mipmap of a texture or PNG, read from the header only. 0 if unknown."""
+    try:
+        if path.endswith(".texture"):
+            with open(path, "rb") as f:
+                dimensions = bwtex.get_texture_dimensions(f.read(bwtex.SNIFF_SIZE))
+            if dimensions is None:
+                return 0
+            width, height = dimensions
+        else:
+            from PIL import Image
+            with Image.open(path) as img:
+                width, height = img.size
+    except OSError:
+        return 0
+    return width*height
+
+
+def scan_folder(inputfolder, topng):
+    """Returns (file name, pixel count, file size) of every file a batch conversion would convert."""
+    extension = ".texture" if topng else ".png"
+    files = []
+    for fname in sorted(os.listdir(inputfolder)):
+        if fname.endswith(extension):
+            path = os.path.join(inputfolder, fname)
+            files.append((fname, get_pixel_count(path), os.path.getsize(path)))
+    return files
+
+
+class ProgressTracker(object):
+    """Keeps track of a batch conversion from its progress events.
+    Progress and ETA are weighted by pixels, files with an unknown size count as one pixel."""
+    def __init__(self):
+        self.files_total = 0
+        self.files_done = 0
+        self.pixels_total = 0
+        self.pixels_done = 0
+        self.elapsed = 0.0
+        self.current_file = None
+        self.current_stage = None
+        self.errors = []
+
+    def update(self, event):
+        self.elapsed = event.get("elapsed", self.elapsed)
+        if event["event"] == "start":
+            self.files_total = event["files_total"]
+            self.pixels_total = event["pixels_total"]
+        elif event["event"] == "file_start":
+            self.current_file = event["file"]
+            self.current_stage = None
+        elif event["event"] == "stage":
+            self.current_stage = event["stage"]
+        elif event["event"] == "file_done":
+            self.files_done += 1
+            self.pixels_done = event["pixels_done"]
+            if event.get("error") is not None:
+                self.errors.append((event["file"], event["error"], event.get("traceback")))
+
+    @property
+    def fraction(self):
+        if self.pixels_total == 0:
+            return 0.0
+        return min(self.pixels_done/self.pixels_total, 1.0)
+
+    def get_eta(self):
+        """Seconds until the batch is done, or None before the first file is done."""
+        if self.pixels_done == 0:
+            return None
+        return self.elapsed*(self.pixels_total - self.pixels_done)/self.pixels_done
+
+
+def convert_file(path, outputfolder, topng=True, bw1=None, fmt=None, max_error=bwtex.DEFAULT_MAX_ERROR, emit_stage=None):
+    """Converts one texture (topng) or PNG into outputfolder and returns the output path.
+    The output is written to a .part file first and renamed when it's complete, the .part file
+    is removed if the conversion fails."""
+    fname = os.path.basename(path)
+    if topng:
+        if emit_stage is not None: emit_stage("decode")
+        with open(path, "rb") as f:
+            tex = bwtex.read_texture(f, conv.game_from_flags(bw1))
+        settings = tex.header_to_string()
+        outpath = os.path.join(outputfolder, fname.replace(".texture", "")+"."+tex.fmt+"."+settings+".png")
+    else:
+        texname = fname.split(".")[0]
+        outpath = os.path.join(outputfolder, texname+".texture")
+
+    try:
+        if topng:
+            if emit_stage is not None: emit_stage("save_png")
+            with PROFILER.stage("save_png", pixels=tex.mipmaps[0].width*tex.mipmaps[0].height):
+                tex.mipmaps[0].save(outpath+".part", "PNG")
+        else:
+            if emit_stage is not None: emit_stage("encode")
+            conv.image_to_texture(path, outpath+".part", bw1=bw1, fmt=fmt, max_error=max_error)
+        os.replace(outpath+".part", outpath)
+    except BaseException:
+        if os.path.exists(outpath+".part"):
+            os.remove(outpath+".part")
+        raise
+    return outpath
+
+
+def get_output_paths(path, outputfolder, topng, suffix=""):
+    """Paths of the existing files convert_file wrote for path, with suffix added to the names.
+    When converting to textures the path is returned even if the file doesn't exist."""
+    fname = os.path.basename(path)
+    if topng:
+        prefix = fname.replace(".texture", "")+"."
+        return [os.path.join(outputfolder, other) for other in os.listdir(outputfolder)
+                if other.startswith(prefix) and other.endswith(".png"+suffix)]
+    else:
+        return [os.path.join(outputfolder, fname.split(".")[0]+".texture"+suffix)]
+
+
+def get_partial_paths(path, outputfolder, topng):
+    """Paths of the .part files convert_file could have left behind for path when it was interrupted."""
+    return get_output_paths(path, outputfolder, topng, ".part")
+
+
+def is_up_to_date(path, outputfolder, topng):
+    """True if path was converted into outputfolder after it was last modified."""
+    mtime = os.path.getmtime(path)
+    return any(os.path.exists(outpath) and os.path.getmtime(outpath) >= mtime
+               for outpath in get_output_paths(path, outputfolder, topng))
+
+
+def get_duplicate_key(path):
+    """Images with the same key become the same texture apart from the texture name: their pixels
+    are identical and their names ask for the same format and header values. None if the image
+    can't be read, which never counts as a duplicate."""
+    from PIL import Image
+    # Everything but the texture name is what build_texture reads from the file name
+    settings = ".".join(os.path.basename(path).split(".")[1:])
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with Image.open(path) as img:
+            img.load()
+            digest.update("{0} {1}x{2} {3!r}".format(img.mode, img.width, img.height, img.info.get("transparency")).encode("ascii"))
+            if img.mode == "P":
+                digest.update(bytes(img.getpalette()))
+            digest.update(img.tobytes())
+    except OSError:
+        return None
+    return digest.hexdigest(), settings
+
+
+def group_duplicates(paths):
+    """Groups the indices of paths by get_duplicate_key, in the order the paths come in."""
+    groups = {}
+    for index, path in enumerate(paths):
+        key = get_duplicate_key(path)
+        if key is None:
+            key = index
+        groups.setdefault(key, []).append(index)
+    return list(groups.values())
+
+
+def get_metrics_path(outpath):
+    return outpath+".metrics.json"
+
+
+def write_metrics(path, outpath):
+    """Compares the texture at outpath with the PNG at path it was made from, see texmetrics, and
+    writes the metrics as JSON next to the texture. Returns them as a dict, or None if measuring failed.
+    Measuring failing doesn't make the conversion fail, the texture is fine."""
+    import texmetrics
+    try:
+        metrics = texmetrics.measure_texture(outpath, path)
+    except Exception as e:
+        print("Cannot measure {0}: {1}: {2}".format(outpath, type(e).__name__, e))
+        return None
+    print("Metrics:", metrics.summary())
+    result = metrics.to_dict()
+    write_metrics_file(outpath, result)
+    return result
+
+
+def write_metrics_file(outpath, metrics):
+    with open(get_metrics_path(outpath), "w") as f:
+        json.dump(metrics, f, indent=2)
+
+
+def init_worker(backend_name, stdout_to_stderr=False):
+    """Initializer of the worker processes. With stdout_to_stderr, what the worker prints goes to stderr,
+    so it doesn't end up between the progress events on stdout: workers that are spawned instead of
+    forked, like on Windows and macOS, don't inherit the redirect_stdout of the parent."""
+    select_backend(backend_name)
+    if stdout_to_stderr:
+        sys.stdout = sys.stderr
+
+
+def convert_file_in_worker(path, outputfolder, topng, bw1, fmt, max_error, metrics=False):
+    """Runs in the worker processes of BatchConversion. Returns the output path, or None and the error,
+    and the metrics of the texture if metrics is True, see write_metrics."""
+    try:
+        print("Converting", path)
+        outpath = convert_file(path, outputfolder, topng, bw1, fmt, max_error)
+        print("Saved to", outpath)
+    except Exception as e:
+        return None, "{0}: {1}".format(type(e).__name__, e), traceback.format_exc(), None
+    return outpath, None, None, write_metrics(path, outpath) if metrics else None
+
+
+class BatchConversion(object):
+    """Converts every texture (topng) or PNG in inputfolder.
+    
+    progress is called with a dict for every progress event, see ProgressTracker. With workers=None
+    the files are converted one after another in this process, otherwise in a pool of that many 
+    worker processes. cancel, pause and resume may be called from any thread while run is running.
+    
+    With dedup, PNGs with the same pixels and settings are only encoded once, the other textures
+    are copies of the first one with their own name. The groups of such PNGs are in duplicates
+    after run.
+    
+    With metrics, every new texture is compared with its PNG, see texmetrics. The metrics are
+    written next to the texture as .metrics.json and are in the file_done events."""
+    def __init__(self, inputfolder, outputfolder=None, topng=True, bw1=None, fmt=None,
+                 max_error=bwtex.DEFAULT_MAX_ERROR, progress=None, workers=None, dedup=True, metrics=False):
+        if outputfolder is None:
+            outputfolder = inputfolder
+        self.inputfolder = inputfolder
+        self.outputfolder = outputfolder
+        self.topng = topng
+        self.bw1 = bw1
+        self.fmt = fmt
+        self.max_error = max_error
+        self.progress = progress
+        self.workers = workers
+        self.dedup = dedup
+        self.duplicates = []
+        self.metrics = metrics and not topng
+        
+        self.cancelled = False
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.start_time = None
+
+    def cancel(self):
+        self.cancelled = True
+        self.resumed.set()
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    @property
+    def paused(self):
+        return not self.resumed.is_set()
+
+    def emit(self, event, **fields):
+        if self.progress is not None:
+            progress_event = {"event": event, "elapsed": round(time.perf_counter() - self.start_time, 3)}
+            progress_event.update(fields)
+            self.progress(progress_event)
+
+    def wait_while_paused(self):
+        if self.paused:
+            self.emit("paused")
+            self.resumed.wait()
+            if not self.cancelled:
+                self.emit("resumed")
+
+    def run(self):
+        """Converts all files and returns the number of files that failed."""
+        self.start_time = time.perf_counter()
+        files = scan_folder(self.inputfolder, self.topng)
+        pixels_total = sum(max(pixels, 1) for fname, pixels, size in files)
+        bytes_total = sum(size for fname, pixels, size in files)
+        
+        if self.dedup and not self.topng:
+            groups = group_duplicates([os.path.join(self.inputfolder, fname) for fname, pixels, size in files])
+        else:
+            groups = [[index] for index in range(len(files))]
+        self.duplicates = [[os.path.join(self.inputfolder, files[index][0]) for index in group]
+                           for group in groups if len(group) > 1]
+        self.emit("start", files_total=len(files), pixels_total=pixels_total, bytes_total=bytes_total,
+                  files_unique=len(groups))
+        
+        self.pixels_done = 0
+        self.bytes_done = 0
+        self.failed = 0
+        if self.workers is None:
+            self.run_sequential(files, groups)
+        else:
+            self.run_pool(files, groups)
+        
+        self.emit("done", files_total=len(files), files_failed=self.failed, cancelled=self.cancelled,
+                  pixels_done=self.pixels_done, bytes_done=self.bytes_done)
+        return self.failed
+
+    def file_done(self, index, path, pixels, size, outpath, error, error_traceback=None, metrics=None):
+        if error is not None:
+            self.failed += 1
+        self.pixels_done += max(pixels, 1)
+        self.bytes_done += size
+        fields = {}
+        if metrics is not None:
+            fields["metrics"] = metrics
+        self.emit("file_done", file=path, index=index, output=outpath, error=error, traceback=error_traceback,
+                  pixels_done=self.pixels_done, bytes_done=self.bytes_done, **fields)
+
+    def write_copies(self, source, source_outpath, files, indices, metrics=None):
+        """Writes the texture converted from source again for each of the duplicates of it in indices,
+        under their own name. The copies have the same metrics as the texture of source."""
+        with open(source_outpath, "rb") as f:
+            data = f.read()
+        
+        for index in indices:
+            fname, pixels, size = files[index]
+            path = os.path.join(self.inputfolder, fname)
+            self.emit("file_start", file=path, index=index, pixels=pixels, bytes=size, duplicate_of=source)
+            
+            outpath = None
+            error = None
+            error_traceback = None
+            texname = fname.split(".")[0]
+            copy_outpath = os.path.join(self.outputfolder, texname+".texture")
+            try:
+                if copy_outpath != source_outpath:
+                    # Renaming fails for names the game can't store, before anything is written
+                    renamed = bwtex.rename_texture(data, texname)
+                    with open(copy_outpath+".part", "wb") as f:
+                        f.write(renamed)
+                    os.replace(copy_outpath+".part", copy_outpath)
+                    if metrics is not None:
+                        write_metrics_file(copy_outpath, metrics)
+                outpath = copy_outpath
+                print("Same image as", source, "saved to", outpath)
+            except Exception as e:
+                if os.path.exists(copy_outpath+".part"):
+                    os.remove(copy_outpath+".part")
+                traceback.print_exc()
+                error = "{0}: {1}".format(type(e).__name__, e)
+                error_traceback = traceback.format_exc()
+            self.file_done(index, path, pixels, size, outpath, error, error_traceback, metrics)
+
+    def run_sequential(self, files, groups):
+        # The first file of each group is converted, the others are copies of it. If the first
+        # fails, the next one is tried, as the failure can be down to its name.
+        pending = collections.deque(groups)
+        while pending:
+            self.wait_while_paused()
+            if self.cancelled:
+                break
+            
+            group = pending.popleft()
+            index = group[0]
+            fname, pixels, size = files[index]
+            path = os.path.join(self.inputfolder, fname)
+            self.emit("file_start", file=path, index=index, pixels=pixels, bytes=size)
+            print("Converting", path)
+            
+            outpath = None
+            error = None
+            error_traceback = None
+            metrics = None
+            try:
+                outpath = convert_file(path, self.outputfolder, self.topng, self.bw1, self.fmt, self.max_error,
+                                       emit_stage=lambda stage: self.emit("stage", file=path, stage=stage))
+                print("Saved to", outpath)
+            except Exception as e:
+                traceback.print_exc()
+                error = "{0}: {1}".format(type(e).__name__, e)
+                error_traceback = traceback.format_exc()
+            if outpath is not None and self.metrics:
+                self.emit("stage", file=path, stage="metrics")
+                metrics = write_metrics(path, outpath)
+            self.file_done(index, path, pixels, size, outpath, error, error_traceback, metrics)
+            
+            if outpath is not None:
+                self.write_copies(path, outpath, files, group[1:], metrics)
+            elif len(group) > 1:
+                pending.appendleft(group[1:])
+
+    def run_pool(self, files, groups):
+        results = queue.Queue()
+        pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                    initargs=(get_backend().name, self.progress is not None))
+        # Index of the converted file -> (its path, the other files of its group)
+        in_flight = {}
+        pending = collections.deque(groups)
+        try:
+            while (pending or in_flight) and not self.cancelled:
+                # Only as many files as there are workers are handed out so pausing takes effect right away
+                while not self.paused and pending and len(in_flight) < self.workers:
+                    group = pending.popleft()
+                    index = group[0]
+                    fname, pixels, size = files[index]
+                    path = os.path.join(self.inputfolder, fname)
+                    self.emit("file_start", file=path, index=index, pixels=pixels, bytes=size)
+                    in_flight[index] = (path, group[1:])
+                    pool.apply_async(
+                        convert_file_in_worker, 
+                        (path, self.outputfolder, self.topng, self.bw1, self.fmt, self.max_error, self.metrics),
+                        callback=lambda result, index=index: results.put((index, result)),
+                        error_callback=lambda e, index=index: results.put((index, (None, "{0}: {1}".format(type(e).__name__, e), None, None))))
+                
+                if self.paused and not in_flight:
+                    self.wait_while_paused()
+                    continue
+                
+                try:
+                    index, (outpath, error, error_traceback, metrics) = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                path, copies = in_flight.pop(index)
+                fname, pixels, size = files[index]
+                self.file_done(index, path, pixels, size, outpath, error, error_traceback, metrics)
+                if outpath is not None:
+                    self.write_copies(path, outpath, files, copies, metrics)
+                elif copies:
+                    # The failure can be down to the name of the file, try the next one of the group
+                    pending.appendleft(copies)
+        finally:
+            if in_flight:
+                # Cancelled: stop the workers in the middle of their files and remove what they were writing
+                pool.terminate()
+                pool.join()
+                for path, copies in in_flight.values():
+                    for partial_path in get_partial_paths(path, self.outputfolder, self.topng):
+                        if os.path.exists(partial_path):
+                            os.remove(partial_path)
+            else:
+                pool.close()
+                pool.join()
+
+
+def convert_folder(inputfolder, outputfolder=None, topng=True, bw1=None, fmt=None,
+                   max_error=bwtex.DEFAULT_MAX_ERROR, progress=None, workers=None, dedup=True, report_duplicates=False,
+                   metrics=False):
+    """Converts every texture (topng) or PNG in inputfolder, see BatchConversion. 
+    Returns the number of files that failed."""
+    conversion = BatchConversion(inputfolder, outputfolder, topng=topng, bw1=bw1, fmt=fmt, max_error=max_error,
+                                 progress=progress, workers=workers, dedup=dedup, metrics=metrics)
+    failed = conversion.run()
+    if report_duplicates:
+        print_duplicates(conversion.duplicates)
+    return failed
+
+
+def print_duplicates(groups):
+    if not groups:
+        print("No duplicate images found")
+        return
+    print("{0} groups of duplicate images, {1} files with the same pixels and settings as the first of their group:".format(
+        len(groups), sum(len(group)-1 for group in groups)))
+    for group in groups:
+        print("  "+group[0])
+        for path in group[1:]:
+            print("    = "+path)
+
+
+class FolderWatcher(object):
+    """Converts the textures (topng) or PNGs in inputfolder whenever they change, until stop is called.
+
+    Files that are newer than their output are converted when watching starts. Changes are noticed
+    through watchdog if it's installed and by scanning the folder every poll_interval seconds
+    otherwise. A file is converted once it stayed the same for debounce seconds, so that files
+    in the middle of being saved are left alone. The conversions run in a pool of worker processes
+    and progress is reported like BatchConversion does, without the start and done events."""
+    def __init__(self, inputfolder, outputfolder=None, topng=True, bw1=None, fmt=None,
+                 max_error=bwtex.DEFAULT_MAX_ERROR, progress=None, workers=None,
+                 poll_interval=WATCH_POLL_INTERVAL, debounce=WATCH_DEBOUNCE, use_watchdog=True, metrics=False):
+        if outputfolder is None:
+            outputfolder = inputfolder
+        self.inputfolder = inputfolder
+        self.outputfolder = outputfolder
+        self.topng = topng
+        self.bw1 = bw1
+        self.fmt = fmt
+        self.max_error = max_error
+        self.progress = progress
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_watchdog = use_watchdog and WATCHDOG_INSTALLED
+        self.metrics = metrics and not topng
+        
+        # File name -> (modification time, size) of the version that was converted last
+        self.converted = {}
+        # File name -> ((modification time, size), when that was first seen) of files that changed since
+        self.pending = {}
+        # File name -> path of the files the workers are converting
+        self.in_flight = {}
+        self.results = queue.Queue()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.start_time = None
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def emit(self, event, **fields):
+        if self.progress is not None:
+            progress_event = {"event": event, "elapsed": round(time.perf_counter() - self.start_time, 3)}
+            progress_event.update(fields)
+            self.progress(progress_event)
+
+    def scan(self):
+        """Returns file name -> (modification time, size) of every file to watch."""
+        extension = ".texture" if self.topng else ".png"
+        signatures = {}
+        for entry in os.scandir(self.inputfolder):
+            if entry.name.endswith(extension) and entry.is_file():
+                stat = entry.stat()
+                signatures[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def find_changes(self, now):
+        signatures = self.scan()
+        for fname, signature in signatures.items():
+            if self.converted.get(fname) == signature:
+                self.pending.pop(fname, None)
+            elif fname not in self.pending or self.pending[fname][0] != signature:
+                self.pending[fname] = (signature, now)
+        
+        for fname in list(self.converted):
+            if fname not in signatures:
+                del self.converted[fname]
+        for fname in list(self.pending):
+            if fname not in signatures:
+                del self.pending[fname]
+
+    def submit_ready_files(self, pool, now):
+        for fname, (signature, changed) in list(self.pending.items()):
+            # A file that changes while it's converted is converted again after that
+            if now - changed < self.debounce or fname in self.in_flight:
+                continue
+            del self.pending[fname]
+            self.converted[fname] = signature
+            
+            path = os.path.join(self.inputfolder, fname)
+            self.in_flight[fname] = path
+            self.emit("file_start", file=path, pixels=get_pixel_count(path), bytes=signature[1])
+            pool.apply_async(
+                convert_file_in_worker,
+                (path, self.outputfolder, self.topng, self.bw1, self.fmt, self.max_error, self.metrics),
+                callback=lambda result, fname=fname: self.file_converted(fname, result),
+                error_callback=lambda e, fname=fname: self.file_converted(fname, (None, "{0}: {1}".format(type(e).__name__, e), None, None)))
+
+    def file_converted(self, fname, result):
+        """Runs on the result thread of the pool."""
+        self.results.put((fname, result))
+        self.wakeup.set()
+
+    def collect_results(self):
+        while True:
+            try:
+                fname, (outpath, error, error_traceback, metrics) = self.results.get_nowait()
+            except queue.Empty:
+                break
+            path = self.in_flight.pop(fname)
+            if error is not None:
+                print("Failed to convert {0}: {1}".format(path, error))
+                if error_traceback is not None:
+                    print(error_traceback)
+            fields = {}
+            if metrics is not None:
+                fields["metrics"] = metrics
+            self.emit("file_done", file=path, output=outpath, error=error, traceback=error_traceback, **fields)
+
+    def start_observer(self):
+        if not self.use_watchdog:
+            return None
+        wakeup = self.wakeup
+        
+        class ChangeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+        
+        observer = Observer()
+        observer.schedule(ChangeHandler(), self.inputfolder, recursive=False)
+        observer.start()
+        return observer
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        # Only files that changed since they were last converted need converting now
+        for fname, signature in self.scan().items():
+            if is_up_to_date(os.path.join(self.inputfolder, fname), self.outputfolder, self.topng):
+                self.converted[fname] = signature
+        
+        observer = self.start_observer()
+        pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                    initargs=(get_backend().name, self.progress is not None))
+        method = "watchdog" if observer is not None else "polling"
+        self.emit("watching", folder=self.inputfolder, method=method)
+        print("Watching {0} for changes ({1}), press Ctrl+C to stop".format(self.inputfolder, method))
+        try:
+            while not self.stopped:
+                now = time.perf_counter()
+                self.find_changes(now)
+                self.submit_ready_files(pool, now)
+                self.collect_results()
+                
+                if self.pending:
+                    timeout = min(self.poll_interval, self.debounce)
+                elif observer is None:
+                    timeout = self.poll_interval
+                else:
+                    timeout = None
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            if self.in_flight:
+                pool.terminate()
+                pool.join()
+                for path in self.in_flight.values():
+                    for partial_path in get_partial_paths(path, self.outputfolder, self.topng):
+                        if os.path.exists(partial_path):
+                            os.remove(partial_path)
+            else:
+                pool.close()
+                pool.join()
+
+
+def watch_folder(inputfolder, outputfolder=None, topng=True, bw1=None, fmt=None,
+                 max_error=bwtex.DEFAULT_MAX_ERROR, progress=None, workers=None, debounce=WATCH_DEBOUNCE, metrics=False):
+    """Converts files in inputfolder as they change until interrupted with Ctrl+C, see FolderWatcher."""
+    watcher = FolderWatcher(inputfolder, outputfolder, topng=topng, bw1=bw1, fmt=fmt, max_error=max_error,
+                            progress=progress, workers=workers, debounce=debounce, metrics=metrics)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -12,45 +672,86 @@ if __name__ == "__main__":
     parser.add_argument('--tobw',
                         action='store_true')
     parser.add_argument('--bw1',
-                        action='store_true')
+                        action='store_true',
+                        help="Treat all files as BW1. Default: detect the game of each file separately.")
     parser.add_argument('--bw2',
-                        action='store_true')
+                        action='store_true',
+                        help="Treat all files as BW2. Default: detect the game of each file separately.")
+    parser.add_argument("-f", "--format", default=None,
+                        help=("Format of the new textures, overrides the format in the PNG names. "
+                                "auto picks the smallest format that keeps the error below --max-error for each file."))
+    parser.add_argument("--max-error", type=float, default=bwtex.DEFAULT_MAX_ERROR,
+                        help="Largest root mean square error per channel (0-255) that --format auto accepts. Default: {0}".format(
+                                bwtex.DEFAULT_MAX_ERROR))
+    parser.add_argument("--backend", default=None, choices=list(BACKENDS),
+                        help=("Codec implementation to use. Default: the {0} environment variable, "
+                                "otherwise native if installed, otherwise reference.".format(BACKEND_ENV_VAR)))
+    parser.add_argument('--profile', action='store_true',
+                        help="Print the time spent in each stage of the conversion, summed over all files.")
+    parser.add_argument("--trace", default=None,
+                        help="Write a Chrome trace JSON of the whole batch to this path. Implies --profile.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=("Convert this many files at once in separate worker processes. "
+                                "Default: one file at a time in this process. --profile only covers this process."))
+    parser.add_argument("--progress-json", action='store_true',
+                        help=("Write progress events as JSON lines to stdout. "
+                                "Everything else that would be printed goes to stderr instead."))
+    parser.add_argument("--watch", action='store_true',
+                        help=("Keep running and convert files again whenever they change. "
+                                "Uses watchdog if it's installed, otherwise checks the folder every {0}s. "
+                                "--workers defaults to one per CPU.".format(WATCH_POLL_INTERVAL)))
+    parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE,
+                        help=("With --watch, how many seconds a file has to stay unchanged before it's converted. "
+                                "Default: {0}".format(WATCH_DEBOUNCE)))
+    parser.add_argument("--no-dedup", action='store_true',
+                        help=("Encode every PNG, even if another PNG with the same pixels and the same settings "
+                                "in its name was already encoded. By default those are copied with their own name."))
+    parser.add_argument("--report-duplicates", action='store_true',
+                        help="After converting PNGs, list the groups of PNGs that had the same pixels and settings.")
+    parser.add_argument("--metrics", action='store_true',
+                        help=("With --tobw, compare every new texture with its PNG and write PSNR, SSIM and the "
+                                "worst blocks to a .metrics.json file next to it, see texmetrics.py. Requires numpy."))
     parser.add_argument("outputfolder", default=None, nargs = '?',
                         help=("Path to output folder. Default is same folder as input.") )
 
     args = parser.parse_args()
     
-    currdir = os.path.dirname("__file__")
-    
-    assert args.bw1 is not args.bw2 
+    assert not (args.bw1 and args.bw2)
+    bw1 = True if args.bw1 else (False if args.bw2 else None)
     assert args.tobw is not args.topng 
     
-    game = "--bw1" if args.bw1 else "--bw2"
+    select_backend(args.backend)
+
+    if args.profile or args.trace is not None:
+        PROFILER.enable()
     
-    outputfolder = args.outputfolder
-    if outputfolder is None:
-        outputfolder = args.inputfolder
+    if args.metrics and args.topng:
+        parser.error("--metrics only works with --tobw")
+    if args.metrics and not NUMPY_INSTALLED:
+        parser.error("--metrics requires numpy")
+
+    if args.watch:
+        if args.report_duplicates:
+            parser.error("--report-duplicates can't be used with --watch")
+        convert = functools.partial(watch_folder, debounce=args.debounce, metrics=args.metrics)
+    else:
+        convert = functools.partial(convert_folder, dedup=not args.no_dedup, report_duplicates=args.report_duplicates,
+                                    metrics=args.metrics)
+
+    if args.progress_json:
+        events_out = sys.stdout
     
-    for fname in os.listdir(args.inputfolder):
-        if args.tobw:
-            if fname.endswith(".png"):
-                texname = fname.split(".")[0]
-                print("Converting", os.path.join(args.inputfolder, fname))
-                result = subprocess.call(["python",  
-                    os.path.join(currdir, "conv.py"), 
-                    game,
-                    os.path.join(args.inputfolder, fname),
-                    os.path.join(outputfolder, texname+".texture")])
-                
-                print("Saved to", os.path.join(outputfolder, texname+".texture"))
-        else:
-            if fname.endswith(".texture"):
-                print("Converting", os.path.join(args.inputfolder, fname))
-                with open(os.path.join(args.inputfolder, fname), "rb") as f:
-                    if args.bw1:
-                        tex = bwtex.BW1Texture.from_file(f)
-                    else:
-                        tex = bwtex.BW2Texture.from_file(f)
-                settings = tex.header_to_string()
-                tex.mipmaps[0].save(os.path.join(outputfolder, fname.replace(".texture", "")+"."+tex.fmt+"."+settings+".png"))
-                print("Saved to", os.path.join(outputfolder, fname.replace(".texture", "")+"."+tex.fmt+"."+settings+".png"))
\ No newline at end of file
+        def write_event(event):
+            events_out.write(json.dumps(event)+"\n")
+            events_out.flush()
+
+        with contextlib.redirect_stdout(sys.stderr):
+            convert(args.inputfolder, args.outputfolder, topng=args.topng, bw1=bw1,
+                           fmt=args.format, max_error=args.max_error, progress=write_event, workers=args.workers)
+            if PROFILER.enabled:
+                conv.print_profile(args.trace)
+    else:
+        convert(args.inputfolder, args.outputfolder, topng=args.topng, bw1=bw1,
+                       fmt=args.format, max_error=args.max_error, workers=args.workers)
+        if PROFILER.enabled:
+            conv.print_profile(args.trace)
@@ -0,0 +1,239 @@
+# Adds up how much memory the textures under one or more folders take: the palettes and pixel
+# data of all their mipmaps, read from the headers of their sections without decoding anything.
+# PNGs that weren't converted yet count with the format and mipmaps their name asks for.
+#
+#   python texbudget.py levels/C1_Bonus/
+#   python texbudget.py levels/ --by folder --top 20
+#   python texbudget.py edited/ --png-format P8 --limit 8M
+
+import os
+import sys
+import json
+import argparse
+from collections import namedtuple
+import bwtex
+
+GROUPINGS = ("folder", "format", "game", "kind")
+DEFAULT_TOP = 10
+
+# PNGs get the format conv.py gives them when their name has none
+DEFAULT_PNG_FORMAT = "DXT1"
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+class BudgetEntry(namedtuple("BudgetEntry", "path kind game fmt width height mipcount size")):
+    """One texture or PNG and the bytes its texture takes up in memory. game is None for PNGs
+    whose game can't be told from the name or the flags."""
+    __slots__ = ()
+
+
+def get_texture_entry(path):
+    """The texture at path and the bytes of all the mipmaps in its file. BW2 headers always say
+    there is one mipmap, so the MIP sections are counted instead."""
+    with open(path, "rb") as f:
+        header = bwtex.read_texture_header(f)
+        mipcount, size = bwtex.read_section_sizes(f)
+    return BudgetEntry(path, "texture", header.game, header.fmt, header.width, header.height, mipcount, size)
+
+
+def get_png_entry(path, bw1=None, default_fmt=DEFAULT_PNG_FORMAT):
+    """The texture conv.py would make of the PNG at path, from its size and name. Only the header
+    of the PNG is read."""
+    from PIL import Image
+    with Image.open(path) as img:
+        width, height = img.size
+
+    settings = os.path.basename(path).split(".")[1:]
+    fmt = settings.pop(0) if len(settings) > 2 else None
+    if fmt not in bwtex.STRTOFORMAT:
+        fmt = default_fmt
+    gen_mipmap = len(settings) > 1 and settings[0].lower() == "mipmap"
+
+    if bw1 is not None:
+        game = "bw1" if bw1 else "bw2"
+    else:
+        game = bwtex.sniff_game_from_settings(".".join(settings))
+    if gen_mipmap:
+        mipcount = bwtex.get_generated_mipmap_count(width, height)
+    else:
+        mipcount = 1
+    size = bwtex.get_texture_memory(fmt, width, height, mipcount)
+    return BudgetEntry(path, "png", game, fmt, width, height, mipcount, size)
+
+
+def is_converted(png_path, filenames):
+    """Whether the texture made of png_path is in the same folder, with the name conv.py or
+    massconvert.py give it. filenames holds the names of the files in that folder."""
+    fname = os.path.basename(png_path)
+    return fname+".texture" in filenames or fname.split(".")[0]+".texture" in filenames
+
+
+def find_files(roots):
+    """Paths of the textures under roots and of the PNGs that don't have their texture next to them."""
+    paths = []
+    for root in roots:
+        if os.path.isfile(root):
+            paths.append(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            names = set(filenames)
+            for fname in sorted(filenames):
+                path = os.path.join(dirpath, fname)
+                if fname.endswith(".texture") or (fname.endswith(".png") and not is_converted(path, names)):
+                    paths.append(path)
+    return paths
+
+
+def scan(roots, bw1=None, default_fmt=DEFAULT_PNG_FORMAT, errors=None):
+    """BudgetEntry of every texture and unconverted PNG under roots. Files that can't be read are
+    skipped and (path, error message) is appended to errors, or the error is raised if errors is None."""
+    entries = []
+    for path in find_files(roots):
+        try:
+            if path.endswith(".texture"):
+                entries.append(get_texture_entry(path))
+            else:
+                entries.append(get_png_entry(path, bw1, default_fmt))
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append((path, "{0}: {1}".format(type(e).__name__, e)))
+    return entries
+
+
+def get_group_key(entry, by):
+    if by == "folder":
+        return os.path.dirname(entry.path)
+    elif by == "format":
+        return entry.fmt
+    elif by == "game":
+        return entry.game or "unknown"
+    else:
+        return entry.kind
+
+
+def summarize(entries, by):
+    """[(group, number of textures, bytes)] for every group of entries, largest first."""
+    groups = {}
+    for entry in entries:
+        key = get_group_key(entry, by)
+        count, size = groups.get(key, (0, 0))
+        groups[key] = (count+1, size+entry.size)
+    return sorted(((key, count, size) for key, (count, size) in groups.items()), key=lambda group: (-group[2], group[0]))
+
+
+def get_top_entries(entries, top):
+    return sorted(entries, key=lambda entry: (-entry.size, entry.path))[:top]
+
+
+def parse_size(text):
+    """Number of bytes in text, which may end in K, M or G for KiB, MiB or GiB."""
+    text = text.strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    try:
+        return int(float(text[:len(text)-len(unit)])*SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError("Not a size: {0}".format(text))
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= SIZE_UNITS[unit]:
+            return "{0:.2f} {1}iB".format(size/SIZE_UNITS[unit], unit)
+    return "{0} B".format(size)
+
+
+def format_share(size, total):
+    return "{0:5.1f}%".format(100*size/total if total else 0)
+
+
+def print_report(entries, groupings, top):
+    total = sum(entry.size for entry in entries)
+    pngs = sum(1 for entry in entries if entry.kind == "png")
+    print("{0} textures, {1} ({2} bytes){3}".format(
+        len(entries), format_size(total), total, ", {0} of them unconverted PNGs".format(pngs) if pngs else ""))
+
+    for by in groupings:
+        print()
+        print("By {0}:".format(by))
+        for key, count, size in summarize(entries, by):
+            print("  {0:>12} {1} {2:>6}  {3}".format(format_size(size), format_share(size, total), count, key))
+
+    if top > 0 and entries:
+        print()
+        print("Largest {0}:".format(min(top, len(entries))))
+        for entry in get_top_entries(entries, top):
+            print("  {0:>12} {1} {2:<4} {3:>4}x{4:<4} {5:>2} mips  {6}{7}".format(
+                format_size(entry.size), format_share(entry.size, total), entry.fmt, entry.width, entry.height,
+                entry.mipcount, entry.path, " (PNG)" if entry.kind == "png" else ""))
+
+
+def get_report(entries, groupings, top):
+    """The report as a dict that can be written as JSON."""
+    return {
+        "total": sum(entry.size for entry in entries),
+        "files": len(entries),
+        "groups": {by: [{"group": key, "files": count, "bytes": size} for key, count, size in summarize(entries, by)]
+                   for by in groupings},
+        "largest": [entry._asdict() for entry in get_top_entries(entries, top)],
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=("Adds up the memory the textures under folders take, from their headers and the size "
+                     "and name of PNGs that aren't converted yet."))
+    parser.add_argument("roots", nargs='+', metavar="folder",
+                        help="Folders to add up, including their subfolders. Single files work too.")
+    parser.add_argument("--by", action='append', choices=GROUPINGS, default=None,
+                        help="Add up per folder, format, game or kind of file. Can be given more than once. Default: folder and format")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP,
+                        help="List this many of the largest textures. Default: {0}".format(DEFAULT_TOP))
+    parser.add_argument("--png-format", default=DEFAULT_PNG_FORMAT, choices=sorted(bwtex.STRTOFORMAT),
+                        help="Format of PNGs whose name doesn't have one. Default: {0}".format(DEFAULT_PNG_FORMAT))
+    parser.add_argument('--bw1', action='store_true',
+                        help="PNGs are for BW1. Default: detected from the header values in their name.")
+    parser.add_argument('--bw2', action='store_true',
+                        help="PNGs are for BW2. Default: detected from the header values in their name.")
+    parser.add_argument("--limit", type=parse_size, default=None, metavar="SIZE",
+                        help="Exit with an error if the total is above SIZE, in bytes or with K, M or G.")
+    parser.add_argument("--json", action='store_true',
+                        help="Print the report as JSON.")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.bw1 and args.bw2:
+        parser.error("--bw1 and --bw2 can't be used together")
+    bw1 = True if args.bw1 else (False if args.bw2 else None)
+    groupings = args.by or ["folder", "format"]
+
+    errors = []
+    entries = scan(args.roots, bw1, args.png_format, errors)
+    if args.json:
+        report = get_report(entries, groupings, args.top)
+        report["errors"] = [{"path": path, "error": error} for path, error in errors]
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(entries, groupings, args.top)
+        if errors:
+            print()
+            print("{0} files couldn't be read:".format(len(errors)))
+            for path, error in errors:
+                print("  {0}: {1}".format(path, error))
+
+    total = sum(entry.size for entry in entries)
+    if args.limit is not None and total > args.limit:
+        print("Over the limit of {0} by {1}".format(format_size(args.limit), format_size(total - args.limit)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
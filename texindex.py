@@ -0,0 +1,521 @@
+# Keeps a SQLite database of the textures and PNGs under one or more folders: their header
+# values, a hash of the encoded data, a hash of the decoded pixels of the first mipmap and a
+# perceptual hash for finding textures that look alike.
+# Updating only reads files whose modification time or size changed since the last update.
+#
+#   python texindex.py update extracted/ edited/
+#   python texindex.py query --format P8 --min-width 512
+#   python texindex.py duplicates --by pixels
+#   python texindex.py similar edited/rock.png --distance 8
+#   python texindex.py sql "SELECT fmt, count(*) FROM files GROUP BY fmt"
+
+import io
+import os
+import sys
+import time
+import struct
+import sqlite3
+import hashlib
+import argparse
+import bwtex
+from lib.texture_utils import NUMPY_INSTALLED
+from lib.codec_backends import BACKENDS, BACKEND_ENV_VAR, select_backend, get_backend
+
+DEFAULT_DATABASE = "texindex.db"
+EXTENSIONS = (".texture", ".png")
+
+# Files are committed to the database in batches so an interrupted update keeps what it did
+COMMIT_INTERVAL = 200
+
+HEADER_VALUE_COLUMNS = ("unkint2", "unkint3", "unkint4", "unkint5", "unkint6", "unkint7")
+
+# Hamming distance up to which similar lists textures by default. Out of 64 bits.
+DEFAULT_SIMILAR_DISTANCE = 8
+
+# Everything about a file except its path, in the order of the table columns
+FILE_COLUMNS = ("kind", "mtime_ns", "size", "game", "name", "fmt", "width", "height", "mipcount") + HEADER_VALUE_COLUMNS + (
+    "payload_hash", "pixel_hash", "phash", "error")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    game TEXT,
+    name TEXT,
+    fmt TEXT,
+    width INTEGER,
+    height INTEGER,
+    mipcount INTEGER,
+    unkint2 INTEGER,
+    unkint3 INTEGER,
+    unkint4 INTEGER,
+    unkint5 INTEGER,
+    unkint6 INTEGER,
+    unkint7 INTEGER,
+    payload_hash TEXT,
+    pixel_hash TEXT,
+    phash INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_fmt ON files (fmt);
+CREATE INDEX IF NOT EXISTS files_size ON files (width, height);
+CREATE INDEX IF NOT EXISTS files_payload_hash ON files (payload_hash);
+CREATE INDEX IF NOT EXISTS files_pixel_hash ON files (pixel_hash);
+"""
+
+# Columns added after the first version of the table, added to older databases when they're opened
+ADDED_COLUMNS = (("phash", "INTEGER"),)
+
+# Version of what scan_file stores, kept in the user_version of the database. The rows of older
+# databases are marked as changed when they're opened so update scans them again.
+# 2: the perceptual hash of lib.perceptual_hash changed. 3: mipcount counts the MIP sections.
+SCAN_VERSION = 3
+
+
+def hash_bytes(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_pixels(image):
+    """Hash of the size and RGBA pixels of a PIL image. A texture and a PNG with the same pixels get the same hash."""
+    image = image.convert("RGBA")
+    return hash_bytes(struct.pack("<II", image.width, image.height), image.tobytes())
+
+
+def get_perceptual_hash(image):
+    """The perceptual hash of a PIL image as SQLite stores it, or None without numpy."""
+    if not NUMPY_INSTALLED:
+        return None
+    from lib.perceptual_hash import perceptual_hash
+    value = perceptual_hash(image)
+    # SQLite integers are signed 64 bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def get_phash_mipmap_index(header):
+    """Index of the smallest mipmap that still has enough pixels for the perceptual hash."""
+    from lib.perceptual_hash import SAMPLE_SIZE
+    index = 0
+    for i in range(1, header.mipcount):
+        if min(header.width >> i, header.height >> i) < SAMPLE_SIZE:
+            break
+        index = i
+    return index
+
+
+def parse_png_name(path):
+    """Game, texture name, format and header values from a PNG name as written by conv.py and
+    massconvert.py, e.g. name.DXT1.4100.255.255.1.1024.0.png. What isn't in the name is None."""
+    settings = os.path.basename(path)[:-len(".png")].split(".")
+    name = settings[0]
+    fmt = settings[1] if len(settings) > 1 and settings[1] in bwtex.STRTOFORMAT else None
+
+    header_string = ".".join(settings[2:])
+    game = bwtex.sniff_game_from_settings(header_string)
+    values = settings[2:]
+    if values and values[0].lower() == "mipmap":
+        values.pop(0)
+    try:
+        values = [int(x) for x in values[:6]]
+    except ValueError:
+        values = []
+    if len(values) < 6:
+        values = [None]*6
+    values = [0xFFFFFFFF if x == -1 else x for x in values]
+    return game, name, fmt, values
+
+
+def scan_texture(path, with_pixels):
+    with open(path, "rb") as f:
+        data = f.read()
+    stream = io.BytesIO(data)
+    header = bwtex.read_texture_header(stream)
+    header_size = (bwtex.BW1_HEADER if header.game == "bw1" else bwtex.BW2_HEADER).size
+    # BW2 headers always say there is one mipmap, the MIP sections tell how many there are
+    mipcount, _ = bwtex.read_section_sizes(stream)
+    row = {
+        "kind": "texture", "game": header.game, "name": header.name, "fmt": header.fmt,
+        "width": header.width, "height": header.height, "mipcount": mipcount,
+        "payload_hash": hash_bytes(data[header_size:])
+    }
+    row.update(zip(HEADER_VALUE_COLUMNS, header.values))
+
+    if with_pixels or NUMPY_INSTALLED:
+        # The texture classes print while reading
+        with bwtex.quiet():
+            tex = bwtex.read_texture(io.BytesIO(data), header.game, decode_mipmaps=False)
+            if with_pixels:
+                mipmap = tex.decode_mipmap(0)
+                row["pixel_hash"] = hash_pixels(mipmap)
+            if NUMPY_INSTALLED:
+                # Looking alike doesn't need all the pixels, a small mipmap is much quicker to decode
+                phash_index = get_phash_mipmap_index(header)
+                if not with_pixels or phash_index != 0:
+                    mipmap = tex.decode_mipmap(phash_index)
+                row["phash"] = get_perceptual_hash(mipmap)
+    return row
+
+
+def scan_png(path, with_pixels):
+    from PIL import Image
+    with open(path, "rb") as f:
+        data = f.read()
+    game, name, fmt, values = parse_png_name(path)
+    with Image.open(io.BytesIO(data)) as image:
+        row = {
+            "kind": "png", "game": game, "name": name, "fmt": fmt,
+            "width": image.width, "height": image.height,
+            # The PNG only holds the first mipmap
+            "mipcount": 1,
+            "payload_hash": hash_bytes(data)
+        }
+        row.update(zip(HEADER_VALUE_COLUMNS, values))
+        if with_pixels:
+            row["pixel_hash"] = hash_pixels(image)
+        row["phash"] = get_perceptual_hash(image)
+    return row
+
+
+def scan_file(path, mtime_ns, size, with_pixels):
+    """Returns the path and the database row of a file. Files that can't be read get a row with the error."""
+    try:
+        if path.endswith(".texture"):
+            row = scan_texture(path, with_pixels)
+        else:
+            row = scan_png(path, with_pixels)
+    except Exception as e:
+        row = {"kind": "texture" if path.endswith(".texture") else "png",
+               "error": "{0}: {1}".format(type(e).__name__, e) if str(e) else type(e).__name__}
+    row.setdefault("error", None)
+    row["mtime_ns"] = mtime_ns
+    row["size"] = size
+    return path, row
+
+
+def scan_file_in_worker(args):
+    return scan_file(*args)
+
+
+def find_files(root):
+    """Returns {path: (mtime_ns, size)} for the textures and PNGs under root, with absolute paths."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if not fname.endswith(EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, fname)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted while we were looking
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+class TextureDatabase(object):
+    def __init__(self, path=DEFAULT_DATABASE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        columns = set(row["name"] for row in self.connection.execute("PRAGMA table_info(files)"))
+        for column, column_type in ADDED_COLUMNS:
+            if column not in columns:
+                self.connection.execute("ALTER TABLE files ADD COLUMN {0} {1}".format(column, column_type))
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCAN_VERSION:
+            # Old hashes can't be compared with new ones, similar mustn't find them before the next update
+            self.connection.execute("UPDATE files SET mtime_ns = 0, phash = NULL")
+            self.connection.execute("PRAGMA user_version = {0}".format(SCAN_VERSION))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def store(self, path, row):
+        columns = ("path",)+FILE_COLUMNS
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files ({0}) VALUES ({1})".format(", ".join(columns), ", ".join("?"*len(columns))),
+            [path]+[row.get(column) for column in FILE_COLUMNS])
+
+    def update(self, roots, with_pixels=True, workers=None, progress=None):
+        """Brings the database up to date with the files under roots. Only new files, files whose
+        modification time or size changed and files whose hashes weren't computed yet are read.
+        Rows of files that no longer exist under roots are removed. Returns a dict with the number
+        of files that were added, updated, removed, unchanged and failed."""
+        found = {}
+        for root in roots:
+            found.update(find_files(root))
+        prefixes = tuple(os.path.join(os.path.abspath(root), "") for root in roots)
+
+        known = {}
+        for row in self.connection.execute("SELECT path, mtime_ns, size, pixel_hash, phash, error FROM files"):
+            if row["path"].startswith(prefixes):
+                known[row["path"]] = row
+
+        to_scan = []
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+        for path, (mtime_ns, size) in found.items():
+            row = known.get(path)
+            if row is None:
+                stats["added"] += 1
+            elif (row["mtime_ns"], row["size"]) != (mtime_ns, size) or (row["error"] is None and (
+                    (with_pixels and row["pixel_hash"] is None) or (NUMPY_INSTALLED and row["phash"] is None))):
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+                continue
+            to_scan.append((path, mtime_ns, size, with_pixels))
+
+        removed = [path for path in known if path not in found]
+        stats["removed"] = len(removed)
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+
+        if workers is None:
+            workers = min(os.cpu_count() or 1, len(to_scan))
+        if workers > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers, initializer=select_backend, initargs=(get_backend().name,))
+            results = pool.imap_unordered(scan_file_in_worker, to_scan, chunksize=8)
+        else:
+            pool = None
+            results = (scan_file(*args) for args in to_scan)
+
+        try:
+            for done, (path, row) in enumerate(results, 1):
+                if row.get("error") is not None:
+                    stats["failed"] += 1
+                self.store(path, row)
+                if done % COMMIT_INTERVAL == 0:
+                    self.connection.commit()
+                if progress is not None:
+                    progress(done, len(to_scan), path, row)
+        finally:
+            self.connection.commit()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        return stats
+
+    def query(self, game=None, formats=None, kind=None, min_width=None, max_width=None, min_height=None,
+              max_height=None, mipcount=None, values=None, where=None, errors=False):
+        """Returns the rows of the files matching all given conditions, sorted by path.
+        values maps header value columns (unkint2 to unkint7) to the value they need to have,
+        where is an additional SQL condition."""
+        conditions = ["error IS NOT NULL" if errors else "error IS NULL"]
+        parameters = []
+
+        def add(condition, *condition_parameters):
+            conditions.append(condition)
+            parameters.extend(condition_parameters)
+
+        if game is not None:
+            add("game = ?", game)
+        if formats:
+            add("fmt IN ({0})".format(", ".join("?"*len(formats))), *formats)
+        if kind is not None:
+            add("kind = ?", kind)
+        if min_width is not None:
+            add("width >= ?", min_width)
+        if max_width is not None:
+            add("width <= ?", max_width)
+        if min_height is not None:
+            add("height >= ?", min_height)
+        if max_height is not None:
+            add("height <= ?", max_height)
+        if mipcount is not None:
+            add("mipcount = ?", mipcount)
+        for column, value in (values or {}).items():
+            if column not in HEADER_VALUE_COLUMNS:
+                raise ValueError("Unknown header value: {0}".format(column))
+            add("{0} = ?".format(column), 0xFFFFFFFF if value == -1 else value)
+        if where:
+            conditions.append("({0})".format(where))
+
+        return self.connection.execute(
+            "SELECT * FROM files WHERE {0} ORDER BY path".format(" AND ".join(conditions)), parameters).fetchall()
+
+    def similar(self, path, max_distance=DEFAULT_SIMILAR_DISTANCE):
+        """Returns (distance, path) of the files whose perceptual hash differs from that of the
+        texture or image at path in at most max_distance bits, closest first. path doesn't need
+        to be in the database, it's hashed if it isn't or if it changed."""
+        if not NUMPY_INSTALLED:
+            raise RuntimeError("Finding similar textures requires numpy.")
+        from lib.perceptual_hash import BKTree
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.connection.execute("SELECT mtime_ns, size, phash, error FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or (row["mtime_ns"], row["size"]) != (stat.st_mtime_ns, stat.st_size) or row["phash"] is None:
+            path, row = scan_file(path, stat.st_mtime_ns, stat.st_size, with_pixels=False)
+        if row["error"] is not None:
+            raise RuntimeError("Cannot read {0}: {1}".format(path, row["error"]))
+
+        tree = BKTree((phash & 0xFFFFFFFFFFFFFFFF, other_path) for other_path, phash in
+                      self.connection.execute("SELECT path, phash FROM files WHERE phash IS NOT NULL AND path != ?", (path,)))
+        return tree.search(row["phash"] & 0xFFFFFFFFFFFFFFFF, max_distance)
+
+    def duplicates(self, by="payload"):
+        """Groups of paths of files with the same encoded data (by="payload") or the same
+        decoded pixels (by="pixels"), largest groups first."""
+        column = {"payload": "payload_hash", "pixels": "pixel_hash"}[by]
+        groups = {}
+        for row in self.connection.execute(
+                "SELECT {0} AS hash, path FROM files WHERE {0} IN "
+                "(SELECT {0} FROM files WHERE {0} IS NOT NULL GROUP BY {0} HAVING count(*) > 1) "
+                "ORDER BY path".format(column)):
+            groups.setdefault(row["hash"], []).append(row["path"])
+        return sorted(groups.values(), key=lambda paths: (-len(paths), paths[0]))
+
+
+def format_row(row, long):
+    if not long:
+        return row["path"]
+    if row["error"] is not None:
+        return "{0}\t{1}".format(row["path"], row["error"])
+    values = ".".join("-1" if row[column] == 0xFFFFFFFF else str(row[column]) for column in HEADER_VALUE_COLUMNS
+                      if row[column] is not None)
+    return "\t".join(str(x) for x in (row["path"], row["game"] or "?", row["fmt"] or "?",
+                                       "{0}x{1}".format(row["width"], row["height"]), row["mipcount"], values or "-"))
+
+
+def parse_header_value(text):
+    column, sep, value = text.partition("=")
+    if not sep or column not in HEADER_VALUE_COLUMNS:
+        raise argparse.ArgumentTypeError("expected unkint2=VALUE to unkint7=VALUE, not {0}".format(text))
+    try:
+        return column, int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("{0} is not a number".format(value))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Indexes the textures and PNGs under folders in a SQLite database and answers questions about them.")
+    parser.add_argument("--db", default=DEFAULT_DATABASE,
+                        help="Path of the database. Default: {0}".format(DEFAULT_DATABASE))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Add new and changed files to the database and remove deleted ones.")
+    update.add_argument("roots", nargs='+', metavar="folder",
+                        help="Folders to index, including their subfolders.")
+    update.add_argument("--no-pixels", action='store_true',
+                        help="Don't decode the files to hash their pixels, which makes indexing much faster.")
+    update.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes that read files. Default: one per CPU")
+    update.add_argument("--backend", default=None, choices=list(BACKENDS),
+                        help=("Codec implementation used to decode textures. Default: the {0} environment variable, "
+                                "otherwise native if installed, otherwise reference.".format(BACKEND_ENV_VAR)))
+    update.add_argument("-v", "--verbose", action='store_true',
+                        help="Print every file that is read and the error of files that can't be read.")
+
+    query = commands.add_parser("query", help="List the files matching all given conditions.")
+    query.add_argument("--game", choices=("bw1", "bw2"), default=None)
+    query.add_argument("-f", "--format", dest="formats", action='append', default=None,
+                       help="Texture format, can be given more than once.")
+    query.add_argument("--kind", choices=("texture", "png"), default=None)
+    query.add_argument("--min-width", type=int, default=None)
+    query.add_argument("--max-width", type=int, default=None)
+    query.add_argument("--min-height", type=int, default=None)
+    query.add_argument("--max-height", type=int, default=None)
+    query.add_argument("--mipcount", type=int, default=None)
+    query.add_argument("--value", type=parse_header_value, action='append', default=[], metavar="unkintN=VALUE",
+                       help="Header value that has to match, e.g. unkint2=4100. Can be given more than once.")
+    query.add_argument("--where", default=None,
+                       help="Additional SQL condition on the columns of the files table.")
+    query.add_argument("--errors", action='store_true',
+                       help="List the files that couldn't be read instead.")
+    query.add_argument("-l", "--long", action='store_true',
+                       help="Also print game, format, size, mipmap count and header values.")
+    query.add_argument("--count", action='store_true',
+                       help="Only print how many files match.")
+
+    duplicates = commands.add_parser("duplicates", help="List groups of files with the same content.")
+    duplicates.add_argument("--by", choices=("payload", "pixels"), default="payload",
+                            help=("payload: same encoded texture data (the whole file for PNGs). "
+                                    "pixels: same decoded pixels in the first mipmap. Default: payload"))
+
+    similar = commands.add_parser("similar", help="List the files that look like a texture or image, closest first.")
+    similar.add_argument("path",
+                         help="Texture or image to compare against. It doesn't need to be indexed.")
+    similar.add_argument("-d", "--distance", type=int, default=DEFAULT_SIMILAR_DISTANCE,
+                         help=("How many of the 64 bits of the perceptual hashes may differ. 0 finds only "
+                                 "near exact copies, around 10 also recolors and edits. Default: {0}".format(DEFAULT_SIMILAR_DISTANCE)))
+    similar.add_argument("-n", "--limit", type=int, default=None,
+                         help="Only list this many of the closest files.")
+
+    sql = commands.add_parser("sql", help="Run an SQL statement on the files table and print the result.")
+    sql.add_argument("statement")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    with TextureDatabase(args.db) as database:
+        if args.command == "update":
+            select_backend(args.backend)
+
+            def progress(done, total, path, row):
+                if args.verbose:
+                    print("[{0}/{1}] {2}{3}".format(done, total, path, " ({0})".format(row["error"]) if row.get("error") else ""))
+
+            start = time.time()
+            stats = database.update(args.roots, with_pixels=not args.no_pixels, workers=args.workers, progress=progress)
+            print("{added} added, {updated} updated, {removed} removed, {unchanged} unchanged, {failed} couldn't be read".format(**stats),
+                  "({0:.2f}s)".format(time.time()-start))
+
+        elif args.command == "query":
+            rows = database.query(
+                game=args.game, formats=args.formats, kind=args.kind,
+                min_width=args.min_width, max_width=args.max_width, min_height=args.min_height, max_height=args.max_height,
+                mipcount=args.mipcount, values=dict(args.value), where=args.where, errors=args.errors)
+            if args.count:
+                print(len(rows))
+            else:
+                for row in rows:
+                    print(format_row(row, args.long or args.errors))
+
+        elif args.command == "duplicates":
+            groups = database.duplicates(args.by)
+            for paths in groups:
+                print("\n".join(paths))
+                print()
+            print("{0} groups, {1} files that are copies".format(len(groups), sum(len(paths)-1 for paths in groups)))
+
+        elif args.command == "similar":
+            for distance, path in database.similar(args.path, args.distance)[:args.limit]:
+                print("{0}\t{1}".format(distance, path))
+
+        elif args.command == "sql":
+            cursor = database.connection.execute(args.statement)
+            if cursor.description is not None:
+                print("\t".join(column[0] for column in cursor.description))
+                for row in cursor:
+                    print("\t".join("" if value is None else str(value) for value in row))
+            database.connection.commit()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except sqlite3.Error as e:
+        print("Database error:", e, file=sys.stderr)
+        sys.exit(1)
+    except (OSError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
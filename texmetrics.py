@@ -0,0 +1,99 @@
+# Compares an encoded texture with the PNG it was made from: PSNR and SSIM of every channel,
+# the error in the alpha channel and the blocks of the texture format with the largest error.
+#
+#   python texmetrics.py rock.texture rock.DXT1.png
+#   python texmetrics.py rock.texture rock.DXT1.png --worst 20 --json
+
+import sys
+import json
+import argparse
+import bwtex
+from lib.texture_utils import NUMPY_INSTALLED
+from lib.codec_backends import BACKENDS, BACKEND_ENV_VAR, select_backend
+
+
+def compare_texture(data, source, worst=None):
+    """Returns the TextureMetrics of the first mipmap of the texture file in data, any bytes-like
+    object, compared with the PIL image source. worst is the number of blocks to list, by default
+    DEFAULT_WORST_BLOCKS."""
+    if not NUMPY_INSTALLED:
+        raise RuntimeError("Measuring textures requires numpy.")
+    from lib.texture_metrics import TextureMetrics, DEFAULT_WORST_BLOCKS
+
+    result = bwtex.decode_texture(data, mipmaps=1)
+    if source.size != result.mipmap_sizes[0]:
+        raise ValueError("The image is {0}x{1} but the texture is {2}x{3}".format(
+            source.width, source.height, result.width, result.height))
+    return TextureMetrics.from_images(
+        source, result.to_image(0), bwtex.FORMAT[result.fmt],
+        DEFAULT_WORST_BLOCKS if worst is None else worst)
+
+
+def measure_texture(texture_path, source_path, worst=None):
+    """compare_texture for the texture at texture_path and the image at source_path."""
+    from PIL import Image
+
+    with open(texture_path, "rb") as f:
+        data = f.read()
+    with Image.open(source_path) as source:
+        source.load()
+        try:
+            return compare_texture(data, source, worst)
+        except ValueError as e:
+            raise ValueError("{0} and {1}: {2}".format(source_path, texture_path, e))
+
+
+def print_metrics(texture_path, source_path, fmt, metrics):
+    from lib.texture_metrics import CHANNELS, format_psnr
+    print("{0} compared with {1} ({2}, {3}x{4})".format(texture_path, source_path, fmt, metrics.width, metrics.height))
+    print("{0:<8} {1:>9} {2:>8} {3:>10}".format("Channel", "PSNR dB", "SSIM", "MSE"))
+    for channel, psnr, ssim, mse in zip(CHANNELS, metrics.psnr, metrics.ssim, metrics.mse):
+        print("{0:<8} {1:>9} {2:>8.4f} {3:>10.3f}".format(channel.upper(), format_psnr(psnr), ssim, mse))
+    print("{0:<8} {1:>9}".format("RGB", format_psnr(metrics.rgb_psnr)))
+    print("Largest error: {0}, alpha error max {1} mean {2:.3f}".format(
+        metrics.max_error, metrics.alpha_max_error, metrics.alpha_mean_error))
+
+    if metrics.worst_blocks:
+        print("Worst blocks:")
+        for block in metrics.worst_blocks:
+            print("  x {x:>5} y {y:>5} {width}x{height}  MSE {mse:>9.2f}  max error {max_error}".format(**block))
+    elif metrics.max_error == 0:
+        print("No block has any error")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Decodes a texture and compares it with the image it was encoded from.")
+    parser.add_argument("texture",
+                        help="Path of the texture.")
+    parser.add_argument("source",
+                        help="Path of the image the texture was made from.")
+    parser.add_argument("-n", "--worst", type=int, default=None,
+                        help="List this many blocks with the largest error. Default: 10")
+    parser.add_argument("--json", action='store_true',
+                        help="Print the metrics as JSON.")
+    parser.add_argument("--backend", default=None, choices=list(BACKENDS),
+                        help=("Codec implementation to use. Default: the {0} environment variable, "
+                                "otherwise native if installed, otherwise reference.".format(BACKEND_ENV_VAR)))
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    select_backend(args.backend)
+
+    metrics = measure_texture(args.texture, args.source, args.worst)
+    if args.json:
+        print(json.dumps(metrics.to_dict(), indent=2))
+    else:
+        with open(args.texture, "rb") as f:
+            fmt = bwtex.read_texture_header(f).fmt
+        print_metrics(args.texture, args.source, fmt, metrics)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -3,13 +3,31 @@ from tkinter import filedialog, ttk, messagebox
 import os
 import subprocess
 import threading
+import queue
 import sys
 from PIL import Image, ImageTk
+from massconvert import BatchConversion, ProgressTracker
+from thumbnails import THUMBNAIL_SIZE, fit_image, load_fitted_image, ThumbnailLoader
 
 # Add necessary paths for imports
 if not os.path.exists('lib'):
     os.makedirs('lib')
 
+# Size of the box previews are shown in
+PREVIEW_MAX_WIDTH = 400
+PREVIEW_MAX_HEIGHT = 300
+
+# Number of thumbnails per row on the batch tab
+THUMBNAIL_COLUMNS = 8
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
 def setup_military_theme(root):
     """Configure military-themed styling for the application"""
     # Create a style object to manage themed widget appearances
@@ -271,6 +289,14 @@ class TextureConverterGUI:
         # Preview image variables
         self.preview_image = None
         self.preview_photo = None
+        self.preview_generation = 0
+        
+        # Thumbnail grid variables
+        self.thumbnail_loader = None
+        self.thumbnail_photos = {}
+        
+        # Running batch conversion
+        self.batch_conversion = None
         
         # Progress variable
         self.progress_var = tk.DoubleVar()
@@ -297,6 +323,12 @@ class TextureConverterGUI:
         ttk.Entry(input_frame, textvariable=self.single_input_var, width=120).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W+tk.E)
         ttk.Button(input_frame, text="Browse...", command=self.browse_single_input).grid(row=0, column=2, padx=5, pady=5)
         
+        # Original texture (optional, PNG to Texture only)
+        self.single_original_var = tk.StringVar()
+        ttk.Label(input_frame, text="Original Texture:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Entry(input_frame, textvariable=self.single_original_var, width=120).grid(row=1, column=1, padx=5, pady=5, sticky=tk.W+tk.E)
+        ttk.Button(input_frame, text="Browse...", command=self.browse_single_original).grid(row=1, column=2, padx=5, pady=5)
+        
         # Settings frame
         settings_frame = ttk.LabelFrame(self.single_tab, text="Conversion Settings")
         settings_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -350,6 +382,27 @@ class TextureConverterGUI:
         ttk.Radiobutton(settings_frame, text="Texture to PNG", variable=self.batch_conversion_direction_var, value="to_png").grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
         ttk.Radiobutton(settings_frame, text="PNG to Texture", variable=self.batch_conversion_direction_var, value="to_texture").grid(row=1, column=2, sticky=tk.W, padx=5, pady=5)
         
+        # Thumbnail frame
+        thumbnail_frame = ttk.LabelFrame(self.batch_tab, text="Thumbnails")
+        thumbnail_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        thumbnail_buttons = ttk.Frame(thumbnail_frame)
+        thumbnail_buttons.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Button(thumbnail_buttons, text="Show Thumbnails", command=self.show_thumbnails).pack(side=tk.LEFT)
+        self.thumbnail_status_label = ttk.Label(thumbnail_buttons, text="")
+        self.thumbnail_status_label.pack(side=tk.LEFT, padx=10)
+        
+        # Scrollable grid of thumbnails
+        self.thumbnail_canvas = tk.Canvas(thumbnail_frame, bg=self.colors['background'], highlightthickness=0, height=250)
+        thumbnail_scrollbar = ttk.Scrollbar(thumbnail_frame, orient=tk.VERTICAL, command=self.thumbnail_canvas.yview)
+        self.thumbnail_canvas.configure(yscrollcommand=thumbnail_scrollbar.set)
+        thumbnail_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.thumbnail_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        self.thumbnail_grid = ttk.Frame(self.thumbnail_canvas)
+        self.thumbnail_canvas.create_window((0, 0), window=self.thumbnail_grid, anchor=tk.NW)
+        self.thumbnail_grid.bind("<Configure>", lambda e: self.thumbnail_canvas.configure(scrollregion=self.thumbnail_canvas.bbox("all")))
+        
         # Progress frame
         progress_frame = ttk.LabelFrame(self.batch_tab, text="Progress")
         progress_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -362,8 +415,18 @@ class TextureConverterGUI:
         self.progress_label = ttk.Label(progress_frame, text="Ready")
         self.progress_label.pack(pady=5)
         
-        # Convert button
-        ttk.Button(self.batch_tab, text="Convert All", command=self.convert_batch).pack(pady=10)
+        # Worker count and batch controls
+        batch_buttons = ttk.Frame(self.batch_tab)
+        batch_buttons.pack(pady=10)
+        ttk.Label(batch_buttons, text="Workers:").pack(side=tk.LEFT, padx=5)
+        self.batch_workers_var = tk.IntVar(value=os.cpu_count() or 1)
+        ttk.Spinbox(batch_buttons, from_=1, to=max(os.cpu_count() or 1, 1)*2, textvariable=self.batch_workers_var, width=4).pack(side=tk.LEFT, padx=5)
+        self.batch_convert_button = ttk.Button(batch_buttons, text="Convert All", command=self.convert_batch)
+        self.batch_convert_button.pack(side=tk.LEFT, padx=5)
+        self.batch_pause_button = ttk.Button(batch_buttons, text="Pause", command=self.toggle_pause_batch, state=tk.DISABLED)
+        self.batch_pause_button.pack(side=tk.LEFT, padx=5)
+        self.batch_cancel_button = ttk.Button(batch_buttons, text="Cancel", command=self.cancel_batch, state=tk.DISABLED)
+        self.batch_cancel_button.pack(side=tk.LEFT, padx=5)
 
     def browse_single_input(self):
         if self.conversion_direction_var.get() == "to_png":
@@ -376,10 +439,79 @@ class TextureConverterGUI:
             self.single_input_var.set(filename)
             self.update_preview()
 
+    def browse_single_original(self):
+        filetypes = [("Texture files", "*.texture"), ("All files", "*.*")]
+        filename = filedialog.askopenfilename(filetypes=filetypes)
+        if filename:
+            self.single_original_var.set(filename)
+
     def browse_batch_input(self):
         folder = filedialog.askdirectory()
         if folder:
             self.batch_input_var.set(folder)
+            self.show_thumbnails()
+
+    def show_thumbnails(self):
+        input_folder = self.batch_input_var.get()
+        if self.thumbnail_loader is not None:
+            self.thumbnail_loader.cancel()
+            self.thumbnail_loader = None
+        
+        for widget in self.thumbnail_grid.winfo_children():
+            widget.destroy()
+        self.thumbnail_photos = {}
+        
+        if not input_folder or not os.path.isdir(input_folder):
+            self.thumbnail_status_label.config(text="No folder selected or folder does not exist")
+            return
+        
+        # Show the files the batch conversion would convert
+        file_extension = ".png" if self.batch_conversion_direction_var.get() == "to_texture" else ".texture"
+        paths = [os.path.join(input_folder, fname) for fname in sorted(os.listdir(input_folder))
+                    if fname.lower().endswith(file_extension)]
+        
+        # Placeholders in the final order, filled in as the thumbnails arrive
+        self.thumbnail_cells = []
+        for index, path in enumerate(paths):
+            cell = ttk.Label(self.thumbnail_grid, text=os.path.basename(path), compound=tk.TOP, 
+                             width=14, anchor=tk.CENTER, wraplength=THUMBNAIL_SIZE+20)
+            cell.grid(row=index // THUMBNAIL_COLUMNS, column=index % THUMBNAIL_COLUMNS, padx=2, pady=2, sticky=tk.N)
+            self.thumbnail_cells.append(cell)
+        
+        self.thumbnail_done = 0
+        self.thumbnail_status_label.config(text=f"Loading {len(paths)} thumbnails...")
+        self.thumbnail_loader = ThumbnailLoader(paths, self.batch_game_version_var.get())
+        self.thumbnail_loader.start()
+        self.poll_thumbnails(self.thumbnail_loader)
+
+    def poll_thumbnails(self, loader):
+        """Moves finished thumbnails from the loader into the grid, keeps polling until the loader is done"""
+        if loader is not self.thumbnail_loader:
+            return
+        
+        while True:
+            try:
+                result = loader.results.get_nowait()
+            except queue.Empty:
+                break
+            
+            if result is None:
+                self.thumbnail_status_label.config(text=f"Loaded {self.thumbnail_done} of {len(loader.paths)} thumbnails")
+                self.thumbnail_loader = None
+                return
+            
+            index, path, img, error = result
+            cell = self.thumbnail_cells[index]
+            if error is not None:
+                cell.config(text=f"{os.path.basename(path)}\n(error)")
+            else:
+                photo = ImageTk.PhotoImage(img)
+                self.thumbnail_photos[index] = photo
+                cell.config(image=photo)
+            self.thumbnail_done += 1
+        
+        self.thumbnail_status_label.config(text=f"Loaded {self.thumbnail_done} of {len(loader.paths)} thumbnails")
+        self.root.after(50, self.poll_thumbnails, loader)
 
     def update_preview(self):
         input_file = self.single_input_var.get()
@@ -387,56 +519,40 @@ class TextureConverterGUI:
             self.preview_label.config(text="No file selected or file does not exist")
             return
         
+        if not input_file.lower().endswith(('.png', '.texture')):
+            self.preview_label.config(text="Unsupported file type for preview")
+            return
+        
+        # Results of older previews that finish after this one are thrown away
+        self.preview_generation += 1
+        generation = self.preview_generation
+        self.preview_label.config(text="Loading preview...")
+        
+        preview_thread = threading.Thread(
+            target=self.load_preview, args=(generation, input_file, self.game_version_var.get()))
+        preview_thread.daemon = True
+        preview_thread.start()
+
+    def load_preview(self, generation, input_file, game_version):
+        """Runs on a worker thread, decodes the preview and hands it to the Tk thread"""
         try:
-            if input_file.lower().endswith('.png'):
-                # For PNG, show preview directly
-                img = Image.open(input_file)
-                self.display_preview_image(img)
-            elif input_file.lower().endswith('.texture'):
-                # For texture files, try to convert them first
-                self.preview_label.config(text="Loading texture preview...")
-                self.root.update_idletasks()
-                
-                # Create a temporary command to get a PNG for preview
-                game_version = self.game_version_var.get()
-                temp_output_file = os.path.join(os.path.dirname(input_file), "_temp_preview.png")
-                
-                try:
-                    # Use the direct Python script for preview generation
-                    game_flag = "--bw1" if game_version == "bw1" else "--bw2"
-                    cmd = ["python", "conv.py", game_flag, input_file, temp_output_file]
-                    
-                    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    
-                    if os.path.exists(temp_output_file):
-                        img = Image.open(temp_output_file)
-                        self.display_preview_image(img)
-                        # Clean up temporary file
-                        try:
-                            os.remove(temp_output_file)
-                        except:
-                            pass
-                    else:
-                        self.preview_label.config(text="Failed to generate preview")
-                except Exception as e:
-                    self.preview_label.config(text=f"Error generating preview: {str(e)}")
-            else:
-                self.preview_label.config(text="Unsupported file type for preview")
+            img = load_fitted_image(input_file, PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT, game_version)
+            error = None
         except Exception as e:
-            self.preview_label.config(text=f"Error loading preview: {str(e)}")
+            img = None
+            error = e
+        self.root.after(0, self.show_preview, generation, img, error)
+
+    def show_preview(self, generation, img, error):
+        if generation != self.preview_generation:
+            return
+        if error is not None:
+            self.preview_label.config(image="", text=f"Error loading preview: {str(error)}")
+        else:
+            self.display_preview_image(img)
 
     def display_preview_image(self, img):
-        # Resize image if it's too large
-        max_width = 400
-        max_height = 300
-        width, height = img.size
-        
-        if width > max_width or height > max_height:
-            # Calculate new size maintaining aspect ratio
-            ratio = min(max_width / width, max_height / height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+        img = fit_image(img, PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT)
         
         # Convert to PhotoImage and display
         self.preview_image = img
@@ -465,9 +581,18 @@ class TextureConverterGUI:
             cmd = [batch_file, input_file, output_file]
         else:
             output_file = os.path.join(input_dir, f"{filename}.texture")
-            # Use the appropriate batch file for PNG to texture conversion
-            batch_file = "convert_bw1.bat" if self.game_version_var.get() == "bw1" else "convert_bw2.bat"
-            cmd = [batch_file, input_file, output_file]
+            original_file = self.single_original_var.get()
+            if original_file:
+                if not os.path.exists(original_file):
+                    messagebox.showerror("Error", "Original texture does not exist")
+                    return
+                # Reuse the unchanged blocks of the original texture, the batch files don't pass extra options
+                game_flag = "--bw1" if self.game_version_var.get() == "bw1" else "--bw2"
+                cmd = [sys.executable, "conv.py", game_flag, "--original", original_file, input_file, output_file]
+            else:
+                # Use the appropriate batch file for PNG to texture conversion
+                batch_file = "convert_bw1.bat" if self.game_version_var.get() == "bw1" else "convert_bw2.bat"
+                cmd = [batch_file, input_file, output_file]
         
         # Show a message box to indicate conversion has started
         messagebox.showinfo("Conversion Started", f"{input_basename} successfully converted")
@@ -495,48 +620,66 @@ class TextureConverterGUI:
         self.progress_var.set(0)
         self.progress_label.config(text="Starting conversion...")
         
-        # Select the appropriate batch file based on settings
-        if self.batch_conversion_direction_var.get() == "to_png":
-            # For texture to PNG
-            if self.batch_game_version_var.get() == "bw1":
-                batch_file = "massconvert_bw1_to_png.bat"
-            else:
-                batch_file = "massconvert_bw2_to_png.bat"
-        else:
-            # For PNG to texture
-            if self.batch_game_version_var.get() == "bw1":
-                batch_file = "massconvert_png_to_bw1.bat"
-            else:
-                batch_file = "massconvert_png_to_bw2.bat"
-        
-        # Use the same folder for input and output (don't create a separate output folder)
-        cmd = [batch_file, input_folder]
+        topng = self.batch_conversion_direction_var.get() == "to_png"
+        bw1 = self.batch_game_version_var.get() == "bw1"
         
         # Count files to process before starting
-        file_extension = ".png" if "png_to" in batch_file else ".texture"
-        total_files = 0
-        
-        for root, dirs, files in os.walk(input_folder):
-            for file in files:
-                if file.lower().endswith(file_extension):
-                    total_files += 1
+        file_extension = ".texture" if topng else ".png"
+        total_files = len([fname for fname in os.listdir(input_folder) if fname.endswith(file_extension)])
         
         if total_files == 0:
             messagebox.showerror("Error", f"No {file_extension} files found in the input folder")
             return
         
+        try:
+            workers = max(int(self.batch_workers_var.get()), 1)
+        except (tk.TclError, ValueError):
+            messagebox.showerror("Error", "The number of workers needs to be a number")
+            return
+        
         # Show a message box to indicate batch conversion has started
         messagebox.showinfo("Batch Conversion Started", 
                         f"Starting batch conversion of {total_files} files.\nThis may take some time depending on the number of files.")
         
         # Update status bar
-        self.status_var.set(f"Running batch conversion: {' '.join(cmd)}")
-        self.root.update_idletasks()
+        self.status_var.set(f"Running batch conversion of {input_folder} with {workers} workers")
         
-        # Run conversion in a separate thread to avoid freezing the UI
-        conversion_thread = threading.Thread(target=self.run_batch_command, args=(cmd,))
+        # The conversion runs on a worker thread and reports through the events queue, 
+        # which poll_batch_events reads on the Tk thread
+        self.batch_events = queue.Queue()
+        self.batch_tracker = ProgressTracker()
+        self.batch_conversion = BatchConversion(
+            input_folder, topng=topng, bw1=bw1, workers=workers, 
+            progress=lambda event: self.batch_events.put(("progress", event)))
+        
+        self.batch_convert_button.config(state=tk.DISABLED)
+        self.batch_pause_button.config(state=tk.NORMAL, text="Pause")
+        self.batch_cancel_button.config(state=tk.NORMAL)
+        
+        conversion_thread = threading.Thread(target=self.run_batch_conversion, args=(self.batch_conversion, self.batch_events))
         conversion_thread.daemon = True  # Make thread terminate when main program exits
         conversion_thread.start()
+        self.poll_batch_events(self.batch_events)
+
+    def toggle_pause_batch(self):
+        conversion = self.batch_conversion
+        if conversion is None:
+            return
+        if conversion.paused:
+            conversion.resume()
+            self.batch_pause_button.config(text="Pause")
+            self.status_var.set("Batch conversion resumed")
+        else:
+            conversion.pause()
+            self.batch_pause_button.config(text="Resume")
+            self.status_var.set("Pausing batch conversion, waiting for the files in progress...")
+
+    def cancel_batch(self):
+        if self.batch_conversion is not None:
+            self.batch_conversion.cancel()
+            self.batch_pause_button.config(state=tk.DISABLED)
+            self.batch_cancel_button.config(state=tk.DISABLED)
+            self.status_var.set("Cancelling batch conversion...")
 
     def run_command(self, cmd):
         """Run a command and handle the output"""
@@ -613,154 +756,123 @@ class TextureConverterGUI:
             self.status_var.set(f"Error: {str(e)}")
             messagebox.showerror("Error", f"Error during conversion: {str(e)}")
 
-    def run_batch_command(self, cmd):
-        """Run a batch command with progress monitoring"""
+    def run_batch_conversion(self, conversion, events):
+        """Runs on the worker thread"""
         try:
-            # Reset progress bar
-            self.progress_var.set(0)
-            self.progress_label.config(text="Starting conversion...")
-            
-            # First, count the total number of files to be processed
-            input_folder = cmd[1]
-            file_extension = ".png" if "png_to" in cmd[0] else ".texture"
-            total_files = 0
-            
-            for root, dirs, files in os.walk(input_folder):
-                for file in files:
-                    if file.lower().endswith(file_extension):
-                        total_files += 1
+            conversion.run()
+            events.put(("exit", None))
+        except Exception as e:
+            events.put(("exception", e))
+
+    def poll_batch_events(self, events):
+        """Shows the progress of the batch conversion, runs on the Tk thread until the conversion is over"""
+        tracker = self.batch_tracker
+        while True:
+            try:
+                kind, value = events.get_nowait()
+            except queue.Empty:
+                break
             
-            if total_files == 0:
-                messagebox.showerror("Error", f"No {file_extension} files found in the input folder")
+            if kind == "progress":
+                tracker.update(value)
+                if value["event"] in ("file_start", "stage", "file_done"):
+                    self.progress_var.set(tracker.fraction * 100)
+                    text = f"Processing: {os.path.basename(tracker.current_file)} ({tracker.files_done}/{tracker.files_total})"
+                    if tracker.current_stage is not None and value["event"] != "file_done":
+                        text += f" - {tracker.current_stage}"
+                    eta = tracker.get_eta()
+                    if eta is not None:
+                        text += f", about {format_duration(eta)} left"
+                    if tracker.errors:
+                        text += f", {len(tracker.errors)} failed"
+                    self.progress_label.config(text=text)
+                elif value["event"] == "paused":
+                    self.progress_label.config(text=f"Paused ({tracker.files_done}/{tracker.files_total})")
+                    self.status_var.set("Batch conversion paused")
+            elif kind == "exception":
+                self.end_batch()
+                self.status_var.set(f"Error: {str(value)}")
+                self.progress_label.config(text=f"Error: {str(value)}")
+                messagebox.showerror("Error", f"Error during batch conversion: {str(value)}")
                 return
-            
-            self.progress_label.config(text=f"Found {total_files} files to convert")
-            self.root.update_idletasks()
-            
-            # Now run the conversion process
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, universal_newlines=True)
+            elif kind == "exit":
+                self.finish_batch()
+                return
+        
+        self.root.after(100, self.poll_batch_events, events)
+
+    def end_batch(self):
+        self.batch_conversion = None
+        self.batch_convert_button.config(state=tk.NORMAL)
+        self.batch_pause_button.config(state=tk.DISABLED, text="Pause")
+        self.batch_cancel_button.config(state=tk.DISABLED)
+
+    def finish_batch(self):
+        tracker = self.batch_tracker
+        cancelled = self.batch_conversion.cancelled
+        self.end_batch()
+        
+        converted = tracker.files_done - len(tracker.errors)
+        if cancelled:
+            self.progress_label.config(text=f"Conversion cancelled after converting {converted} of {tracker.files_total} files.")
+            self.status_var.set("Batch conversion cancelled")
+        elif not tracker.errors:
+            self.progress_var.set(100)
+            self.progress_label.config(text=f"Conversion completed successfully! Converted {converted} files in {format_duration(tracker.elapsed)}.")
+            self.status_var.set("Batch conversion completed successfully")
+            messagebox.showinfo("Batch Conversion Complete", 
+                            f"Batch conversion completed successfully!\n\nConverted {converted} files.")
+        else:
+            message = f"{len(tracker.errors)} of {tracker.files_done} files failed to convert"
+            self.status_var.set(message)
+            self.progress_label.config(text=message)
             
             output = []
-            processed_files = 0
-            current_file = ""
-            is_png_to_texture = "png_to" in cmd[0]
-            
-            # Track processed files to avoid double counting
-            processed_file_paths = set()
-            
-            # Read output line by line
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    line = line.strip()
-                    output.append(line)
-                    
-                    # Check for converting/processing file messages
-                    if "Converting" in line or "Processing file" in line:
-                        # Extract the filename from the line
-                        if "Converting" in line:
-                            file_path = line.split("Converting ")[-1].strip()
-                        else:
-                            file_path = line.split("Processing file")[-1].strip()
-                        
-                        # For PNG to texture conversion, we'll only count a file once
-                        # even though there might be both "Processing" and "Converting" messages
-                        if is_png_to_texture:
-                            if file_path not in processed_file_paths:
-                                processed_file_paths.add(file_path)
-                                processed_files += 1
-                        else:
-                            # For texture to PNG, we'll count each "Converting" message
-                            processed_files += 1
-                        
-                        current_file = os.path.basename(file_path)
-                        
-                        # Update progress
-                        progress_percent = min(100, (processed_files / total_files) * 100)
-                        self.progress_var.set(progress_percent)
-                        
-                        # Update the label
-                        self.progress_label.config(text=f"Processing: {current_file} ({processed_files}/{total_files})")
-                    
-                    # Check for saved messages
-                    elif "Saved" in line:
-                        # Update the label
-                        self.progress_label.config(text=f"Saved: {current_file} ({processed_files}/{total_files})")
-                    
-                    # Look for specific error indicators related to file operations
-                    elif "FileNotFoundError" in line or "Error" in line or "Traceback" in line or "Exception" in line:
-                        self.progress_label.config(text=f"Error detected: {line}")
-                    
-                    # Force update the UI
-                    self.root.update_idletasks()
-            
-            process.stdout.close()
-            return_code = process.wait()
-            
-            if return_code == 0:
-                self.progress_var.set(100)
-                self.progress_label.config(text=f"Conversion completed successfully! Converted {processed_files} files.")
-                self.status_var.set("Batch conversion completed successfully")
-                
-                # Make sure this message box is shown on the main thread
-                self.root.after(100, lambda: messagebox.showinfo("Batch Conversion Complete", 
-                                f"Batch conversion completed successfully!\n\nConverted {processed_files} files."))
-            else:
-                self.status_var.set(f"Batch conversion failed with return code {return_code}")
-                self.progress_label.config(text="Conversion failed!")
-                
-                # Create a dialog with text that can be selected and copied
-                def show_error_dialog():
-                    error_dialog = tk.Toplevel(self.root)
-                    error_dialog.title("Error Details")
-                    error_dialog.geometry("600x400")
-                    
-                    # Configure dialog with military theme colors
-                    error_dialog.configure(bg=self.colors['background'])
-                    
-                    # Add label at the top
-                    tk.Label(error_dialog, text=f"Batch conversion failed with return code {return_code}", 
-                            font=("TkDefaultFont", 10, "bold"), bg=self.colors['background'], fg=self.colors['foreground']).pack(pady=5)
-                    
-                    # Add text area with scrollbars
-                    text_frame = tk.Frame(error_dialog, bg=self.colors['background'])
-                    text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
-                    
-                    scrollbar_y = tk.Scrollbar(text_frame)
-                    scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
-                    
-                    scrollbar_x = tk.Scrollbar(text_frame, orient=tk.HORIZONTAL)
-                    scrollbar_x.pack(side=tk.BOTTOM, fill=tk.X)
-                    
-                    error_text = tk.Text(text_frame, wrap=tk.NONE, yscrollcommand=scrollbar_y.set, 
-                                        xscrollcommand=scrollbar_x.set, bg=self.colors['input_bg'], fg=self.colors['foreground'])
-                    error_text.pack(fill=tk.BOTH, expand=True)
-                    
-                    scrollbar_y.config(command=error_text.yview)
-                    scrollbar_x.config(command=error_text.xview)
-                    
-                    # Insert command and output
-                    error_text.insert(tk.END, "Command:\n")
-                    error_text.insert(tk.END, " ".join(str(c) for c in cmd) + "\n\n")
-                    error_text.insert(tk.END, "Output:\n")
-                    if output:
-                        error_text.insert(tk.END, "\n".join(output))
-                    else:
-                        error_text.insert(tk.END, "No output captured from command")
-                    
-                    # Make the text selectable but not editable
-                    error_text.config(state=tk.DISABLED)
-                    
-                    # Add a close button
-                    tk.Button(error_dialog, text="Close", command=error_dialog.destroy, 
-                            bg=self.colors['button_bg'], fg=self.colors['foreground']).pack(pady=10)
-                
-                # Show error dialog on the main thread
-                self.root.after(100, show_error_dialog)
-        except Exception as e:
-            self.status_var.set(f"Error: {str(e)}")
-            self.progress_label.config(text=f"Error: {str(e)}")
-            # Show error message on the main thread
-            self.root.after(100, lambda: messagebox.showerror("Error", f"Error during batch conversion: {str(e)}"))
+            for path, error, error_traceback in tracker.errors:
+                output.append(f"{path}: {error}")
+                if error_traceback:
+                    output.append(error_traceback)
+            self.show_batch_error_dialog(message, output)
+
+    def show_batch_error_dialog(self, message, output):
+        # Create a dialog with text that can be selected and copied
+        error_dialog = tk.Toplevel(self.root)
+        error_dialog.title("Error Details")
+        error_dialog.geometry("600x400")
+        
+        # Configure dialog with military theme colors
+        error_dialog.configure(bg=self.colors['background'])
+        
+        # Add label at the top
+        tk.Label(error_dialog, text=message, 
+                font=("TkDefaultFont", 10, "bold"), bg=self.colors['background'], fg=self.colors['foreground']).pack(pady=5)
+        
+        # Add text area with scrollbars
+        text_frame = tk.Frame(error_dialog, bg=self.colors['background'])
+        text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        scrollbar_y = tk.Scrollbar(text_frame)
+        scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        scrollbar_x = tk.Scrollbar(text_frame, orient=tk.HORIZONTAL)
+        scrollbar_x.pack(side=tk.BOTTOM, fill=tk.X)
+        
+        error_text = tk.Text(text_frame, wrap=tk.NONE, yscrollcommand=scrollbar_y.set, 
+                            xscrollcommand=scrollbar_x.set, bg=self.colors['input_bg'], fg=self.colors['foreground'])
+        error_text.pack(fill=tk.BOTH, expand=True)
+        
+        scrollbar_y.config(command=error_text.yview)
+        scrollbar_x.config(command=error_text.xview)
+        
+        # Insert the errors
+        error_text.insert(tk.END, "\n".join(output))
+        
+        # Make the text selectable but not editable
+        error_text.config(state=tk.DISABLED)
+        
+        # Add a close button
+        tk.Button(error_dialog, text="Close", command=error_dialog.destroy, 
+                bg=self.colors['button_bg'], fg=self.colors['foreground']).pack(pady=10)
 
 if __name__ == "__main__":
     root = tk.Tk()
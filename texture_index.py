@@ -0,0 +1,178 @@
+# Keeps the headers of many textures in numpy arrays, one array per header value, so that
+# questions about a whole game ("which P8 textures are larger than 256x256?") are answered
+# with a few vectorized comparisons instead of a loop over texture objects.
+#
+#   index = TextureIndex.from_folder("extracted/")
+#   big_p8 = index.filter(fmt="P8", min_width=256)
+#   print(len(big_p8), big_p8.paths)
+#   index.save("headers.npz")
+
+import os
+
+import numpy
+
+import bwtex
+
+# Column name and dtype. Strings use numpy's fixed width unicode arrays, the width is that of the longest value.
+COLUMNS = (
+    ("path", str),
+    ("game", str),
+    ("name", str),
+    ("fmt", str),
+    ("width", numpy.uint32),
+    ("height", numpy.uint32),
+    ("mipcount", numpy.uint32),
+    ("unkint2", numpy.uint32),
+    ("unkint3", numpy.uint32),
+    ("unkint4", numpy.uint32),
+    ("unkint5", numpy.uint32),
+    ("unkint6", numpy.uint32),
+    ("unkint7", numpy.uint32),
+)
+COLUMN_NAMES = tuple(name for name, dtype in COLUMNS)
+
+
+def read_header_from_path(path):
+    with open(path, "rb") as f:
+        return bwtex.read_texture_header(f)
+
+
+class TextureIndex(object):
+    """Texture headers stored column by column. Every column is a numpy array with one entry per
+    texture and is available as an attribute, e.g. index.width or index.fmt."""
+    def __init__(self, columns):
+        lengths = set(len(columns[name]) for name in COLUMN_NAMES)
+        if len(lengths) > 1:
+            raise ValueError("All columns need the same length, got {0}".format(sorted(lengths)))
+
+        for name, dtype in COLUMNS:
+            setattr(self, name, numpy.asarray(columns[name], dtype=dtype))
+
+    @classmethod
+    def from_headers(cls, paths, headers):
+        """Builds an index from the paths of textures and their TextureHeader."""
+        headers = list(headers)
+        columns = {"path": list(paths)}
+        for i, name in enumerate(bwtex.TextureHeader._fields):
+            columns[name] = [header[i] for header in headers]
+        return cls(columns)
+
+    @classmethod
+    def from_paths(cls, paths, errors=None):
+        """Reads the header of every texture file in paths. Files that aren't valid textures are
+        skipped and (path, error message) is appended to errors, or the error is raised if errors is None."""
+        found_paths = []
+        headers = []
+        for path in paths:
+            try:
+                header = read_header_from_path(path)
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.append((path, "{0}: {1}".format(type(e).__name__, e)))
+                continue
+            found_paths.append(path)
+            headers.append(header)
+        return cls.from_headers(found_paths, headers)
+
+    @classmethod
+    def from_folder(cls, folder, recursive=True, errors=None):
+        """from_paths for all .texture files in folder."""
+        paths = []
+        if recursive:
+            for dirpath, dirnames, filenames in os.walk(folder):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, fname) for fname in sorted(filenames) if fname.endswith(".texture"))
+        else:
+            paths = [os.path.join(folder, fname) for fname in sorted(os.listdir(folder)) if fname.endswith(".texture")]
+        return cls.from_paths(paths, errors)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index written by save."""
+        with numpy.load(path, allow_pickle=False) as data:
+            missing = [name for name in COLUMN_NAMES if name not in data]
+            if missing:
+                raise ValueError("{0} is not a texture index, it has no {1} column".format(path, ", ".join(missing)))
+            return cls({name: data[name] for name in COLUMN_NAMES})
+
+    def save(self, path):
+        """Writes all columns to path as a compressed .npz file."""
+        # numpy.savez adds .npz to paths without it, open the file ourselves so the name is kept
+        with open(path, "wb") as f:
+            numpy.savez_compressed(f, **self.columns)
+
+    @property
+    def columns(self):
+        return {name: getattr(self, name) for name in COLUMN_NAMES}
+
+    @property
+    def paths(self):
+        return self.path.tolist()
+
+    def __len__(self):
+        return len(self.path)
+
+    def __getitem__(self, selection):
+        """Index with a boolean mask, an array of positions or a slice to get a smaller TextureIndex."""
+        if isinstance(selection, (int, numpy.integer)):
+            raise TypeError("Use header(i) to get a single texture")
+        return TextureIndex({name: column[selection] for name, column in self.columns.items()})
+
+    def header(self, i):
+        """The TextureHeader of the i-th texture."""
+        return bwtex.TextureHeader(*(getattr(self, name)[i].item() for name in bwtex.TextureHeader._fields))
+
+    def __iter__(self):
+        """Yields the path and TextureHeader of every texture."""
+        for i in range(len(self)):
+            yield self.path[i].item(), self.header(i)
+
+    def mask(self, game=None, fmt=None, min_width=None, max_width=None, min_height=None, max_height=None,
+             mipcount=None, min_mipcount=None, **values):
+        """Boolean array that is True for the textures matching all given conditions.
+        game, fmt, mipcount and the header values unkint2 to unkint7 passed as keywords match a
+        single value or any value of a list. -1 matches 0xFFFFFFFF like in header strings."""
+        result = numpy.ones(len(self), dtype=bool)
+
+        def matches(column, wanted):
+            if isinstance(wanted, (list, tuple, set, frozenset, numpy.ndarray)):
+                return numpy.isin(column, list(wanted))
+            return column == wanted
+
+        if game is not None:
+            result &= matches(self.game, game)
+        if fmt is not None:
+            result &= matches(self.fmt, fmt)
+        if min_width is not None:
+            result &= self.width >= min_width
+        if max_width is not None:
+            result &= self.width <= max_width
+        if min_height is not None:
+            result &= self.height >= min_height
+        if max_height is not None:
+            result &= self.height <= max_height
+        if mipcount is not None:
+            result &= matches(self.mipcount, mipcount)
+        if min_mipcount is not None:
+            result &= self.mipcount >= min_mipcount
+
+        for name, wanted in values.items():
+            if name not in ("unkint2", "unkint3", "unkint4", "unkint5", "unkint6", "unkint7"):
+                raise TypeError("Unknown filter: {0}".format(name))
+            if isinstance(wanted, (list, tuple, set, frozenset)):
+                wanted = [0xFFFFFFFF if value == -1 else value for value in wanted]
+            elif wanted == -1:
+                wanted = 0xFFFFFFFF
+            result &= matches(getattr(self, name), wanted)
+
+        return result
+
+    def filter(self, **conditions):
+        """The textures matching all conditions as a new TextureIndex, see mask."""
+        return self[self.mask(**conditions)]
+
+    def count_by(self, name):
+        """Number of textures for each value of a column, as a dict sorted by value."""
+        values, counts = numpy.unique(getattr(self, name), return_counts=True)
+        return {value.item(): int(count) for value, count in zip(values, counts)}
@@ -0,0 +1,145 @@
+import os
+import queue
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+import bwtex
+
+THUMBNAIL_SIZE = 96
+
+# Bump this when thumbnails are made differently so old cache entries aren't used anymore
+CACHE_VERSION = 1
+CACHE_DIR_ENV_VAR = "BWTEX_THUMBNAIL_CACHE"
+
+
+def get_default_cache_dir():
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+    if cache_dir:
+        return cache_dir
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "bw_texture_converter", "thumbnails")
+
+
+def fit_image(img, max_width, max_height):
+    """Scales img down to fit into max_width x max_height, keeping the aspect ratio"""
+    width, height = img.size
+
+    if width > max_width or height > max_height:
+        # Calculate new size maintaining aspect ratio
+        ratio = min(max_width / width, max_height / height)
+        new_width = max(int(width * ratio), 1)
+        new_height = max(int(height * ratio), 1)
+        img = img.resize((new_width, new_height), Image.LANCZOS)
+    return img
+
+
+def load_fitted_image(input_file, max_width, max_height, game_version="bw2"):
+    """Loads a PNG or texture scaled to fit into max_width x max_height. For textures only the
+    smallest mipmap that still fills the box is decoded. game_version is only used if it
+    can't be detected from the texture header."""
+    if input_file.lower().endswith('.texture'):
+        with open(input_file, "rb") as f:
+            game = bwtex.sniff_game(f.read(bwtex.SNIFF_SIZE)) or game_version
+            f.seek(0)
+            tex = bwtex.read_texture(f, game, decode_mipmaps=False)
+        img = tex.decode_mipmap(tex.get_mipmap_index_for_size(max_width, max_height))
+    else:
+        img = Image.open(input_file)
+        img.load()
+    return fit_image(img, max_width, max_height)
+
+
+class ThumbnailCache(object):
+    """Thumbnails stored as PNGs, keyed by the path, modification time and size of the file"""
+    def __init__(self, cache_dir=None, size=THUMBNAIL_SIZE):
+        if cache_dir is None:
+            cache_dir = get_default_cache_dir()
+        self.cache_dir = cache_dir
+        self.size = size
+
+    def get_cache_path(self, path):
+        stat = os.stat(path)
+        key = "{0}|{1}|{2}|{3}|{4}".format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, self.size, CACHE_VERSION)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name+".png")
+
+    def load(self, path):
+        try:
+            img = Image.open(self.get_cache_path(path))
+            img.load()
+        except OSError:
+            return None
+        return img
+
+    def store(self, path, img):
+        cache_path = self.get_cache_path(path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temporary file first so other processes never see half written thumbnails
+        temp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+        img.save(temp_path, "PNG")
+        os.replace(temp_path, cache_path)
+
+
+def make_thumbnail(path, game_version, size, cache_dir):
+    """Runs in the worker processes of ThumbnailLoader. Returns the mode, size and pixels of the thumbnail."""
+    img = load_fitted_image(path, size, size, game_version).convert("RGBA")
+    ThumbnailCache(cache_dir, size).store(path, img)
+    return img.mode, img.size, img.tobytes()
+
+
+class ThumbnailLoader(object):
+    """Makes thumbnails of a list of files in the background. Cached thumbnails are loaded first,
+    the others are decoded in a pool of worker processes. Every finished thumbnail is put into
+    self.results as (index, path, image, error), followed by None when all are done."""
+    def __init__(self, paths, game_version="bw2", size=THUMBNAIL_SIZE, cache_dir=None, workers=None):
+        self.paths = paths
+        self.game_version = game_version
+        self.cache = ThumbnailCache(cache_dir, size)
+        self.workers = workers
+        self.results = queue.Queue()
+        self.cancelled = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            missing = []
+            for index, path in enumerate(self.paths):
+                if self.cancelled:
+                    return
+                img = self.cache.load(path)
+                if img is not None:
+                    self.results.put((index, path, img, None))
+                else:
+                    missing.append((index, path))
+
+            if not missing:
+                return
+
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {}
+                for index, path in missing:
+                    future = pool.submit(make_thumbnail, path, self.game_version, self.cache.size, self.cache.cache_dir)
+                    futures[future] = (index, path)
+
+                for future in as_completed(futures):
+                    if self.cancelled:
+                        for other in futures:
+                            other.cancel()
+                        return
+                    index, path = futures[future]
+                    try:
+                        mode, size, pixels = future.result()
+                        self.results.put((index, path, Image.frombytes(mode, size, pixels), None))
+                    except Exception as e:
+                        self.results.put((index, path, None, e))
+        finally:
+            self.results.put(None)